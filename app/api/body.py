@@ -0,0 +1,107 @@
+from typing import AsyncIterator, Tuple, Optional
+from fastapi import Request, HTTPException
+from app.core.compression import DecompressionError, create_decompressor
+
+
+def _body_too_large(max_bytes: int) -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"Request body exceeds the limit of {max_bytes} bytes"
+    )
+
+
+def _content_encoding(request: Request) -> str:
+    return request.headers.get("content-encoding", "").strip().lower() or "identity"
+
+
+def _declared_length(request: Request) -> Optional[int]:
+    value = request.headers.get("content-length")
+    return int(value) if value and value.isdigit() else None
+
+
+def content_length(request: Request) -> Optional[int]:
+    """The declared size of the document in the request body, if any, which is unknown when it is compressed"""
+    if _content_encoding(request) != "identity":
+        return None
+    return _declared_length(request)
+
+
+def _check_content_length(request: Request, max_bytes: int):
+    """Reject a request up front when its declared size is above the limit"""
+    declared = _declared_length(request)
+    if declared is not None and declared > max_bytes:
+        raise _body_too_large(max_bytes)
+
+
+def _stream(request: Request) -> AsyncIterator[bytes]:
+    """
+    The chunks of the request body, decompressed while they are read when the body is sent with a
+    Content-Encoding of gzip, deflate or zstd
+    """
+    encoding = _content_encoding(request)
+    if encoding == "identity":
+        return request.stream()
+    try:
+        decompressor = create_decompressor(encoding)
+    except ValueError:
+        raise HTTPException(status_code=415, detail=f"Unsupported Content-Encoding: {encoding}")
+    return _decompressed(request.stream(), decompressor)
+
+
+async def _decompressed(chunks: AsyncIterator[bytes], decompressor) -> AsyncIterator[bytes]:
+    try:
+        async for chunk in chunks:
+            for piece in decompressor.decompress(chunk):
+                yield piece
+        for piece in decompressor.finish():
+            yield piece
+    except DecompressionError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid compressed request body: {str(e)}")
+
+
+async def read_body(request: Request, max_bytes: int) -> bytes:
+    """
+    Read the whole request body into memory, enforcing max_bytes while reading.
+    A compressed body is decompressed, with max_bytes applying to the decompressed document.
+    """
+    _check_content_length(request, max_bytes)
+    body = bytearray()
+    async for chunk in _stream(request):
+        if len(body) + len(chunk) > max_bytes:
+            raise _body_too_large(max_bytes)
+        body += chunk
+    return bytes(body)
+
+
+async def peek_body(request: Request, peek_bytes: int, max_bytes: int) -> Tuple[bytes, AsyncIterator[bytes]]:
+    """
+    Read only the first peek_bytes (or a little more, depending on how the body arrives) of the request body.
+
+    Returns the peeked prefix and an iterator over the complete body, which yields the prefix followed by the
+    rest of the incoming stream chunk by chunk. max_bytes is enforced while the body is streamed.
+    A compressed body is decompressed, with max_bytes applying to the decompressed document.
+    """
+    _check_content_length(request, max_bytes)
+    incoming = _stream(request).__aiter__()
+    head = bytearray()
+    while len(head) < peek_bytes:
+        try:
+            head += await incoming.__anext__()
+        except StopAsyncIteration:
+            break
+    head = bytes(head)
+    if len(head) > max_bytes:
+        raise _body_too_large(max_bytes)
+
+    async def body() -> AsyncIterator[bytes]:
+        received = len(head)
+        if head:
+            yield head
+        async for chunk in incoming:
+            received += len(chunk)
+            if received > max_bytes:
+                raise _body_too_large(max_bytes)
+            if chunk:
+                yield chunk
+
+    return head, body()
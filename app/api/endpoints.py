@@ -1,48 +1,440 @@
-from fastapi import APIRouter, Depends, Request, Header, HTTPException
-from app.core.security import validate_api_key
-from app.services.tika import TikaService
-from app.api.models import DocumentProcessingResponse, DocumentResponse
+import asyncio
+import json
+import time
+from typing import AsyncIterator, List, Optional, Tuple, Union
+from pydantic import TypeAdapter
+from fastapi import APIRouter, Depends, Request, Response, Header, HTTPException, File, UploadFile, Query
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from app.config import settings
+from app.core.security import get_tenant, validate_api_key
+from app.api.body import read_body, peek_body, content_length
+from app.services.tika import Extraction, StreamedExtraction, TikaService
+from app.services.converters import CONVERTERS
+from app.services.jobs import Job, JobInput, JobManager
+from app.services.limiter import PRIORITIES, classify
+from app.api.models import DocumentProcessingResponse, DocumentResponse, BatchDocumentResponse, JobResponse
+from app.core.logs import log_event
+from app.core.metrics import BODY_BYTES, STAGE_SECONDS, mime_label
 
 router = APIRouter()
 
+_DOCUMENT_LIST = TypeAdapter(List[DocumentResponse])
+
+
+def get_tika_service(request: Request) -> TikaService:
+    """The TikaService shared by all requests, created in the application lifespan"""
+    return request.app.state.tika_service
+
+
+def get_job_manager(request: Request) -> JobManager:
+    """The JobManager shared by all requests, created in the application lifespan when jobs are enabled"""
+    job_manager = getattr(request.app.state, "job_manager", None)
+    if job_manager is None:
+        raise HTTPException(status_code=404, detail="Jobs are not enabled")
+    return job_manager
+
+
+def get_converter_name(x_converter: str = Header(None, alias="X-Converter")) -> Optional[str]:
+    """The converter engine requested with the X-Converter header, if any"""
+    if x_converter is not None and x_converter not in CONVERTERS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown converter {x_converter}, must be one of {', '.join(CONVERTERS)}"
+        )
+    return x_converter
+
+
+# Ways the response of /process can be split into a list of documents. "pages" and "documents" respond with the
+# documents the document was extracted to: "pages" names the parts of a split PDF, "documents" also fits the
+# embedded documents of a container. "chunks" splits their text into chunks following its Markdown structure.
+SPLITS = ("pages", "documents", "chunks")
+
+
+def get_split(
+        x_split: str = Header(None, alias="X-Split"),
+        split: str = Query(None, description="How the response is split, like the X-Split header")
+) -> Optional[str]:
+    """
+    How the response is split into a list of documents, as requested with the X-Split header or the split query
+    parameter, if at all
+    """
+    split = x_split or split
+    if split is not None and split not in SPLITS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown split {split}, must be one of {', '.join(SPLITS)}"
+        )
+    return split
+
+
+def get_chunking(
+        x_chunk_size: int = Header(None, alias="X-Chunk-Size", ge=1),
+        x_chunk_overlap: int = Header(None, alias="X-Chunk-Overlap", ge=0),
+        chunk_size: int = Query(None, ge=1, description="Characters per chunk, like the X-Chunk-Size header"),
+        chunk_overlap: int = Query(None, ge=0, description="Characters of overlap, like the X-Chunk-Overlap header")
+) -> Tuple[int, int]:
+    """
+    The size and overlap of the chunks of "X-Split: chunks", as requested with headers or query parameters,
+    by default CHUNK_SIZE and CHUNK_OVERLAP
+    """
+    size = x_chunk_size or chunk_size or settings.CHUNK_SIZE
+    overlap = next(
+        (value for value in (x_chunk_overlap, chunk_overlap) if value is not None),
+        min(settings.CHUNK_OVERLAP, size - 1)
+    )
+    if overlap >= size:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Chunk overlap {overlap} must be smaller than the chunk size {size}"
+        )
+    return size, overlap
+
+
+def get_priority(x_priority: str = Header(None, alias="X-Priority")) -> Optional[str]:
+    """The priority requested with the X-Priority header, if any"""
+    if x_priority is not None and x_priority not in PRIORITIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown priority {x_priority}, must be one of {', '.join(PRIORITIES)}"
+        )
+    return x_priority
+
+
+def _should_stream(size: Optional[int], split: Optional[str]) -> bool:
+    """Whether the response to a document of size bytes, None when unknown, is streamed"""
+    return (
+        settings.STREAM_RESPONSES
+        and split is None
+        and (size is None or size >= settings.STREAM_RESPONSES_MIN_BYTES)
+    )
+
+
+async def _stream_response(streamed: StreamedExtraction) -> AsyncIterator[bytes]:
+    """
+    The JSON of a DocumentProcessingResponse, with the text written into page_content piece by piece
+    """
+    try:
+        yield b'{"success":true,"content":{"page_content":"'
+        async for text in streamed.chunks:
+            # The JSON string of the piece without its quotes
+            yield json.dumps(text, ensure_ascii=False)[1:-1].encode()
+        yield b'","metadata":' + json.dumps(streamed.metadata, ensure_ascii=False).encode() + b'}}'
+    finally:
+        await streamed.close()
+
 
 @router.put(
     "/process",
-    response_model=DocumentProcessingResponse,
+    response_model=Union[DocumentProcessingResponse, List[DocumentResponse]],
     dependencies=[Depends(validate_api_key)],
     tags=["Document Processing"]
 )
 async def process_document(
         request: Request,
         content_type: str = Header(None),
-        x_filename: str = Header(None, alias="X-Filename")
-) -> DocumentProcessingResponse:
+        x_filename: str = Header(None, alias="X-Filename"),
+        converter: Optional[str] = Depends(get_converter_name),
+        split: Optional[str] = Depends(get_split),
+        chunking: Tuple[int, int] = Depends(get_chunking),
+        priority: Optional[str] = Depends(get_priority),
+        tenant: str = Depends(get_tenant),
+        tika_service: TikaService = Depends(get_tika_service)
+) -> Response:
     """
     Process a document using Tika service.
     Automatically detects MIME type if not provided.
+    With "X-Split: pages" or "X-Split: documents" the response is a list with one document per part of a split PDF,
+    with the page range of the part in its metadata, or one for a container and each document embedded in it,
+    or a list of the one document when the document was not split.
+    With "X-Split: chunks" the response is a list of chunks of the text of at most X-Chunk-Size characters,
+    following its headings and paragraphs, with their offsets and heading in their metadata.
+    The split and chunking can also be requested with the split, chunk_size and chunk_overlap query parameters.
+    Large documents are streamed back while they are extracted when STREAM_RESPONSES is enabled.
+    The document waits for Tika in the fair queue of the tenant of the API key, with the priority requested with
+    the X-Priority header, or high priority when it is small.
     """
-    tika_service = TikaService()
-
-    # Get the raw content from the request body
-    content = await request.body()
+    started = time.perf_counter()
+    if settings.STREAM_UPLOADS:
+        # Only hold back the start of the body for MIME detection and stream the rest to Tika
+        content, body = await peek_body(request, settings.MIME_SNIFF_BYTES, settings.MAX_BODY_BYTES)
+    else:
+        # Get the raw content from the request body
+        content = await read_body(request, settings.MAX_BODY_BYTES)
 
     if not content:
         raise HTTPException(
             status_code=400,
             detail="No content provided - request body is empty"
         )
+    STAGE_SECONDS.observe_since(started, "body_read", "", mime_label(content_type))
+    size = content_length(request) if settings.STREAM_UPLOADS else len(content)
+    if size is not None:
+        BODY_BYTES.observe(size)
+    flow = classify(tenant, priority, size)
+
+    if _should_stream(size, split):
+        streamed = await tika_service.extract_streaming(
+            head=content,
+            file_content=body if settings.STREAM_UPLOADS else content,
+            filename=x_filename,
+            provided_mime_type=content_type,
+            size=content_length(request),
+            converter=converter,
+            flow=flow
+        )
+        headers = {}
+        if streamed.cache:
+            headers["X-Cache"] = streamed.cache.upper()
+        if streamed.cache_tier:
+            headers["X-Cache-Tier"] = streamed.cache_tier
+        # The extraction is closed by the stream, and by the background task when the stream is never started
+        return StreamingResponse(
+            _stream_response(streamed),
+            media_type="application/json",
+            headers=headers,
+            background=BackgroundTask(streamed.close)
+        )
 
     # Process document
-    text, metadata = await tika_service.process_document(
-        file_content=content,
+    extraction = await tika_service.extract(
+        head=content,
+        file_content=body if settings.STREAM_UPLOADS else content,
         filename=x_filename,
-        provided_mime_type=content_type
+        provided_mime_type=content_type,
+        size=content_length(request),
+        converter=converter,
+        flow=flow
+    )
+
+    headers = {}
+    if extraction.cache:
+        headers["X-Cache"] = extraction.cache.upper()
+    if extraction.cache_tier:
+        headers["X-Cache-Tier"] = extraction.cache_tier
+    if extraction.coalesced:
+        headers["X-Coalesced"] = "true"
+
+    documents = extraction.documents
+    if split == "chunks":
+        documents = await tika_service.chunk(documents, *chunking)
+
+    # The response is serialized here, rather than by FastAPI, so the time it takes is measured
+    started = time.perf_counter()
+    if split is not None:
+        content = _DOCUMENT_LIST.dump_json([
+            DocumentResponse(page_content=text, metadata=metadata) for text, metadata in documents
+        ])
+    else:
+        content = DocumentProcessingResponse(
+            success=True,
+            content=DocumentResponse(
+                page_content=extraction.text,
+                metadata=extraction.metadata
+            )
+        ).model_dump_json().encode()
+    STAGE_SECONDS.observe_since(started, "serialization", "", mime_label(extraction.metadata.get("Content-Type")))
+    return Response(content, media_type="application/json", headers=headers)
+
+
+@router.post(
+    "/process/batch",
+    response_model=List[BatchDocumentResponse],
+    dependencies=[Depends(validate_api_key)],
+    tags=["Document Processing"]
+)
+async def process_batch(
+        request: Request,
+        files: List[UploadFile] = File(...),
+        converter: Optional[str] = Depends(get_converter_name),
+        priority: Optional[str] = Depends(get_priority),
+        tenant: str = Depends(get_tenant),
+        tika_service: TikaService = Depends(get_tika_service)
+):
+    """
+    Process many documents, uploaded as multipart/form-data files, in one request.
+    The documents are processed concurrently, at most BATCH_MAX_PARALLEL at a time, and the response lists one
+    document per file, in the order of the files, with its own success or error.
+    With "Accept: application/x-ndjson" each document is instead streamed back as a JSON line as soon as it
+    is processed.
+    The documents have low priority unless another one is requested with the X-Priority header.
+    """
+    if len(files) > settings.BATCH_MAX_DOCUMENTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many documents in batch, at most {settings.BATCH_MAX_DOCUMENTS} are allowed"
+        )
+
+    parallel = asyncio.Semaphore(settings.BATCH_MAX_PARALLEL)
+    flow = classify(tenant, priority, bulk=True)
+
+    async def process(index: int, file: UploadFile) -> BatchDocumentResponse:
+        # Each document is logged as an event of its own, carrying the request id of the batch
+        with log_event("Processed batch document", index=index) as event:
+            document = await process_file(index, file)
+            event.fields["status"] = document.status_code or 200
+            return document
+
+    async def process_file(index: int, file: UploadFile) -> BatchDocumentResponse:
+        async with parallel:
+            try:
+                if file.size is not None and file.size > settings.MAX_BODY_BYTES:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"Document exceeds the limit of {settings.MAX_BODY_BYTES} bytes"
+                    )
+                content = await file.read()
+                BODY_BYTES.observe(len(content))
+                if not content:
+                    raise HTTPException(status_code=400, detail="No content provided - document is empty")
+                # Multipart clients send application/octet-stream when they do not know the type
+                mime_type = file.content_type if file.content_type != "application/octet-stream" else None
+                extraction = await tika_service.extract(
+                    head=content,
+                    file_content=content,
+                    filename=file.filename,
+                    provided_mime_type=mime_type,
+                    converter=converter,
+                    flow=flow
+                )
+                return BatchDocumentResponse(
+                    index=index,
+                    filename=file.filename,
+                    success=True,
+                    page_content=extraction.text,
+                    metadata=extraction.metadata
+                )
+            except HTTPException as e:
+                return BatchDocumentResponse(
+                    index=index,
+                    filename=file.filename,
+                    success=False,
+                    page_content="",
+                    metadata={},
+                    status_code=e.status_code,
+                    error=str(e.detail)
+                )
+
+    tasks = [asyncio.create_task(process(index, file)) for index, file in enumerate(files)]
+
+    if "application/x-ndjson" in request.headers.get("accept", ""):
+        async def stream_results():
+            try:
+                for next_done in asyncio.as_completed(tasks):
+                    document = await next_done
+                    yield document.model_dump_json() + "\n"
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+        return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+    return await asyncio.gather(*tasks)
+
+
+def _job_response(job: Job) -> JobResponse:
+    response = JobResponse(
+        job_id=job.id,
+        status=job.status,
+        filename=job.filename,
+        created=job.created,
+        started=job.started,
+        finished=job.finished,
+        status_code=job.status_code,
+        error=job.error
     )
+    if job.documents is not None:
+        if job.split is not None:
+            response.documents = [
+                DocumentResponse(page_content=text, metadata=metadata) for text, metadata in job.documents
+            ]
+        else:
+            extraction = Extraction(job.documents)
+            response.content = DocumentResponse(page_content=extraction.text, metadata=extraction.metadata)
+    return response
+
 
-    return DocumentProcessingResponse(
-        success=True,
-        content=DocumentResponse(
-            page_content=text,
-            metadata=metadata
+@router.post(
+    "/jobs",
+    response_model=JobResponse,
+    status_code=202,
+    dependencies=[Depends(validate_api_key)],
+    tags=["Jobs"]
+)
+async def submit_job(
+        request: Request,
+        response: Response,
+        content_type: str = Header(None),
+        x_filename: str = Header(None, alias="X-Filename"),
+        converter: Optional[str] = Depends(get_converter_name),
+        split: Optional[str] = Depends(get_split),
+        chunking: Tuple[int, int] = Depends(get_chunking),
+        priority: Optional[str] = Depends(get_priority),
+        tenant: str = Depends(get_tenant),
+        job_manager: JobManager = Depends(get_job_manager)
+):
+    """
+    Submit a document, sent like to /process, to be processed in the background.
+    Responds right away with the job, whose status and result are then polled at /jobs/{job_id}.
+    Jobs have low priority unless another one is requested with the X-Priority header, and are only visible to
+    the tenant which submitted them.
+    """
+    content = await read_body(request, settings.MAX_BODY_BYTES)
+    if not content:
+        raise HTTPException(
+            status_code=400,
+            detail="No content provided - request body is empty"
         )
+    BODY_BYTES.observe(len(content))
+    flow = classify(tenant, priority, bulk=True)
+    document = JobInput(
+        content, x_filename, content_type, converter, flow, chunking=chunking if split == "chunks" else None
     )
+    job = await job_manager.submit(document, split)
+    response.headers["Location"] = str(request.url_for("get_job", job_id=job.id).path)
+    return _job_response(job)
+
+
+@router.get(
+    "/jobs/{job_id}",
+    response_model=JobResponse,
+    dependencies=[Depends(validate_api_key)],
+    tags=["Jobs"]
+)
+async def get_job(
+        job_id: str,
+        wait: float = Query(0, ge=0, description="Seconds to wait for the job to finish"),
+        tenant: str = Depends(get_tenant),
+        job_manager: JobManager = Depends(get_job_manager)
+):
+    """
+    The status of a job, with its result once it has succeeded or its error once it has failed.
+    With wait, the request is held until the job finishes or up to JOBS_MAX_WAIT_SECONDS.
+    """
+    # Only the tenant of a job may wait on it
+    job = await job_manager.get(job_id)
+    if job is None or job.tenant != tenant:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    if wait and not job.done:
+        job = await job_manager.get(job_id, min(wait, settings.JOBS_MAX_WAIT_SECONDS))
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return _job_response(job)
+
+
+@router.delete(
+    "/jobs/{job_id}",
+    status_code=204,
+    dependencies=[Depends(validate_api_key)],
+    tags=["Jobs"]
+)
+async def delete_job(
+        job_id: str,
+        tenant: str = Depends(get_tenant),
+        job_manager: JobManager = Depends(get_job_manager)
+):
+    """Delete a job and its result, cancelling it when it has not finished"""
+    job = await job_manager.get(job_id)
+    if job is None or job.tenant != tenant or not await job_manager.delete(job_id):
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return Response(status_code=204)
@@ -1,18 +1,60 @@
 from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
+
+class BackendHealth(BaseModel):
+    name: str
+    healthy: bool
+    # Circuit breaker state: closed, open or half_open
+    state: str = "closed"
+    in_flight: int
+    latency_ms: Optional[float] = None
+    consecutive_failures: int
+    # Result of the last background probe: when it was done, as a Unix timestamp, its latency and Tika's version
+    probed_at: Optional[float] = None
+    probe_latency_ms: Optional[float] = None
+    version: Optional[str] = None
 
 class HealthResponse(BaseModel):
     status: str
     service: str
+    # When the backends were last probed, as a Unix timestamp
+    checked_at: Optional[float] = None
+    backends: List[BackendHealth] = []
+
+class ProbeResponse(BaseModel):
+    status: str
 
 class DocumentResponse(BaseModel):
     page_content: str
     metadata: Dict[str, Any]
 
+class BatchDocumentResponse(DocumentResponse):
+    # Position of the document in the batch
+    index: int
+    filename: Optional[str] = None
+    success: bool
+    status_code: Optional[int] = None
+    error: Optional[str] = None
+
 class DocumentProcessingResponse(BaseModel):
     success: bool
     content: DocumentResponse
 
+class JobResponse(BaseModel):
+    job_id: str
+    # "queued", "running", "succeeded" or "failed"
+    status: str
+    filename: Optional[str] = None
+    # Unix timestamps
+    created: float
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    # The document of a succeeded job, or its list of documents when it was submitted with X-Split
+    content: Optional[DocumentResponse] = None
+    documents: Optional[List[DocumentResponse]] = None
+    status_code: Optional[int] = None
+    error: Optional[str] = None
+
 # Not used at this point
 # TODO: Check if used by end of vibe coding
 class TikaError(BaseModel):
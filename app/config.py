@@ -1,4 +1,6 @@
+from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
+from typing import Dict, List, Literal
 from urllib.parse import urlparse, urlunparse
 from loguru import logger
 
@@ -7,16 +9,211 @@ class Settings(BaseSettings):
 
     APP_NAME: str = "Document Ingestion Router"
 
+    # Serving with python -m app.server: WORKERS processes, 0 for one per CPU, forked from a parent which loads
+    # the application once. The workers share the admission limits and Tika health, and the cache and jobs through
+    # SQLite databases in a temporary directory, unless CACHE_SQLITE_PATH and JOBS_SQLITE_PATH give them a
+    # persistent location on local disk.
+    HOST: str = "0.0.0.0"
+    PORT: int = 8000
+    WORKERS: int = Field(1, ge=0)
+
     API_KEY: str
+    # Named API keys of tenants, as comma separated name:key pairs, besides API_KEY of the "default" tenant
+    API_KEYS: str = ""
 
+    # One or more comma separated Tika servers
     TIKA_BASE_URL: str
     TIKA_USER: str
     TIKA_PASSWORD: str
 
+    # Connection pool and timeouts of the shared HTTP client used for all Tika calls
+    TIKA_MAX_CONNECTIONS: int = 100
+    TIKA_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    TIKA_KEEPALIVE_EXPIRY: float = 30.0
+    TIKA_CONNECT_TIMEOUT: float = 10.0
+    TIKA_READ_TIMEOUT: float = 300.0
+    TIKA_WRITE_TIMEOUT: float = 60.0
+    TIKA_POOL_TIMEOUT: float = 30.0
+    # The read and write timeouts grow by these many seconds per MiB of the document, up to TIKA_MAX_TIMEOUT,
+    # so that a large document gets more time to be parsed than a small one
+    TIKA_READ_TIMEOUT_PER_MB: float = 5.0
+    TIKA_WRITE_TIMEOUT_PER_MB: float = 1.0
+    TIKA_MAX_TIMEOUT: float = 1800.0
+
+    # A backend is ejected for TIKA_EJECT_SECONDS after this many consecutive failures or a failed probe
+    TIKA_FAILURE_THRESHOLD: int = 3
+    TIKA_EJECT_SECONDS: float = 30.0
+    # Number of times a document is sent after connection errors and 502, 503 or 504 responses, preferring
+    # backends not tried yet, with an exponential backoff with full jitter of TIKA_RETRY_BACKOFF seconds
+    # doubling up to TIKA_RETRY_BACKOFF_MAX in between
+    TIKA_MAX_ATTEMPTS: int = 2
+    TIKA_RETRY_BACKOFF: float = 0.2
+    TIKA_RETRY_BACKOFF_MAX: float = 5.0
+
+    # Admission control: documents and bytes parsed by Tika at a time, and how many documents may wait
+    # for how long (seconds) before they are rejected with Retry-After
+    TIKA_MAX_IN_FLIGHT: int = 16
+    TIKA_MAX_IN_FLIGHT_BYTES: int = 512 * 1024 * 1024
+    TIKA_QUEUE_SIZE: int = 100
+    TIKA_QUEUE_TIMEOUT: float = 120.0
+    RETRY_AFTER_SECONDS: int = 5
+    # Documents waiting for admission are scheduled fairly across tenants and priorities, in proportion to
+    # the weight of their tenant, given as comma separated name=weight pairs (default 1), times the weight of
+    # their priority. The priority is high, normal or low as requested with the X-Priority header, otherwise
+    # high for documents up to PRIORITY_SMALL_BYTES, low for batches and jobs and normal for the rest.
+    # At most TIKA_TENANT_QUEUE_SIZE documents of one tenant may wait, 0 for no limit besides TIKA_QUEUE_SIZE.
+    TENANT_WEIGHTS: str = ""
+    PRIORITY_WEIGHTS: str = "high=8,normal=2,low=1"
+    PRIORITY_SMALL_BYTES: int = 1024 * 1024
+    TIKA_TENANT_QUEUE_SIZE: int = 0
+
+    # Conversion of Tika HTML output to markdown runs in a "process" or "thread" pool,
+    # except for documents up to CONVERSION_INLINE_MAX_BYTES, which take under about 1 ms and are converted inline
+    CONVERSION_POOL: Literal["process", "thread"] = "process"
+    CONVERSION_WORKERS: int = 4
+    CONVERSION_INLINE_MAX_BYTES: int = 512
+    # Engine converting Tika HTML output to markdown: "html2text", or "xhtml" which converts while the
+    # output arrives from Tika. Can be chosen per request with the X-Converter header.
+    CONVERTER: Literal["html2text", "xhtml"] = "html2text"
+
+    # Upper limit on the size of uploaded documents, after decompressing uploads sent with a Content-Encoding
+    # of gzip, deflate or zstd
+    MAX_BODY_BYTES: int = 512 * 1024 * 1024
+    # When enabled, uploads are forwarded to Tika while they are received instead of being buffered in memory.
+    # Only the first MIME_SNIFF_BYTES are held back to detect the MIME type.
+    STREAM_UPLOADS: bool = False
+    MIME_SNIFF_BYTES: int = 8 * 1024
+    # libmagic, the most expensive tier of MIME detection, only looks at this many bytes of a document
+    MIME_MAGIC_BYTES: int = 64 * 1024
+
+    # Batch processing: documents allowed in one batch and how many of them are processed at a time
+    BATCH_MAX_DOCUMENTS: int = 500
+    BATCH_MAX_PARALLEL: int = 8
+
+    # Cache of extraction results keyed by a hash of the document and how it is routed.
+    # The in-memory tier is bounded by entries and bytes, the optional SQLite tier survives restarts.
+    CACHE_ENABLED: bool = True
+    CACHE_TTL_SECONDS: float = 24 * 60 * 60
+    CACHE_MAX_ENTRIES: int = 1000
+    CACHE_MAX_BYTES: int = 128 * 1024 * 1024
+    CACHE_SQLITE_PATH: str = ""
+    CACHE_SQLITE_MAX_BYTES: int = 2 * 1024 * 1024 * 1024
+
+    # Concurrent requests for the same document share one in-flight Tika call
+    COALESCE_REQUESTS: bool = True
+
+    # Large PDFs are split into parts of PDF_SPLIT_PAGES pages, which are extracted in parallel across the Tika
+    # backends and joined in page order. Only PDFs of at least PDF_SPLIT_MIN_BYTES are opened to count their
+    # pages and only those with at least PDF_SPLIT_MIN_PAGES pages are split. Needs pypdf.
+    PDF_SPLIT_ENABLED: bool = False
+    PDF_SPLIT_MIN_BYTES: int = 5 * 1024 * 1024
+    PDF_SPLIT_MIN_PAGES: int = 100
+    PDF_SPLIT_PAGES: int = Field(50, ge=1)
+
+    # Asynchronous jobs: documents submitted to /api/v1/jobs are processed by JOBS_WORKERS workers in the
+    # background. At most JOBS_MAX_QUEUED documents, of at most JOBS_MAX_QUEUED_BYTES in total, wait to be
+    # processed. Finished jobs are kept for JOBS_TTL_SECONDS and the oldest are evicted above JOBS_MAX_RESULT_BYTES
+    # of results. With JOBS_SQLITE_PATH jobs are kept in a SQLite database instead of in memory.
+    # Long polls wait at most JOBS_MAX_WAIT_SECONDS for a job to finish.
+    JOBS_ENABLED: bool = True
+    JOBS_WORKERS: int = Field(4, ge=1)
+    JOBS_MAX_QUEUED: int = 100
+    JOBS_MAX_QUEUED_BYTES: int = 1024 * 1024 * 1024
+    JOBS_TTL_SECONDS: float = 60 * 60
+    JOBS_MAX_RESULT_BYTES: int = 256 * 1024 * 1024
+    JOBS_SQLITE_PATH: str = ""
+    JOBS_MAX_WAIT_SECONDS: float = 60.0
+
+    # Stream the text of documents of at least STREAM_RESPONSES_MIN_BYTES, or of unknown size, into the JSON
+    # response while Tika's response arrives, instead of holding the whole response and text in memory.
+    # Streamed extractions are not stored in the cache, coalesced or split.
+    STREAM_RESPONSES: bool = False
+    STREAM_RESPONSES_MIN_BYTES: int = 8 * 1024 * 1024
+
+    # Responses of at least COMPRESS_RESPONSES_MIN_BYTES are compressed with zstd or gzip as accepted by the client,
+    # streamed responses always are. Documents of compressible types of at least TIKA_COMPRESS_MIN_BYTES are sent
+    # to Tika gzip compressed when TIKA_COMPRESS_REQUESTS is enabled, for Tika servers accepting such bodies.
+    COMPRESS_RESPONSES: bool = True
+    COMPRESS_RESPONSES_MIN_BYTES: int = 1024
+    TIKA_COMPRESS_REQUESTS: bool = False
+    TIKA_COMPRESS_MIN_BYTES: int = 64 * 1024
+
+    # Container documents of RMETA_MIME_TYPES, such as archives and emails, are extracted with Tika's recursive
+    # metadata endpoint into one document per embedded document, whose XHTML is converted in parallel
+    RMETA_ENABLED: bool = False
+    RMETA_MIME_TYPES: str = (
+        "application/zip,application/x-tar,application/gzip,application/x-7z-compressed,application/vnd.rar,"
+        "application/x-rar-compressed,message/rfc822,application/vnd.ms-outlook,application/mbox"
+    )
+
+    # Chunks the text of documents is split into with "X-Split: chunks", of at most CHUNK_SIZE characters,
+    # overlapping by up to CHUNK_OVERLAP characters. Can be chosen per request with the X-Chunk-Size and
+    # X-Chunk-Overlap headers.
+    CHUNK_SIZE: int = Field(1000, ge=1)
+    CHUNK_OVERLAP: int = Field(100, ge=0)
+
+    # JSON file of the routing table: rules mapping MIME types and size ranges to a Tika endpoint with extra Tika
+    # headers and a converter, or to local passthrough of text. Documents no rule matches are routed by default.
+    ROUTING_TABLE: str = ""
+
+    # Tika backends are probed in the background every HEALTH_PROBE_INTERVAL seconds, 0 to disable, and the
+    # health endpoints are answered from the results. The service is not ready while the last probe round is
+    # more than HEALTH_STALE_SECONDS old.
+    HEALTH_PROBE_INTERVAL: float = 10.0
+    HEALTH_PROBE_TIMEOUT: float = 5.0
+    HEALTH_STALE_SECONDS: float = 60.0
+
+    # Logging: one structured event per request, written to stderr through a queue, as text or as JSON lines.
+    # A preview of the start of LOG_PREVIEW_SAMPLE_RATE of the documents, at most LOG_PREVIEW_BYTES of them,
+    # is added to the events of documents which look like text.
+    LOG_LEVEL: str = "INFO"
+    LOG_JSON: bool = False
+    LOG_PREVIEW_SAMPLE_RATE: float = Field(0.0, ge=0, le=1)
+    LOG_PREVIEW_BYTES: int = 256
+
+    # Expose request, stage latency and load metrics in the Prometheus text format at /metrics
+    METRICS_ENABLED: bool = True
+
+    @property
+    def tenants_by_key(self) -> Dict[str, str]:
+        """The tenant names of API_KEY and the keys listed in API_KEYS, by key"""
+        tenants = {self.API_KEY: "default"}
+        for pair in self.API_KEYS.split(","):
+            name, _, key = pair.strip().partition(":")
+            if name and key:
+                tenants[key] = name
+        return tenants
+
+    @property
+    def tenant_weights(self) -> Dict[str, float]:
+        return _weights(self.TENANT_WEIGHTS)
+
+    @property
+    def priority_weights(self) -> Dict[str, float]:
+        return {"high": 1.0, "normal": 1.0, "low": 1.0, **_weights(self.PRIORITY_WEIGHTS)}
+
+    @property
+    def rmeta_mime_types(self) -> List[str]:
+        """The MIME types listed in RMETA_MIME_TYPES"""
+        return [mime_type.strip().lower() for mime_type in self.RMETA_MIME_TYPES.split(",") if mime_type.strip()]
+
+    @property
+    def tika_base_urls(self) -> List[str]:
+        """The Tika servers listed in TIKA_BASE_URL"""
+        return [url.strip() for url in self.TIKA_BASE_URL.split(",") if url.strip()]
+
     @property
     def tika_url_with_auth(self) -> str:
-        """Constructs Tika URL with authentication credentials"""
-        parsed = urlparse(self.TIKA_BASE_URL)
+        """Constructs Tika URL of the first Tika server with authentication credentials"""
+        return self.tika_urls_with_auth[0]
+
+    @property
+    def tika_urls_with_auth(self) -> List[str]:
+        """Constructs Tika URLs with authentication credentials"""
+        return [self._with_auth(url) for url in self.tika_base_urls]
+
+    def _with_auth(self, url: str) -> str:
+        parsed = urlparse(url)
         netloc = f"{self.TIKA_USER}:{self.TIKA_PASSWORD}@{parsed.netloc}"
         return urlunparse((
             parsed.scheme,
@@ -27,5 +224,15 @@ class Settings(BaseSettings):
             parsed.fragment
         ))
 
+
+def _weights(value: str) -> Dict[str, float]:
+    """Weights given as comma separated name=weight pairs"""
+    weights = {}
+    for pair in value.split(","):
+        name, _, weight = pair.strip().partition("=")
+        if name and weight:
+            weights[name] = float(weight)
+    return weights
+
 settings = Settings()
-logger.info(f"Loaded settings: {settings.model_dump(exclude=['API_KEY', 'TIKA_PASSWORD'])}")
\ No newline at end of file
+logger.info(f"Loaded settings: {settings.model_dump(exclude=['API_KEY', 'API_KEYS', 'TIKA_PASSWORD'])}")
\ No newline at end of file
@@ -0,0 +1,250 @@
+# Compression of request and response bodies with gzip, or zstd when the zstandard package is installed.
+
+import asyncio
+import zlib
+from typing import Iterator, Optional
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - zstd support is optional
+    zstandard = None
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+# Largest piece of output a decompressor produces at a time, which bounds the memory a decompression bomb takes
+# before the size limit stops it
+DECOMPRESS_PIECE_BYTES = 1024 * 1024
+# Input fed to a zstd decompressor at a time, which bounds its output as its output can not be limited directly
+_ZSTD_INPUT_BYTES = 1024
+# Bodies compressed at once in a worker thread rather than on the event loop
+_THREAD_BYTES = 1024 * 1024
+
+# Types which compress well, besides text/* and types with a +json or +xml suffix
+COMPRESSIBLE_MIME_TYPES = {
+    "application/json",
+    "application/x-ndjson",
+    "application/xml",
+    "application/javascript",
+    "application/rtf",
+    "application/postscript",
+    "application/msword",
+    "application/vnd.ms-excel",
+    "application/vnd.ms-powerpoint",
+}
+
+
+class DecompressionError(ValueError):
+    pass
+
+
+def encodings() -> tuple:
+    """The content encodings supported, in order of preference"""
+    return ("zstd", "gzip") if zstandard is not None else ("gzip",)
+
+
+def compressible(mime_type: Optional[str]) -> bool:
+    """Whether documents or responses of the MIME type are worth compressing"""
+    if not mime_type:
+        return False
+    mime_type = mime_type.split(";", 1)[0].strip().lower()
+    return (
+        mime_type.startswith("text/")
+        or mime_type in COMPRESSIBLE_MIME_TYPES
+        or mime_type.endswith("+json")
+        or mime_type.endswith("+xml")
+    )
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """The preferred supported encoding accepted by an Accept-Encoding header, if any"""
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for item in accept_encoding.split(","):
+        coding, _, parameters = item.strip().lower().partition(";")
+        quality = 1.0
+        name, _, value = parameters.strip().partition("=")
+        if name.strip() == "q":
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip()] = quality
+    for encoding in encodings():
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+class _ZlibDecompressor:
+    def __init__(self):
+        # Automatic detection of the gzip or zlib header, for gzip and deflate
+        self._decompressor = zlib.decompressobj(32 + zlib.MAX_WBITS)
+
+    def decompress(self, data: bytes) -> Iterator[bytes]:
+        try:
+            while True:
+                piece = self._decompressor.decompress(data, DECOMPRESS_PIECE_BYTES)
+                data = self._decompressor.unconsumed_tail
+                if piece:
+                    yield piece
+                if not data and len(piece) < DECOMPRESS_PIECE_BYTES:
+                    break
+        except zlib.error as e:
+            raise DecompressionError(str(e)) from e
+
+    def finish(self) -> Iterator[bytes]:
+        yield from self.decompress(b"")
+        if not self._decompressor.eof:
+            raise DecompressionError("Compressed data ended early")
+
+
+class _ZstdDecompressor:
+    def __init__(self):
+        self._decompressor = zstandard.ZstdDecompressor().decompressobj()
+
+    def decompress(self, data: bytes) -> Iterator[bytes]:
+        try:
+            for start in range(0, len(data), _ZSTD_INPUT_BYTES):
+                piece = self._decompressor.decompress(data[start:start + _ZSTD_INPUT_BYTES])
+                if piece:
+                    yield piece
+        except zstandard.ZstdError as e:
+            raise DecompressionError(str(e)) from e
+
+    def finish(self) -> Iterator[bytes]:
+        if not getattr(self._decompressor, "eof", True):
+            raise DecompressionError("Compressed data ended early")
+        return iter(())
+
+
+def create_decompressor(encoding: str):
+    """
+    A decompressor of a body in the content encoding, whose decompress yields the output of each chunk of the
+    body in pieces of bounded size and whose finish checks that the body was complete.
+    Raises ValueError for an unsupported encoding.
+    """
+    if encoding in ("gzip", "x-gzip", "deflate"):
+        return _ZlibDecompressor()
+    if encoding == "zstd" and zstandard is not None:
+        return _ZstdDecompressor()
+    raise ValueError(f"Unsupported content encoding: {encoding}")
+
+
+class _GzipCompressor:
+    def __init__(self, level: int = GZIP_LEVEL):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        """The output so far, so that it can be decompressed without waiting for more"""
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class _ZstdCompressor:
+    def __init__(self, level: int = ZSTD_LEVEL):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+def create_compressor(encoding: str):
+    """A streaming compressor of the content encoding, gzip or zstd"""
+    return _ZstdCompressor() if encoding == "zstd" else _GzipCompressor()
+
+
+def compress(encoding: str, data: bytes) -> bytes:
+    compressor = create_compressor(encoding)
+    return compressor.compress(data) + compressor.finish()
+
+
+async def compress_async(encoding: str, data: bytes) -> bytes:
+    """Compress data, in a worker thread when it is large to keep the event loop free"""
+    if len(data) > _THREAD_BYTES:
+        return await asyncio.to_thread(compress, encoding, data)
+    return compress(encoding, data)
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware compressing responses of compressible types with the encoding preferred by Accept-Encoding.
+    Complete responses are compressed when they are at least minimum_size large, while streamed responses are
+    always compressed, with each chunk flushed so that the client can decode it right away.
+    """
+    def __init__(self, app, minimum_size: int = 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        compressor = None
+
+        async def send_compressed(message):
+            nonlocal start, compressor
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                if start is not None:
+                    await send(start)
+                    start = None
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if start is not None:
+                # The first part of the body decides whether the response is compressed
+                response_start, start = start, None
+                headers = MutableHeaders(raw=list(response_start["headers"]))
+                if (
+                        "content-encoding" in headers
+                        or not compressible(headers.get("content-type"))
+                        or (not more_body and len(body) < self.minimum_size)
+                ):
+                    await send(response_start)
+                    await send(message)
+                    return
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if not more_body:
+                    body = await compress_async(encoding, body)
+                    headers["Content-Length"] = str(len(body))
+                    response_start["headers"] = headers.raw
+                    await send(response_start)
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                if "content-length" in headers:
+                    del headers["Content-Length"]
+                response_start["headers"] = headers.raw
+                compressor = create_compressor(encoding)
+                await send(response_start)
+
+            if compressor is None:
+                await send(message)
+                return
+            body = compressor.compress(body) + (compressor.flush() if more_body else compressor.finish())
+            await send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
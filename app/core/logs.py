@@ -0,0 +1,141 @@
+# Structured log events of requests.
+# Each HTTP request, and each document of a batch or job, gets one event which is filled in while it is processed
+# and logged once when it ends, with its request id, the size, MIME type and Tika endpoint of the document and the
+# time spent in each stage. The event of the current request is held in a context variable, so that tasks and
+# threads started while processing it add to the same event.
+
+import random
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional
+from loguru import logger
+from app.config import settings
+
+# Paths of the health and metrics endpoints, which are polled often and only logged at DEBUG level
+QUIET_PATHS = ("/health", "/health/live", "/health/ready", "/metrics")
+
+_current_event: ContextVar[Optional["LogEvent"]] = ContextVar("log_event", default=None)
+_handler_id: Optional[int] = None
+
+
+def configure_logging(enqueue: bool = True):
+    """
+    Log to stderr through a queue, so that writing the log never blocks the event loop, as text or as JSON lines
+    when LOG_JSON is enabled. Without enqueue no thread is started, for a process which forks workers.
+    """
+    global _handler_id
+    if _handler_id is None:
+        logger.remove()
+    else:
+        logger.remove(_handler_id)
+    _handler_id = logger.add(sys.stderr, level=settings.LOG_LEVEL, serialize=settings.LOG_JSON, enqueue=enqueue)
+
+
+class LogEvent:
+    """The structured log event of a request or document"""
+    def __init__(self, request_id: str, **fields: Any):
+        self.request_id = request_id
+        self.fields: Dict[str, Any] = fields
+        # Seconds spent in each stage, summed over the stage's occurrences
+        self.stages: Dict[str, float] = {}
+        self.started = time.perf_counter()
+
+    def render(self, message: str) -> str:
+        """The message followed by the fields as key=value pairs"""
+        fields = " ".join(f"{key}={value}" for key, value in self.fields.items() if value is not None)
+        return f"{message} {fields}" if fields else message
+
+
+@contextmanager
+def log_event(message: str, request_id: str = None, level: str = "INFO", **fields: Any) -> Iterator[LogEvent]:
+    """
+    Collect the log event of a request or document while the context runs, and log it with message when it ends.
+    Log records written in the context carry the request id, which is inherited from an enclosing event when
+    none is given.
+    """
+    parent = _current_event.get()
+    if request_id is None:
+        request_id = parent.request_id if parent is not None else uuid.uuid4().hex
+    event = LogEvent(request_id, **fields)
+    token = _current_event.set(event)
+    try:
+        with logger.contextualize(request_id=request_id):
+            yield event
+    finally:
+        _current_event.reset(token)
+        event.fields["duration_ms"] = round((time.perf_counter() - event.started) * 1000, 1)
+        if event.stages:
+            event.fields["stages_ms"] = {stage: round(seconds * 1000, 1) for stage, seconds in event.stages.items()}
+        logger.bind(request_id=request_id, **event.fields).log(level, event.render(message))
+
+
+def annotate(**fields: Any):
+    """Add fields to the log event of the current request, if any"""
+    event = _current_event.get()
+    if event is not None:
+        event.fields.update(fields)
+
+
+def record_stage(stage: str, seconds: float):
+    """Add the time spent in a stage to the log event of the current request, if any"""
+    event = _current_event.get()
+    if event is not None:
+        event.stages[stage] = event.stages.get(stage, 0.0) + seconds
+
+
+def content_preview(head: bytes) -> Optional[str]:
+    """
+    A preview of the start of a document for a sample of LOG_PREVIEW_SAMPLE_RATE of the documents, or None.
+    Only the first LOG_PREVIEW_BYTES are decoded, and documents which do not look like text are not previewed.
+    """
+    if settings.LOG_PREVIEW_SAMPLE_RATE <= 0 or random.random() >= settings.LOG_PREVIEW_SAMPLE_RATE:
+        return None
+    text = head[:settings.LOG_PREVIEW_BYTES].decode("utf-8", "replace")
+    unprintable = sum(1 for char in text if char == "\ufffd" or not (char.isprintable() or char in "\r\n\t"))
+    if not text or unprintable > len(text) // 10:
+        return None
+    return repr(text)
+
+
+class RequestLogMiddleware:
+    """
+    ASGI middleware logging one structured event per HTTP request, with the request id from the X-Request-ID
+    header or a new one, which is returned in the X-Request-ID header of the response
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                # Bounded and printable, as it is written to the log
+                request_id = value.decode("latin-1")[:64]
+                if not request_id.isprintable():
+                    request_id = None
+                break
+        request_id = request_id or uuid.uuid4().hex
+        path = scope["path"]
+        level = "DEBUG" if path in QUIET_PATHS else "INFO"
+
+        with log_event(f"{scope['method']} {path}", request_id, level) as event:
+            async def send_with_request_id(message):
+                if message["type"] == "http.response.start":
+                    event.fields["status"] = message["status"]
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"x-request-id", request_id.encode("latin-1"))
+                    ]
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_request_id)
+            except BaseException:
+                event.fields.setdefault("status", 500)
+                raise
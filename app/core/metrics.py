@@ -0,0 +1,280 @@
+# Minimal in-process metrics in the Prometheus text exposition format.
+# https://prometheus.io/docs/instrumenting/exposition_formats/
+# Metrics are only updated from the event loop, so no locking is needed and an update costs a dict lookup.
+
+import asyncio
+import mimetypes
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+from app.core.logs import record_stage
+
+LabelValues = Tuple[str, ...]
+
+# Latency buckets in seconds, from a fast MIME sniff to a long Tika parse
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# Size buckets in bytes, from 1 KiB to 512 MiB
+SIZE_BUCKETS = tuple(1024 * 4 ** exponent for exponent in range(10))
+
+# MIME types used as label values. Other types, which clients may send freely, are reported as "other"
+# to keep the number of time series bounded.
+_KNOWN_MIME_TYPES = set(mimetypes.types_map.values()) | {"application/octet-stream"}
+
+
+def mime_label(mime_type: Optional[str]) -> str:
+    """The MIME type as a bounded label value"""
+    if not mime_type:
+        return ""
+    mime_type = mime_type.split(";", 1)[0].strip().lower()
+    return mime_type if mime_type in _KNOWN_MIME_TYPES else "other"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    kind: str
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def samples(self) -> Iterable[Tuple[str, Sequence[str], Sequence[str], float]]:
+        """The samples of the metric as name suffix, label names, label values and value"""
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, names, values, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(names, values)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        for labels, value in self._values.items():
+            yield "", self.labelnames, labels, value
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value: float, *labels: str):
+        self._values[labels] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label values: the count of observations in each bucket, not cumulated, with +Inf last, and their sum
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *labels: str):
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+        counts, total = entry
+        counts[bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def observe_since(self, started: float, *labels: str):
+        """Observe the seconds since started, a time.perf_counter value"""
+        self.observe(time.perf_counter() - started, *labels)
+
+    def count(self, *labels: str) -> int:
+        entry = self._values.get(labels)
+        return sum(entry[0]) if entry is not None else 0
+
+    def samples(self):
+        names = self.labelnames + ("le",)
+        for labels, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield "_bucket", names, labels + (_format_value(bound),), cumulative
+            yield "_sum", self.labelnames, labels, total[0]
+            yield "_count", self.labelnames, labels, cumulative
+
+
+class StageHistogram(Histogram):
+    """A histogram of stage durations, labelled by stage first, which also adds them to the current log event"""
+
+    def observe(self, value: float, *labels: str):
+        super().observe(value, *labels)
+        record_stage(labels[0], value)
+
+
+class CollectedMetric(Metric):
+    """A gauge or counter whose samples are read from the state of a component when metrics are rendered"""
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            kind: str,
+            collect: Callable[[], Iterable[Tuple[LabelValues, float]]],
+            labelnames: Sequence[str] = ()
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.kind = kind
+        self.collect = collect
+
+    def samples(self):
+        for labels, value in self.collect():
+            yield "", self.labelnames, labels, value
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        """Register a metric, replacing any earlier metric of the same name"""
+        self._metrics[metric.name] = metric
+        return metric
+
+    def collected(
+            self,
+            name: str,
+            documentation: str,
+            collect: Callable[[], Iterable[Tuple[LabelValues, float]]],
+            labelnames: Sequence[str] = (),
+            kind: str = "gauge"
+    ):
+        self.register(CollectedMetric(name, documentation, kind, collect, labelnames))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.register(Counter(
+    "router_requests_total", "HTTP requests by method, handler and status code", ["method", "handler", "status"]
+))
+REQUEST_ERRORS = REGISTRY.register(Counter(
+    "router_request_errors_total", "HTTP requests answered with a 4xx or 5xx status code", ["handler", "status"]
+))
+REQUESTS_IN_FLIGHT = REGISTRY.register(Gauge(
+    "router_requests_in_flight", "HTTP requests being processed"
+))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "router_request_duration_seconds", "Time to answer HTTP requests by method and handler", ["method", "handler"]
+))
+BODY_BYTES = REGISTRY.register(Histogram(
+    "router_request_body_bytes", "Size of uploaded documents", buckets=SIZE_BUCKETS
+))
+# Stages: body_read, mime_detection, passthrough, queue (waiting for admission), compression (of documents sent to
+# Tika compressed), tika (round-trip including streaming conversion), conversion, pdf_split, chunking and
+# serialization
+STAGE_SECONDS = REGISTRY.register(StageHistogram(
+    "router_stage_duration_seconds",
+    "Time spent in each stage of processing a document, by Tika endpoint and MIME type",
+    ["stage", "endpoint", "mime_type"]
+))
+MIME_DETECTIONS = REGISTRY.register(Counter(
+    "router_mime_detections_total",
+    "MIME type detections by the tier which decided them: client, signature, text, libmagic, filename or fallback",
+    ["tier"]
+))
+CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "router_cache_lookups_total", "Extraction cache lookups by result, hit or miss, and tier of hits", ["result", "tier"]
+))
+TIKA_RESPONSES = REGISTRY.register(Counter(
+    "router_tika_responses_total", "Responses of Tika backends by endpoint and status code, or error",
+    ["backend", "endpoint", "status"]
+))
+
+EVENT_LOOP_LAG = REGISTRY.register(Histogram(
+    "router_event_loop_lag_seconds", "How late timers fire on the event loop, sampled periodically",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+))
+EVENT_LOOP_LAG_MAX = REGISTRY.register(Gauge(
+    "router_event_loop_lag_max_seconds", "Largest event loop lag seen"
+))
+
+
+async def monitor_event_loop_lag(interval: float = 0.1):
+    """
+    Sleep for interval seconds at a time and record how much later than asked the loop woke up.
+    Lag shows work blocking the event loop, which delays every request in flight.
+    """
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(0.0, time.perf_counter() - started - interval)
+        EVENT_LOOP_LAG.observe(lag)
+        if lag > EVENT_LOOP_LAG_MAX.value():
+            EVENT_LOOP_LAG_MAX.set(lag)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware counting HTTP requests, their status codes and latency, by the handler of the route they matched
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            # The name of the endpoint function rather than the path keeps the number of time series bounded
+            handler = getattr(scope.get("endpoint"), "__name__", "unmatched")
+            method = scope["method"]
+            REQUESTS.inc(method, handler, str(status))
+            if status >= 400:
+                REQUEST_ERRORS.inc(handler, str(status))
+            REQUEST_SECONDS.observe_since(started, method, handler)
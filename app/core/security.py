@@ -2,7 +2,7 @@
 # https://fastapi.tiangolo.com/reference/security/?h=apikeyheader#fastapi.security.APIKeyHeader--usage
 # For more advance use maybe start out by looking to https://fastapi.tiangolo.com/tutorial/security/
 
-from fastapi import Security, HTTPException, status
+from fastapi import Depends, Security, HTTPException, status
 from fastapi.security import APIKeyHeader
 from app.config import settings
 
@@ -25,10 +25,15 @@ async def validate_api_key(api_key: str = Security(api_key_header)) -> str:
 
     token = api_key.replace("Bearer ", "")
 
-    if token != settings.API_KEY:
+    if token not in settings.tenants_by_key:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid API key"
         )
 
     return token
+
+
+async def get_tenant(token: str = Depends(validate_api_key)) -> str:
+    """The name of the tenant whose API key authenticated the request, "default" for API_KEY"""
+    return settings.tenants_by_key[token]
@@ -1,31 +1,192 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi import FastAPI, Depends, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from app.config import settings
-from app.services.tika import TikaService
-from app.api.models import HealthResponse
-from app.api.endpoints import router as api_router
+from app.services.tika import TikaService, create_http_client
+from app.services.cache import create_extraction_cache
+from app.services.singleflight import SingleFlight
+from app.services.limiter import create_limiter
+from app.services.converters import create_conversion_pool
+from app.services.jobs import JobManager, create_job_manager
+from app.services.health import HealthMonitor, create_health_monitor
+from app.api.models import HealthResponse, ProbeResponse
+from app.api.endpoints import router as api_router, get_tika_service
+from app.core.metrics import REGISTRY, MetricsMiddleware, monitor_event_loop_lag
+from app.core.logs import RequestLogMiddleware, configure_logging
+from app.core.compression import CompressionMiddleware
 from loguru import logger
 
+configure_logging()
+
+
+def register_service_metrics(tika_service: TikaService):
+    """Expose the load of the Tika backends, the admission queue, coalescing and the cache as metrics"""
+    backends = tika_service.backends.backends
+    REGISTRY.collected(
+        "router_tika_in_flight", "Documents being parsed by each Tika backend",
+        lambda: [((backend.name,), backend.in_flight) for backend in backends], ["backend"]
+    )
+    REGISTRY.collected(
+        "router_tika_in_flight_bytes", "Bytes of documents being parsed by each Tika backend",
+        lambda: [((backend.name,), backend.in_flight_bytes) for backend in backends], ["backend"]
+    )
+    REGISTRY.collected(
+        "router_tika_backend_healthy", "Whether each Tika backend is healthy, 1, or ejected, 0",
+        lambda: [((backend.name,), int(not backend.ejected)) for backend in backends], ["backend"]
+    )
+    limiter = tika_service.limiter
+    if limiter is not None:
+        REGISTRY.collected(
+            "router_admission_in_flight", "Documents admitted to Tika", lambda: [((), limiter.in_flight)]
+        )
+        REGISTRY.collected(
+            "router_admission_queued", "Documents waiting to be admitted to Tika", lambda: [((), limiter.queued)]
+        )
+        REGISTRY.collected(
+            "router_admission_queued_by_tenant", "Documents of each tenant waiting to be admitted to Tika",
+            lambda: [((tenant,), queued) for tenant, queued in limiter.queued_by_tenant().items()], ["tenant"]
+        )
+        REGISTRY.collected(
+            "router_admission_rejected_total", "Documents rejected by admission control",
+            lambda: [((), limiter.rejected)], kind="counter"
+        )
+    singleflight = tika_service.singleflight
+    if singleflight is not None:
+        REGISTRY.collected(
+            "router_coalesce_in_flight", "Distinct extractions in flight", lambda: [((), singleflight.in_flight)]
+        )
+        REGISTRY.collected(
+            "router_coalesced_total", "Requests which shared an identical in-flight extraction",
+            lambda: [((), singleflight.coalesced)], kind="counter"
+        )
+    cache = tika_service.cache
+    if cache is not None:
+        REGISTRY.collected(
+            "router_cache_entries", "Entries in the in-memory extraction cache", lambda: [((), len(cache.memory))]
+        )
+        REGISTRY.collected(
+            "router_cache_bytes", "Size of the in-memory extraction cache", lambda: [((), cache.memory.size)]
+        )
+
+
+def register_job_metrics(job_manager: JobManager):
+    """Expose the jobs waiting for and being processed by the workers as metrics"""
+    REGISTRY.collected("router_jobs_queued", "Jobs waiting to be processed", lambda: [((), job_manager.queued)])
+    REGISTRY.collected("router_jobs_running", "Jobs being processed", lambda: [((), job_manager.running)])
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    conversion_pool = create_conversion_pool()
+    try:
+        # One pooled HTTP client is shared by all requests for the lifetime of the application
+        async with create_http_client() as client:
+            app.state.tika_service = TikaService(
+                client,
+                cache=create_extraction_cache(),
+                singleflight=SingleFlight() if settings.COALESCE_REQUESTS else None,
+                limiter=create_limiter(),
+                conversion_pool=conversion_pool
+            )
+            app.state.health_monitor = create_health_monitor(app.state.tika_service.backends, client)
+            if app.state.health_monitor is not None:
+                app.state.health_monitor.start()
+            app.state.job_manager = None
+            if settings.JOBS_ENABLED:
+                app.state.job_manager = create_job_manager(app.state.tika_service)
+                app.state.job_manager.start()
+            lag_monitor = None
+            if settings.METRICS_ENABLED:
+                register_service_metrics(app.state.tika_service)
+                if app.state.job_manager is not None:
+                    register_job_metrics(app.state.job_manager)
+                lag_monitor = asyncio.create_task(monitor_event_loop_lag())
+            try:
+                yield
+            finally:
+                if lag_monitor is not None:
+                    lag_monitor.cancel()
+                if app.state.job_manager is not None:
+                    await app.state.job_manager.close()
+                if app.state.health_monitor is not None:
+                    await app.state.health_monitor.close()
+    finally:
+        conversion_pool.shutdown()
+        # Flush the log queue
+        await logger.complete()
+
 
 app = FastAPI(
     title=settings.APP_NAME,
     description="A service to route document loading requests to appropriate Tika endpoints",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
-# Public endpoints (no auth required)
+if settings.COMPRESS_RESPONSES:
+    app.add_middleware(CompressionMiddleware, minimum_size=settings.COMPRESS_RESPONSES_MIN_BYTES)
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+app.add_middleware(RequestLogMiddleware)
+
+def get_health_monitor(request: Request) -> Optional[HealthMonitor]:
+    """The HealthMonitor probing Tika in the background, or None when probing is disabled"""
+    return request.app.state.health_monitor
+
+
+# Public endpoints (no auth required). The health endpoints never call Tika: they are answered from the circuit
+# breakers of the backends and the results of the background probes.
 @app.get("/health", tags=["Health"], response_model=HealthResponse)
-async def health_check():
-    tika_service = TikaService()
-    tika_available = await tika_service.is_available()
+async def health_check(
+        tika_service: TikaService = Depends(get_tika_service),
+        health_monitor: Optional[HealthMonitor] = Depends(get_health_monitor)
+):
+    tika_available = tika_service.backends.available
+    backends = tika_service.backends.health()
+    checked_at = health_monitor.checked_at if health_monitor is not None else None
 
     if not tika_available:
-        raise HTTPException(status_code=503, detail="Tika service is not available")
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "Tika service is not available", "checked_at": checked_at, "backends": backends}
+        )
 
-    logger.info(f"A health check was requested. Tika service, and service {settings.APP_NAME} is up and running.")
+    logger.debug(f"A health check was requested. Tika service, and service {settings.APP_NAME} is up and running.")
     return {
         "status": "healthy",
-        "service": settings.APP_NAME
+        "service": settings.APP_NAME,
+        "checked_at": checked_at,
+        "backends": backends
     }
 
+
+@app.get("/health/live", tags=["Health"], response_model=ProbeResponse)
+async def liveness():
+    """Whether the service is running, regardless of Tika"""
+    return {"status": "alive"}
+
+
+@app.get("/health/ready", tags=["Health"], response_model=ProbeResponse)
+async def readiness(
+        tika_service: TikaService = Depends(get_tika_service),
+        health_monitor: Optional[HealthMonitor] = Depends(get_health_monitor)
+):
+    """Whether the service can take documents: Tika has been probed recently and a backend is available"""
+    if health_monitor is not None:
+        ready = health_monitor.ready
+    else:
+        ready = tika_service.backends.available
+    if not ready:
+        return JSONResponse(status_code=503, content={"detail": "Tika service is not available"})
+    return {"status": "ready"}
+
+if settings.METRICS_ENABLED:
+    @app.get("/metrics", tags=["Health"], response_class=PlainTextResponse)
+    async def metrics():
+        """Metrics in the Prometheus text exposition format"""
+        return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 # Include the API router
 app.include_router(api_router, prefix="/api/v1")
@@ -0,0 +1,191 @@
+"""
+Production server, on Linux:
+
+    python -m app.server
+
+Serves the application on HOST:PORT with WORKERS uvicorn worker processes, 0 for one per CPU. The parent process
+imports the application and loads libmagic once, then forks the workers, which share that memory copy-on-write
+and accept connections on one listening socket. Workers which exit are restarted. Admission limits and the health
+of the Tika backends are shared by the workers, see app.services.shared. So are the extraction cache and jobs, in
+SQLite databases in a temporary directory unless CACHE_SQLITE_PATH and JOBS_SQLITE_PATH are set.
+With one worker the application is served in this process.
+"""
+import gc
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+from typing import Dict, Optional
+import uvicorn
+from loguru import logger
+from app.config import settings
+from app.core.logs import configure_logging
+from app.services.shared import SharedState, create_shared_state
+
+# Exit status of a worker whose application failed to start, which stops the server rather than restarting it
+STARTUP_FAILURE = 3
+# Seconds before a worker which exited is restarted, so a worker which keeps crashing does not spin
+RESTART_DELAY = 1.0
+
+
+def worker_count() -> int:
+    return settings.WORKERS or os.cpu_count() or 1
+
+
+def preload():
+    """Import the application and load libmagic, which the workers would otherwise each do on their own"""
+    started = time.perf_counter()
+    from app.main import app
+    from app.services.mime import load_magic
+    load_magic()
+    logger.info(f"Loaded the application in {time.perf_counter() - started:.2f} seconds")
+    return app
+
+
+def share_stores() -> Optional[str]:
+    """
+    Keep the extraction cache and jobs in SQLite databases which the workers share, in a temporary directory,
+    unless they are configured. Otherwise each worker would only find the jobs submitted to it. Returns the
+    directory to remove when the server stops, if any.
+    """
+    if settings.CACHE_SQLITE_PATH and settings.JOBS_SQLITE_PATH:
+        return None
+    directory = tempfile.mkdtemp(prefix="document-router-")
+    if not settings.CACHE_SQLITE_PATH:
+        settings.CACHE_SQLITE_PATH = os.path.join(directory, "extraction_cache.sqlite")
+    if not settings.JOBS_SQLITE_PATH:
+        settings.JOBS_SQLITE_PATH = os.path.join(directory, "jobs.db")
+    logger.info(f"Sharing the cache and jobs of the workers in {directory}, which is removed when the server stops")
+    return directory
+
+
+def bind(host: str, port: int) -> socket.socket:
+    """The listening socket the workers accept connections on"""
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+class _Server(uvicorn.Server):
+    """A uvicorn server which logs how long it took to start serving"""
+
+    def __init__(self, config: uvicorn.Config):
+        super().__init__(config)
+        self.created = time.perf_counter()
+
+    async def startup(self, sockets=None):
+        await super().startup(sockets=sockets)
+        if self.started:
+            logger.info(f"Worker {os.getpid()} started in {(time.perf_counter() - self.created) * 1000:.0f} ms")
+
+
+def serve(app, sock: Optional[socket.socket] = None) -> int:
+    """Run the application with uvicorn in this process until it is stopped, returning the exit status"""
+    # Requests are logged by RequestLogMiddleware
+    server = _Server(uvicorn.Config(app, host=settings.HOST, port=settings.PORT, access_log=False))
+    server.run(sockets=[sock] if sock is not None else None)
+    return 0 if server.started else STARTUP_FAILURE
+
+
+class Supervisor:
+    """Forks the workers and restarts those which exit, until it is stopped by SIGTERM or SIGINT"""
+
+    def __init__(self, app, sock: socket.socket, workers: int, shared: SharedState):
+        self.app = app
+        self.sock = sock
+        self.workers = workers
+        self.shared = shared
+        # Index of the worker of each process
+        self.children: Dict[int, int] = {}
+        self.stopping = False
+
+    def spawn(self, worker: int):
+        pid = os.fork()
+        if pid:
+            self.children[pid] = worker
+            return
+        status = 1
+        try:
+            # Signals reach the workers through the supervisor only, so that each gets one and shuts down gracefully
+            os.setpgid(0, 0)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            configure_logging()
+            self.shared.worker = worker
+            status = serve(self.app, self.sock)
+        except BaseException:
+            logger.exception(f"Worker {worker} failed")
+        finally:
+            os._exit(status)
+
+    def stop(self, signum=None, frame=None):
+        self.stopping = True
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self) -> int:
+        """Run the workers until they have all exited, returning the exit status of the server"""
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for worker in range(self.workers):
+            self.spawn(worker)
+        status = 0
+        while self.children:
+            try:
+                pid, wait_status = os.wait()
+            except ChildProcessError:
+                break
+            worker = self.children.pop(pid, None)
+            if worker is None:
+                continue
+            # Documents the worker had admitted to Tika are no longer in flight
+            self.shared.reset_worker(worker)
+            if self.stopping:
+                continue
+            code = os.waitstatus_to_exitcode(wait_status)
+            if code == STARTUP_FAILURE:
+                logger.error(f"Worker {worker} failed to start, stopping the server")
+                status = STARTUP_FAILURE
+                self.stop()
+                continue
+            logger.warning(f"Worker {worker} (pid {pid}) exited with status {code}, restarting it")
+            time.sleep(RESTART_DELAY)
+            if not self.stopping:
+                self.spawn(worker)
+        return status
+
+
+def main():
+    workers = worker_count()
+    if workers == 1:
+        sys.exit(serve(preload()))
+
+    app = preload()
+    # No thread may run while workers are forked, so the supervisor logs directly
+    configure_logging(enqueue=False)
+    directory = share_stores()
+    sock = bind(settings.HOST, settings.PORT)
+    supervisor = Supervisor(app, sock, workers, create_shared_state(workers, len(settings.tika_base_urls)))
+    # The objects loaded so far stay shared with the workers until written to. The garbage collector writes to
+    # the objects it tracks, so they are moved out of its reach.
+    gc.freeze()
+    logger.info(f"Starting {workers} workers on {settings.HOST}:{settings.PORT}")
+    try:
+        status = supervisor.run()
+    finally:
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+import asyncio
+import math
+import time
+from typing import List, Optional, Iterable, Dict, Any
+import httpx
+from loguru import logger
+from app.config import settings
+from app.services.shared import SharedState, get_shared_state
+
+
+class TikaBackend:
+    """
+    A Tika server together with what the router knows about its current load and health
+    """
+    def __init__(self, url: str, name: str):
+        # url may contain credentials, name is safe to log and report
+        self.url = url.rstrip('/')
+        self.name = name
+        self.in_flight = 0
+        self.in_flight_bytes = 0
+        # Exponentially weighted moving average of the latency of successful requests in seconds
+        self.latency: Optional[float] = None
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        # Whether the backend was ejected and has not succeeded since, and whether the trial request of
+        # a half-open backend is in flight
+        self.tripped = False
+        self.trial_in_flight = False
+        # Result of the last /version probe: when it was done (time.time()), how long it took and the version
+        self.probed_at: Optional[float] = None
+        self.probe_latency: Optional[float] = None
+        self.version: Optional[str] = None
+
+    @property
+    def ejected(self) -> bool:
+        return self.ejected_until > time.monotonic()
+
+    @property
+    def state(self) -> str:
+        """The circuit breaker state: "closed", "open" while ejected, or "half_open" once it may be tried again"""
+        if self.ejected:
+            return "open"
+        return "half_open" if self.tripped else "closed"
+
+    @property
+    def accepting(self) -> bool:
+        """Whether a request may be sent, which is a single trial request at a time while half-open"""
+        return not self.ejected and not (self.tripped and self.trial_in_flight)
+
+    def health(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "healthy": not self.ejected,
+            "state": self.state,
+            "in_flight": self.in_flight,
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "consecutive_failures": self.consecutive_failures,
+            "probed_at": self.probed_at,
+            "probe_latency_ms": round(self.probe_latency * 1000, 1) if self.probe_latency is not None else None,
+            "version": self.version
+        }
+
+
+class BackendPool:
+    """
+    Pool of Tika backends. Documents are sent to the least loaded healthy backend and backends which fail
+    repeatedly, or fail a probe, are ejected for a while before they are tried again.
+
+    Each backend is a circuit breaker: an ejected backend is open and gets no requests. After eject_seconds
+    it is half-open and gets a single trial request, which closes it again when it succeeds and opens it
+    for another eject_seconds when it fails.
+
+    With shared state, a backend ejected by any worker process of the server is ejected by all of them, and
+    probe results are taken over from the worker which probed. Load and latency are tracked per worker.
+    """
+    def __init__(
+            self,
+            backends: List[TikaBackend],
+            failure_threshold: int = 3,
+            eject_seconds: float = 30.0,
+            latency_smoothing: float = 0.2,
+            shared: Optional[SharedState] = None
+    ):
+        self.backends = backends
+        self.failure_threshold = failure_threshold
+        self.eject_seconds = eject_seconds
+        self.latency_smoothing = latency_smoothing
+        self.shared = shared
+
+    def __len__(self) -> int:
+        return len(self.backends)
+
+    def choose(self, exclude: Iterable[TikaBackend] = ()) -> Optional[TikaBackend]:
+        """
+        The healthy backend with fewest requests in flight, breaking ties by bytes in flight and then by
+        recent latency. Returns None if no healthy backend is left.
+        """
+        self.sync()
+        candidates = [backend for backend in self.backends if backend.accepting and backend not in exclude]
+        if not candidates:
+            return None
+        return min(
+            candidates,
+            key=lambda backend: (backend.in_flight, backend.in_flight_bytes, backend.latency or 0.0)
+        )
+
+    def started(self, backend: TikaBackend, size: int):
+        backend.in_flight += 1
+        backend.in_flight_bytes += size
+        if backend.tripped:
+            backend.trial_in_flight = True
+
+    def finished(self, backend: TikaBackend, size: int):
+        backend.in_flight -= 1
+        backend.in_flight_bytes -= size
+        backend.trial_in_flight = False
+
+    def sync(self):
+        """Take over the ejections and newer probe results of the other workers sharing state"""
+        if self.shared is None:
+            return
+        for index, backend in enumerate(self.backends):
+            ejected_until = self.shared.ejected_until(index)
+            if ejected_until > backend.ejected_until:
+                backend.ejected_until = ejected_until
+                backend.tripped = True
+            probed_at, probe_latency, ok, version = self.shared.probe_result(index)
+            if probed_at is not None and (backend.probed_at is None or probed_at > backend.probed_at):
+                backend.probed_at = probed_at
+                backend.probe_latency = probe_latency
+                backend.version = version
+                if ok and ejected_until <= time.monotonic():
+                    self.succeeded(backend)
+
+    def succeeded(self, backend: TikaBackend, latency: float = None):
+        if backend.tripped:
+            logger.info(f"Tika backend {backend.name} recovered")
+            if self.shared is not None:
+                self.shared.set_ejected_until(self.backends.index(backend), 0.0)
+        backend.consecutive_failures = 0
+        backend.ejected_until = 0.0
+        backend.tripped = False
+        if latency is not None:
+            if backend.latency is None:
+                backend.latency = latency
+            else:
+                backend.latency += self.latency_smoothing * (latency - backend.latency)
+
+    def failed(self, backend: TikaBackend, eject: bool = False):
+        backend.consecutive_failures += 1
+        # A failed trial of a half-open backend opens it again right away
+        if eject or backend.tripped or backend.consecutive_failures >= self.failure_threshold:
+            if not backend.ejected:
+                logger.warning(f"Ejecting Tika backend {backend.name} for {self.eject_seconds} seconds")
+            backend.ejected_until = time.monotonic() + self.eject_seconds
+            backend.tripped = True
+            if self.shared is not None:
+                self.shared.set_ejected_until(self.backends.index(backend), backend.ejected_until)
+
+    async def probe(self, client: httpx.AsyncClient, timeout: float = 5.0):
+        """
+        Probe the /version endpoint of every backend, ejecting those which do not answer
+        """
+        self.sync()
+
+        async def probe_backend(backend: TikaBackend):
+            started = time.perf_counter()
+            try:
+                response = await client.get(f"{backend.url}/version", timeout=timeout)
+                ok = response.is_success
+            except Exception as e:
+                logger.warning(f"Probe of Tika backend {backend.name} failed: {str(e) or type(e).__name__}")
+                ok = False
+            backend.probed_at = time.time()
+            backend.probe_latency = time.perf_counter() - started
+            backend.version = response.text.strip() if ok else None
+            if ok:
+                self.succeeded(backend)
+            else:
+                self.failed(backend, eject=True)
+            if self.shared is not None:
+                self.shared.publish_probe(
+                    self.backends.index(backend), backend.probed_at, backend.probe_latency, ok, backend.version
+                )
+
+        await asyncio.gather(*(probe_backend(backend) for backend in self.backends))
+
+    @property
+    def available(self) -> bool:
+        """Whether any backend is closed or half-open, which is known without calling the backends"""
+        self.sync()
+        return any(not backend.ejected for backend in self.backends)
+
+    def retry_after(self) -> int:
+        """Seconds until the first open backend becomes half-open"""
+        now = time.monotonic()
+        return max(1, math.ceil(min(backend.ejected_until for backend in self.backends) - now))
+
+    def health(self) -> List[Dict[str, Any]]:
+        self.sync()
+        return [backend.health() for backend in self.backends]
+
+
+def create_backend_pool() -> BackendPool:
+    """Create the pool of the Tika backends listed in the settings"""
+    backends = [
+        TikaBackend(url, name)
+        for url, name in zip(settings.tika_urls_with_auth, settings.tika_base_urls)
+    ]
+    return BackendPool(
+        backends,
+        failure_threshold=settings.TIKA_FAILURE_THRESHOLD,
+        eject_seconds=settings.TIKA_EJECT_SECONDS,
+        shared=get_shared_state()
+    )
@@ -0,0 +1,180 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from contextlib import closing, contextmanager
+from typing import Dict, Any, Iterator, List, Tuple, Optional
+from loguru import logger
+from app.config import settings
+
+# A cached extraction is the list of documents, as text and metadata, extracted from a document
+CachedExtraction = List[Tuple[str, Dict[str, Any]]]
+
+
+def make_cache_key(content_digest: str, endpoint: str, options: Dict[str, Any]) -> str:
+    """
+    Key of an extraction: the hash of the document together with everything that decides how it is extracted
+    """
+    routing = json.dumps({"endpoint": endpoint, "options": options}, sort_keys=True)
+    return f"{content_digest}:{hashlib.sha256(routing.encode()).hexdigest()[:16]}"
+
+
+def extraction_size(value: CachedExtraction) -> int:
+    """Approximate size in bytes of an extraction, by which caches and stores are bounded"""
+    return sum(len(text) + len(json.dumps(metadata, default=str)) for text, metadata in value)
+
+
+class MemoryCache:
+    """
+    In-memory LRU cache bounded by number of entries and total size, with entries expiring after ttl seconds
+    """
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._entries: "OrderedDict[str, Tuple[float, int, CachedExtraction]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[CachedExtraction]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, size, value = entry
+        if expires < time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: CachedExtraction):
+        size = extraction_size(value)
+        if size > self.max_bytes or self.max_entries <= 0:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + self.ttl, size, value)
+        self.size += size
+        while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self.size -= size
+
+
+class SQLiteCache:
+    """
+    On-disk cache in a SQLite database, which survives restarts.
+    Entries expire after ttl seconds and the least recently used entries are evicted above max_bytes.
+    All methods are blocking and are meant to be run in a worker thread.
+    """
+    def __init__(self, path: str, max_bytes: int, ttl: float):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        with self._connect() as connection:
+            # Readers do not wait for writers, as the workers of the server share the database
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS extractions ("
+                "key TEXT PRIMARY KEY, documents TEXT NOT NULL, "
+                "size INTEGER NOT NULL, expires REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS extractions_accessed ON extractions (accessed)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """A connection in a transaction, which is committed, or rolled back on error, and closed on exit"""
+        with closing(sqlite3.connect(self.path, timeout=30)) as connection, connection:
+            yield connection
+
+    def get(self, key: str) -> Optional[CachedExtraction]:
+        now = time.time()
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT documents, expires FROM extractions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            documents, expires = row
+            if expires < now:
+                connection.execute("DELETE FROM extractions WHERE key = ?", (key,))
+                return None
+            connection.execute("UPDATE extractions SET accessed = ? WHERE key = ?", (now, key))
+        return [(text, metadata) for text, metadata in json.loads(documents)]
+
+    def set(self, key: str, value: CachedExtraction):
+        size = extraction_size(value)
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO extractions (key, documents, size, expires, accessed) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, json.dumps(value, default=str), size, now + self.ttl, now)
+            )
+            connection.execute("DELETE FROM extractions WHERE expires < ?", (now,))
+            total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM extractions").fetchone()[0]
+            if total > self.max_bytes:
+                # Evict least recently used entries until the cache is within its size limit again
+                rows = connection.execute("SELECT key, size FROM extractions ORDER BY accessed").fetchall()
+                evicted = []
+                for evict_key, evict_size in rows:
+                    if total <= self.max_bytes:
+                        break
+                    evicted.append((evict_key,))
+                    total -= evict_size
+                connection.executemany("DELETE FROM extractions WHERE key = ?", evicted)
+
+
+class ExtractionCache:
+    """
+    Two tier cache of extraction results: an in-memory LRU tier in front of an optional on-disk tier
+    """
+    def __init__(self, memory: MemoryCache, disk: Optional[SQLiteCache] = None):
+        self.memory = memory
+        self.disk = disk
+
+    async def get(self, key: str) -> Tuple[Optional[CachedExtraction], Optional[str]]:
+        """
+        Look up an extraction. Returns the cached value, if any, and the name of the tier that had it.
+        """
+        value = self.memory.get(key)
+        if value is not None:
+            return value, "memory"
+        if self.disk is not None:
+            try:
+                value = await asyncio.to_thread(self.disk.get, key)
+            except Exception as e:
+                logger.warning(f"Failed to read from the disk cache: {str(e)}")
+                value = None
+            if value is not None:
+                self.memory.set(key, value)
+                return value, "disk"
+        return None, None
+
+    async def set(self, key: str, value: CachedExtraction):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            try:
+                await asyncio.to_thread(self.disk.set, key, value)
+            except Exception as e:
+                logger.warning(f"Failed to write to the disk cache: {str(e)}")
+
+
+def create_extraction_cache() -> Optional[ExtractionCache]:
+    """Create the extraction cache configured in the settings, if it is enabled"""
+    if not settings.CACHE_ENABLED:
+        return None
+    memory = MemoryCache(settings.CACHE_MAX_ENTRIES, settings.CACHE_MAX_BYTES, settings.CACHE_TTL_SECONDS)
+    disk = None
+    if settings.CACHE_SQLITE_PATH:
+        disk = SQLiteCache(settings.CACHE_SQLITE_PATH, settings.CACHE_SQLITE_MAX_BYTES, settings.CACHE_TTL_SECONDS)
+        logger.info(f"Using disk cache at {settings.CACHE_SQLITE_PATH}")
+    return ExtractionCache(memory, disk)
@@ -0,0 +1,126 @@
+import re
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Separators tried in order to cut a section into pieces of at most the chunk size: paragraphs, lines, sentences
+# and words. A piece without any of them is cut anywhere.
+SEPARATORS = ("\n\n", "\n", ". ", " ")
+
+# A Markdown heading, or a line opening or closing a fenced code block, in which lines are not headings
+_STRUCTURE = re.compile(r"^(?:(#{1,6})[ \t]+(.*?)[ \t#]*|(?:```|~~~).*)$", re.MULTILINE)
+
+
+def _sections(text: str) -> List[Tuple[int, int, str]]:
+    """The sections of the text, each starting at a heading, as start, end and path of headings"""
+    sections = []
+    path: List[Tuple[int, str]] = []
+    heading = ""
+    start = 0
+    in_fence = False
+    for match in _STRUCTURE.finditer(text):
+        if match.group(1) is None:
+            in_fence = not in_fence
+            continue
+        if in_fence:
+            continue
+        if match.start() > start:
+            sections.append((start, match.start(), heading))
+        level = len(match.group(1))
+        while path and path[-1][0] >= level:
+            path.pop()
+        path.append((level, match.group(2)))
+        heading = " > ".join(title for _, title in path)
+        start = match.start()
+    sections.append((start, len(text), heading))
+    return sections
+
+
+def _boundaries(text: str, start: int, end: int, size: int, separators: Sequence[str]) -> List[int]:
+    """The ends of consecutive pieces of text[start:end] of at most size characters, cut after separators"""
+    if end - start <= size:
+        return [end]
+    for index, separator in enumerate(separators):
+        if text.find(separator, start, end) != -1:
+            break
+    else:
+        return list(range(start + size, end, size)) + [end]
+    finer = separators[index + 1:]
+    boundaries = []
+    position = start
+    while position < end:
+        found = text.find(separator, position, end)
+        cut = end if found == -1 else found + len(separator)
+        if cut - position <= size:
+            boundaries.append(cut)
+        else:
+            boundaries.extend(_boundaries(text, position, cut, size, finer))
+        position = cut
+    return boundaries
+
+
+def _pack(text: str, start: int, end: int, size: int, overlap: int) -> List[Tuple[int, int]]:
+    """
+    Pack the pieces of text[start:end] into chunks of at most size characters, as start and end. Each chunk
+    starts with the last pieces of the previous one which fit in overlap characters.
+    """
+    chunks = []
+    chunk_start = start
+    # Start of the text which is not in a chunk yet, and the end of the pieces added to the current chunk
+    content_start = start
+    last = start
+    # Starts of the pieces of the current chunk, where the next chunk may start
+    cuts: List[int] = []
+    for boundary in _boundaries(text, start, end, size, SEPARATORS):
+        if boundary - chunk_start > size and last > content_start:
+            chunks.append((chunk_start, last))
+            next_start = last
+            for cut in cuts:
+                if last - cut <= overlap and boundary - cut <= size:
+                    next_start = cut
+                    break
+            chunk_start = next_start
+            content_start = last
+            cuts = [cut for cut in cuts if cut > next_start]
+        if last > chunk_start:
+            cuts.append(last)
+        last = boundary
+    if last > content_start:
+        chunks.append((chunk_start, last))
+    return chunks
+
+
+def chunk_markdown(
+        text: str,
+        chunk_size: int,
+        chunk_overlap: int = 0,
+        metadata: Optional[Dict[str, Any]] = None
+) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    Split Markdown text into chunks of at most chunk_size characters, which follow its structure: a heading
+    always starts a new chunk, and sections are cut at paragraphs, then lines, sentences and words, as far as
+    needed. Consecutive chunks of a section overlap by up to chunk_overlap characters of whole pieces.
+
+    Each chunk is a slice of the text with surrounding whitespace stripped, and its metadata extends metadata
+    with its chunk_index, its start_index and end_index in the text and the heading path of its section,
+    such as "Introduction > Scope". A text without chunks is returned whole.
+    This is a module level function, so it can be run in the conversion pool.
+    """
+    metadata = metadata or {}
+    chunks = []
+    for section_start, section_end, heading in _sections(text):
+        for start, end in _pack(text, section_start, section_end, chunk_size, chunk_overlap):
+            chunk = text[start:end]
+            stripped = chunk.lstrip()
+            start += len(chunk) - len(stripped)
+            stripped = stripped.rstrip()
+            if not stripped:
+                continue
+            chunk_metadata = {
+                **metadata,
+                "chunk_index": len(chunks),
+                "start_index": start,
+                "end_index": start + len(stripped)
+            }
+            if heading:
+                chunk_metadata["heading"] = heading
+            chunks.append((stripped, chunk_metadata))
+    return chunks or [(text, metadata)]
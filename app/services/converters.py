@@ -0,0 +1,338 @@
+import asyncio
+import multiprocessing
+import re
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type, Union
+from xml.parsers import expat
+from html2text import HTML2Text
+from loguru import logger
+from app.config import settings
+
+
+class Converter:
+    """
+    Converts the XHTML returned by Tika to markdown. The document is fed in chunks and the markdown is the
+    concatenation of what feed and close return, so streaming converters can emit markdown while the
+    document arrives.
+    """
+    name: str
+    # Whether the converter emits markdown while it is fed, rather than only when it is closed
+    streaming: bool = False
+
+    def feed(self, chunk: str) -> str:
+        raise NotImplementedError
+
+    def close(self) -> str:
+        raise NotImplementedError
+
+
+class Html2TextConverter(Converter):
+    """Converts the whole document with html2text when it is closed"""
+    name = "html2text"
+
+    def __init__(self):
+        self._chunks: List[str] = []
+
+    def feed(self, chunk: str) -> str:
+        self._chunks.append(chunk)
+        return ""
+
+    def close(self) -> str:
+        h = HTML2Text()
+        h.ignore_links = False
+        return h.handle("".join(self._chunks))
+
+
+# Character references which are valid in XML 1.1, which Tika produces, but not in XML 1.0 as parsed by expat
+_INVALID_CHAR_REF = re.compile(r"&#(?:0*(?:[0-8]|1[1-2]|1[4-9]|2[0-9]|3[01])|[xX]0*(?:[0-8bBcCeEfF]|1[0-9a-fA-F]));")
+_WHITESPACE = re.compile(r"\s+")
+_SPACES = re.compile(r" {2,}")
+_HEADINGS = {"h1": 1, "h2": 2, "h3": 3, "h4": 4, "h5": 5, "h6": 6}
+_BLOCKS = {
+    "p", "div", "section", "article", "header", "footer", "main", "nav", "aside", "address",
+    "dl", "dt", "dd", "figure", "figcaption", "caption", "center"
+}
+_SKIPPED = {"head", "title", "script", "style"}
+_EMPHASIS = {"b": "**", "strong": "**", "i": "_", "em": "_"}
+
+
+class _MarkdownWriter:
+    """
+    Writes markdown from the start tag, end tag and text events of an XHTML document.
+    Only the text of the block being written is kept; finished blocks are handed out by take.
+    """
+    def __init__(self):
+        self._out: List[str] = []
+        self._last_kind: Optional[str] = None
+        # Text pieces of the current block
+        self._inline: List[str] = []
+        # Open links as the index of their first piece in _inline and their target
+        self._links: List[Tuple[int, str]] = []
+        self._skipped = 0
+        self._pre = 0
+        self._quotes = 0
+        # Open lists as [tag, number of items, whether the marker of the current item is still to be written,
+        # indentation of the markers]
+        self._lists: List[list] = []
+        self._tables = 0
+        self._row: Optional[List[str]] = None
+        self._rows = 0
+
+    def take(self) -> str:
+        markdown = "".join(self._out)
+        self._out.clear()
+        return markdown
+
+    def _emit(self, text: str, kind: str):
+        """Write a finished line or block. Blocks are separated by an empty line, list items and rows are not."""
+        if self._last_kind is not None and (kind != self._last_kind or kind == "block"):
+            self._out.append("\n")
+        if self._quotes:
+            text = "\n".join("> " * self._quotes + line for line in text.split("\n"))
+        self._out.append(text + "\n")
+        self._last_kind = kind
+
+    def _take_inline(self) -> str:
+        text = "".join(self._inline)
+        self._inline.clear()
+        self._links = [(0, href) for _, href in self._links]
+        if self._pre:
+            return text
+        return "\n".join(_SPACES.sub(" ", line).strip() for line in text.split("\n")).strip()
+
+    def _in_container(self) -> bool:
+        """Whether blocks are part of a list item or table cell rather than blocks of their own"""
+        return self._tables > 0 or (bool(self._lists) and self._lists[-1][2] is not None)
+
+    def _item_indent(self) -> str:
+        """Indentation of the content of the current item of the innermost list, where nested lists start"""
+        tag, number, _, indent = self._lists[-1]
+        return indent + " " * (len(f"{number}. ") if tag == "ol" else 2)
+
+    def _flush(self, prefix: str = ""):
+        text = self._take_inline()
+        if not text:
+            return
+        if self._lists and self._tables == 0:
+            tag, number, marker_pending, indent = self._lists[-1]
+            content_indent = self._item_indent()
+            if marker_pending:
+                self._lists[-1][2] = False
+                marker = f"{number}." if tag == "ol" else "*"
+                text = f"{indent}{marker} {text}"
+            else:
+                text = content_indent + text
+            self._emit(text.replace("\n", "\n" + content_indent), "item")
+        else:
+            self._emit(prefix + text, "block")
+
+    def start(self, tag: str, attrs: Dict[str, str]):
+        if self._skipped or tag in _SKIPPED:
+            self._skipped += 1
+            return
+        if tag in _EMPHASIS:
+            self._inline.append(_EMPHASIS[tag])
+        elif tag == "a":
+            self._links.append((len(self._inline), attrs.get("href", "")))
+        elif tag == "br":
+            self._inline.append("\n")
+        elif tag == "img":
+            src = attrs.get("src")
+            if src:
+                self._inline.append(f"![{attrs.get('alt', '')}]({src})")
+        elif tag == "table":
+            if self._tables == 0:
+                self._flush()
+                self._rows = 0
+            self._tables += 1
+        elif self._tables == 1 and tag == "tr":
+            self._row = []
+        elif self._tables == 1 and tag in ("td", "th"):
+            self._inline.clear()
+        elif tag in ("ul", "ol"):
+            self._flush()
+            self._lists.append([tag, 0, None, self._item_indent() if self._lists else "  "])
+        elif tag == "li" and self._lists:
+            self._flush()
+            self._lists[-1][1] += 1
+            self._lists[-1][2] = True
+        elif tag == "pre":
+            self._flush()
+            self._pre += 1
+        elif tag == "blockquote":
+            self._flush()
+            self._quotes += 1
+        elif tag in _HEADINGS or tag in _BLOCKS:
+            if self._in_container():
+                self._inline.append(" ")
+            else:
+                self._flush()
+
+    def end(self, tag: str):
+        if self._skipped:
+            self._skipped -= 1
+            return
+        if tag in _EMPHASIS:
+            self._inline.append(_EMPHASIS[tag])
+        elif tag == "a":
+            if self._links:
+                index, href = self._links.pop()
+                text = "".join(self._inline[index:]).strip()
+                # Links within the document lead nowhere in the markdown, like in html2text
+                if href and text and not href.startswith("#"):
+                    del self._inline[index:]
+                    self._inline.append(f"<{href}>" if text == href else f"[{text}]({href})")
+        elif tag == "table":
+            self._tables -= 1
+            if self._tables == 0:
+                self._inline.clear()
+                self._row = None
+        elif self._tables == 1 and tag in ("td", "th"):
+            if self._row is not None:
+                self._row.append(self._take_inline().replace("\n", " ").replace("|", "\\|"))
+        elif self._tables == 1 and tag == "tr":
+            if self._row:
+                self._emit("| " + " | ".join(self._row) + " |", "row")
+                if self._rows == 0:
+                    self._emit("|" + "---|" * len(self._row), "row")
+                self._rows += 1
+            self._row = None
+        elif tag in ("ul", "ol"):
+            self._flush()
+            if self._lists:
+                self._lists.pop()
+            if not self._lists and self._last_kind == "item":
+                # Separate the list from what follows it
+                self._last_kind = "block"
+        elif tag == "li" and self._lists:
+            self._flush()
+            self._lists[-1][2] = None
+        elif tag == "pre":
+            text = self._take_inline().strip("\n")
+            self._pre -= 1
+            if text:
+                self._emit(f"```\n{text}\n```", "block")
+        elif tag == "blockquote":
+            self._flush()
+            self._quotes -= 1
+        elif tag in _HEADINGS:
+            if self._in_container():
+                self._inline.append(" ")
+            else:
+                self._flush("#" * _HEADINGS[tag] + " ")
+        elif tag in _BLOCKS:
+            if self._in_container():
+                self._inline.append(" ")
+            else:
+                self._flush()
+
+    def data(self, text: str):
+        if self._skipped:
+            return
+        self._inline.append(text if self._pre else _WHITESPACE.sub(" ", text))
+
+    def finish(self):
+        self._flush()
+
+
+class XhtmlConverter(Converter):
+    """
+    Streaming converter which parses Tika's XHTML incrementally with expat and writes markdown for headings,
+    paragraphs, emphasis, links, images, lists, tables, quotes and preformatted text block by block,
+    without building a document tree.
+    """
+    name = "xhtml"
+    streaming = True
+
+    def __init__(self):
+        self._writer = _MarkdownWriter()
+        self._parser = expat.ParserCreate()
+        self._parser.buffer_text = True
+        self._parser.StartElementHandler = self._writer.start
+        self._parser.EndElementHandler = self._writer.end
+        self._parser.CharacterDataHandler = self._writer.data
+        # End of the previous chunk, held back as it may be the start of a character reference
+        self._pending = ""
+
+    def feed(self, chunk: str) -> str:
+        data = self._pending + chunk
+        self._pending = ""
+        reference = data.rfind("&", max(0, len(data) - 16))
+        if reference != -1 and ";" not in data[reference:]:
+            data, self._pending = data[:reference], data[reference:]
+        self._parser.Parse(_INVALID_CHAR_REF.sub("", data), False)
+        return self._writer.take()
+
+    def close(self) -> str:
+        self._parser.Parse(_INVALID_CHAR_REF.sub("", self._pending), True)
+        self._pending = ""
+        self._writer.finish()
+        return self._writer.take()
+
+
+CONVERTERS: Dict[str, Type[Converter]] = {
+    Html2TextConverter.name: Html2TextConverter,
+    XhtmlConverter.name: XhtmlConverter
+}
+
+
+def get_converter(name: str) -> Converter:
+    """A new converter of the named engine"""
+    try:
+        return CONVERTERS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown converter: {name}")
+
+
+def convert_document(name: str, document: str) -> str:
+    """Convert a whole document with the named converter engine"""
+    converter = get_converter(name)
+    return converter.feed(document) + converter.close()
+
+
+class ConversionPool:
+    """
+    Runs conversions of Tika output off the event loop, in a pool of threads or processes.
+    A process pool gives true parallelism across cores, at the cost of copying the documents between processes,
+    so documents up to inline_max_bytes are converted inline on the event loop.
+    """
+    def __init__(self, kind: str, workers: int, inline_max_bytes: int):
+        self.kind = kind
+        self.inline_max_bytes = inline_max_bytes
+        if kind == "process":
+            # Spawned workers do not inherit the threads and event loop of the server process
+            self.executor: Executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+        elif kind == "thread":
+            self.executor = ThreadPoolExecutor(workers, thread_name_prefix="conversion")
+        else:
+            raise ValueError(f"Unknown conversion pool kind: {kind}")
+
+    async def run(self, convert: Callable[[Any], Any], document: Union[str, bytes]) -> Any:
+        """
+        Run convert on the document, Tika output or the document itself, such as a PDF to split.
+        convert must be a module level function, so it can be sent to a process.
+        """
+        started = time.perf_counter()
+        if len(document) <= self.inline_max_bytes:
+            where = "inline"
+            converted = convert(document)
+        else:
+            where = f"{self.kind} pool"
+            converted = await asyncio.get_running_loop().run_in_executor(self.executor, convert, document)
+        elapsed = time.perf_counter() - started
+        unit = "bytes" if isinstance(document, bytes) else "characters"
+        logger.debug(f"Converted {len(document)} {unit} {where} in {elapsed * 1000:.1f} ms")
+        return converted
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def create_conversion_pool() -> ConversionPool:
+    """Create the conversion pool configured in the settings"""
+    return ConversionPool(
+        settings.CONVERSION_POOL,
+        settings.CONVERSION_WORKERS,
+        settings.CONVERSION_INLINE_MAX_BYTES
+    )
@@ -0,0 +1,88 @@
+import asyncio
+import time
+from typing import Optional
+import httpx
+from loguru import logger
+from app.config import settings
+from app.services.backends import BackendPool
+
+
+class HealthMonitor:
+    """
+    Probes every Tika backend in the background every interval seconds, which feeds the circuit breakers of
+    the pool, and keeps the results for the health endpoints, which are answered from them without calling Tika.
+    The service is ready once a probe round has completed, for as long as the last round is at most
+    stale_seconds old and a backend is available.
+    When the backends share state with other worker processes, each round is run by one worker only and the
+    others take over its results.
+    """
+    def __init__(
+            self,
+            backends: BackendPool,
+            client: httpx.AsyncClient,
+            interval: float,
+            timeout: float,
+            stale_seconds: float
+    ):
+        self.backends = backends
+        self.client = client
+        self.interval = interval
+        self.timeout = timeout
+        self.stale_seconds = stale_seconds
+        # When the last probe round completed, as time.time()
+        self.checked_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def probe(self):
+        """Probe every backend once, unless another worker sharing state runs this round"""
+        shared = self.backends.shared
+        if shared is not None and not shared.claim_probe(self.interval):
+            self.backends.sync()
+            self.checked_at = shared.checked_at
+            return
+        await self.backends.probe(self.client, self.timeout)
+        self.checked_at = time.time()
+        if shared is not None:
+            shared.checked_at = self.checked_at
+
+    async def _run(self):
+        while True:
+            try:
+                await self.probe()
+            except Exception as e:
+                logger.error(f"Error probing Tika backends: {str(e)}")
+            if self.checked_at is None and self.backends.shared is not None:
+                # The first round is run by another worker, whose results are looked for again soon
+                await asyncio.sleep(min(self.interval, 1.0))
+            else:
+                await asyncio.sleep(self.interval)
+
+    @property
+    def fresh(self) -> bool:
+        return self.checked_at is not None and time.time() - self.checked_at <= self.stale_seconds
+
+    @property
+    def ready(self) -> bool:
+        return self.fresh and self.backends.available
+
+
+def create_health_monitor(backends: BackendPool, client: httpx.AsyncClient) -> Optional[HealthMonitor]:
+    """Create the health monitor configured in the settings, which is started by the caller, or None if disabled"""
+    if settings.HEALTH_PROBE_INTERVAL <= 0:
+        return None
+    return HealthMonitor(
+        backends,
+        client,
+        settings.HEALTH_PROBE_INTERVAL,
+        settings.HEALTH_PROBE_TIMEOUT,
+        settings.HEALTH_STALE_SECONDS
+    )
@@ -0,0 +1,445 @@
+import asyncio
+import json
+import sqlite3
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import closing, contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from fastapi import HTTPException
+from loguru import logger
+from app.config import settings
+from app.core.logs import log_event
+from app.services.cache import CachedExtraction, extraction_size
+from app.services.limiter import DEFAULT_FLOW, Flow
+from app.services.tika import TikaService
+
+# Job states, a job is finished in the last two
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+# How often a long poll looks at the store for jobs run by another process sharing it
+POLL_INTERVAL = 1.0
+# How often a process marks the jobs it is running as alive in a store shared with other processes, and after
+# how long without that a job which did not finish is failed, as the process running it died
+HEARTBEAT_INTERVAL = 30.0
+STALE_SECONDS = 4 * HEARTBEAT_INTERVAL
+
+
+@dataclass
+class Job:
+    id: str
+    status: str
+    # The tenant which submitted the job
+    tenant: str = DEFAULT_FLOW.tenant
+    filename: Optional[str] = None
+    split: Optional[str] = None
+    created: float = field(default_factory=time.time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    # The extracted documents of a succeeded job, or the status code and error of a failed one
+    documents: Optional[CachedExtraction] = None
+    status_code: Optional[int] = None
+    error: Optional[str] = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in (SUCCEEDED, FAILED)
+
+    @property
+    def size(self) -> int:
+        return extraction_size(self.documents) if self.documents else 0
+
+
+@dataclass
+class JobInput:
+    """A submitted document waiting to be processed"""
+    content: bytes
+    filename: Optional[str] = None
+    mime_type: Optional[str] = None
+    converter: Optional[str] = None
+    flow: Flow = DEFAULT_FLOW
+    # Size and overlap of the chunks the text is split into, when chunks are requested
+    chunking: Optional[Tuple[int, int]] = None
+
+
+class MemoryJobStore:
+    """
+    Jobs held in memory. Finished jobs expire ttl seconds after they finished, and the oldest finished jobs
+    are evicted when their results exceed max_bytes. Jobs which are not finished are never evicted.
+    """
+    blocking = False
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._jobs: Dict[str, Job] = {}
+        # Finished jobs in the order they finished, with the size of their results
+        self._finished: "OrderedDict[str, int]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self._expire()
+        return self._jobs.get(job_id)
+
+    def add(self, job: Job):
+        self._jobs[job.id] = job
+        self.put(job)
+
+    def put(self, job: Job):
+        """Store a job which was added, unless it was deleted since"""
+        if job.id not in self._jobs:
+            return
+        self.delete(job.id)
+        self._jobs[job.id] = job
+        if job.done:
+            self._finished[job.id] = job.size
+            self.size += job.size
+        self._expire()
+        while self.size > self.max_bytes and self._finished:
+            self.delete(next(iter(self._finished)))
+
+    def delete(self, job_id: str) -> bool:
+        job = self._jobs.pop(job_id, None)
+        if job_id in self._finished:
+            self.size -= self._finished.pop(job_id)
+        return job is not None
+
+    def touch(self, job_ids: Iterable[str]):
+        """Jobs in memory are only run by this process, so they are never stale"""
+
+    def _expire(self):
+        expired = time.time() - self.ttl
+        while self._finished:
+            job_id = next(iter(self._finished))
+            if self._jobs[job_id].finished >= expired:
+                break
+            self.delete(job_id)
+
+
+class SQLiteJobStore:
+    """
+    Jobs kept in a SQLite database, which survives restarts and is shared by the processes using it.
+    Finished jobs expire ttl seconds after they finished, and the oldest finished jobs are evicted when their
+    results exceed max_bytes. A job which did not finish and was not touched for stale_seconds was left by a
+    process which died. It is failed when it is next read, and deleted once it would have expired.
+    All methods are blocking and are meant to be run in a worker thread.
+    """
+    blocking = True
+
+    def __init__(self, path: str, max_bytes: int, ttl: float, stale_seconds: float = STALE_SECONDS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stale_seconds = stale_seconds
+        with self._connect() as connection:
+            # Write-ahead logging lets the workers poll for jobs while another one stores a result
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, job TEXT NOT NULL, size INTEGER NOT NULL, finished REAL, updated REAL)"
+            )
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(jobs)")]
+            if "updated" not in columns:
+                connection.execute("ALTER TABLE jobs ADD COLUMN updated REAL")
+            connection.execute("CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """A connection in a transaction, which is committed, or rolled back on error, and closed on exit"""
+        with closing(sqlite3.connect(self.path, timeout=30)) as connection, connection:
+            yield connection
+
+    def get(self, job_id: str) -> Optional[Job]:
+        now = time.time()
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT job, updated FROM jobs WHERE id = ? AND (finished IS NULL OR finished >= ?)",
+                (job_id, now - self.ttl)
+            ).fetchone()
+            if row is None:
+                return None
+            job = Job(**json.loads(row[0]))
+            if not job.done and (row[1] or 0) < now - self.stale_seconds:
+                job.status = FAILED
+                job.finished = now
+                job.status_code = 503
+                job.error = "The service stopped before the job finished"
+                self._update(connection, job, now)
+        if job.documents is not None:
+            job.documents = [(text, metadata) for text, metadata in job.documents]
+        return job
+
+    def add(self, job: Job):
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT INTO jobs (id, job, size, finished, updated) VALUES (?, ?, ?, ?, ?)",
+                (job.id, json.dumps(asdict(job), default=str), job.size, job.finished, now)
+            )
+            self._evict(connection, now)
+
+    def put(self, job: Job):
+        """Store a job which was added, unless it was deleted since"""
+        now = time.time()
+        with self._connect() as connection:
+            self._update(connection, job, now)
+            self._evict(connection, now)
+
+    def delete(self, job_id: str) -> bool:
+        with self._connect() as connection:
+            return connection.execute("DELETE FROM jobs WHERE id = ?", (job_id,)).rowcount > 0
+
+    def touch(self, job_ids: Iterable[str]):
+        """Mark jobs which did not finish as alive"""
+        now = time.time()
+        with self._connect() as connection:
+            connection.executemany(
+                "UPDATE jobs SET updated = ? WHERE id = ? AND finished IS NULL", [(now, job_id) for job_id in job_ids]
+            )
+
+    @staticmethod
+    def _update(connection: sqlite3.Connection, job: Job, now: float):
+        connection.execute(
+            "UPDATE jobs SET job = ?, size = ?, finished = ?, updated = ? WHERE id = ?",
+            (json.dumps(asdict(job), default=str), job.size, job.finished, now, job.id)
+        )
+
+    def _evict(self, connection: sqlite3.Connection, now: float):
+        connection.execute("DELETE FROM jobs WHERE finished < ?", (now - self.ttl,))
+        # Jobs left by a process which died, which nobody read since
+        connection.execute(
+            "DELETE FROM jobs WHERE finished IS NULL AND COALESCE(updated, 0) < ?",
+            (now - self.stale_seconds - self.ttl,)
+        )
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM jobs").fetchone()[0]
+        if total > self.max_bytes:
+            # Evict the oldest finished jobs until the results are within the size limit again
+            rows = connection.execute(
+                "SELECT id, size FROM jobs WHERE finished IS NOT NULL ORDER BY finished"
+            ).fetchall()
+            evicted = []
+            for job_id, size in rows:
+                if total <= self.max_bytes:
+                    break
+                evicted.append((job_id,))
+                total -= size
+            connection.executemany("DELETE FROM jobs WHERE id = ?", evicted)
+
+
+class JobManager:
+    """
+    Asynchronous extraction jobs. Submitted documents wait in a bounded queue and are processed through the
+    TikaService by a fixed number of workers, while clients poll or long-poll the store for the status and
+    results of their jobs. At most max_queued documents, of at most max_queued_bytes in total, may wait,
+    beyond which submissions are rejected with Retry-After.
+    """
+    def __init__(
+            self,
+            tika_service: TikaService,
+            store: Union[MemoryJobStore, SQLiteJobStore],
+            workers: int,
+            max_queued: int,
+            max_queued_bytes: int,
+            retry_after: int = 5
+    ):
+        self.tika_service = tika_service
+        self.store = store
+        self.workers = workers
+        self.max_queued = max_queued
+        self.max_queued_bytes = max_queued_bytes
+        self.retry_after = retry_after
+        self.queued_bytes = 0
+        self.running = 0
+        self._queue: "asyncio.Queue[Tuple[Job, JobInput]]" = asyncio.Queue()
+        self._workers: List[asyncio.Task] = []
+        self._heartbeat: Optional[asyncio.Task] = None
+        # Tasks processing jobs and events set when jobs finish, for the jobs of this process
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._events: Dict[str, asyncio.Event] = {}
+
+    @property
+    def queued(self) -> int:
+        return self._queue.qsize()
+
+    def start(self):
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._heartbeat = asyncio.create_task(self._beat())
+
+    async def close(self):
+        """Stop the workers, failing the jobs which did not finish"""
+        tasks = self._workers + ([self._heartbeat] if self._heartbeat is not None else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._heartbeat = None
+        while not self._queue.empty():
+            job, _ = self._queue.get_nowait()
+            await self._fail(job, 503, "The service shut down before the job was processed")
+
+    async def _store(self, method, *args):
+        if self.store.blocking:
+            return await asyncio.to_thread(method, *args)
+        return method(*args)
+
+    async def submit(self, document: JobInput, split: Optional[str] = None) -> Job:
+        """Queue a document to be processed, returning its job"""
+        if self.queued >= self.max_queued or (
+                self.queued and self.queued_bytes + len(document.content) > self.max_queued_bytes
+        ):
+            logger.warning("Rejected job: the job queue is full")
+            raise HTTPException(
+                status_code=503,
+                detail="Too many jobs are waiting to be processed",
+                headers={"Retry-After": str(self.retry_after)}
+            )
+        job = Job(
+            id=uuid.uuid4().hex,
+            status=QUEUED,
+            tenant=document.flow.tenant,
+            filename=document.filename,
+            split=split
+        )
+        await self._store(self.store.add, job)
+        self._events[job.id] = asyncio.Event()
+        self.queued_bytes += len(document.content)
+        self._queue.put_nowait((job, document))
+        logger.info(f"Queued job {job.id} ({self.queued} jobs waiting)")
+        return job
+
+    async def get(self, job_id: str, wait: float = 0) -> Optional[Job]:
+        """
+        The job, or None when it does not exist or has expired. A job which is not finished is waited on
+        for up to wait seconds.
+        """
+        deadline = time.monotonic() + wait
+        while True:
+            job = await self._store(self.store.get, job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job.done or remaining <= 0:
+                return job
+            event = self._events.get(job_id)
+            try:
+                # Jobs of other processes sharing the store are only seen by looking at the store again
+                await asyncio.wait_for(
+                    event.wait() if event is not None else asyncio.sleep(remaining),
+                    min(remaining, POLL_INTERVAL)
+                )
+            except asyncio.TimeoutError:
+                pass
+
+    async def delete(self, job_id: str) -> bool:
+        """Delete a job, cancelling it when it is being processed by this process"""
+        task = self._tasks.get(job_id)
+        if task is not None:
+            task.cancel()
+        self._finish(job_id)
+        return await self._store(self.store.delete, job_id)
+
+    def _finish(self, job_id: str):
+        event = self._events.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    async def _fail(self, job: Job, status_code: int, error: str):
+        job.status = FAILED
+        job.finished = time.time()
+        job.status_code = status_code
+        job.error = error
+        await self._store(self.store.put, job)
+        self._finish(job.id)
+
+    async def _beat(self):
+        """Mark the jobs this process queued or is running as alive, so others sharing the store wait for them"""
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            try:
+                await self._store(self.store.touch, list(self._events))
+            except Exception as e:
+                logger.error(f"Failed to mark jobs as alive: {str(e)}")
+
+    async def _work(self):
+        while True:
+            job, document = await self._queue.get()
+            self.queued_bytes -= len(document.content)
+            if job.id not in self._events:
+                # Deleted while it was queued
+                continue
+            task = asyncio.ensure_future(self._process(job, document))
+            self._tasks[job.id] = task
+            self.running += 1
+            try:
+                # Waiting rather than awaiting the task keeps a deleted job from cancelling the worker
+                await asyncio.wait([task])
+            finally:
+                self.running -= 1
+                self._tasks.pop(job.id, None)
+                if not task.done():
+                    # The worker is stopped
+                    task.cancel()
+                    await self._fail(job, 503, "The service shut down before the job finished")
+
+    async def _process(self, job: Job, document: JobInput):
+        # A job is logged as an event of its own, with the job id as request id
+        with log_event("Processed job", request_id=job.id) as event:
+            await self._run(job, document)
+            event.fields["status"] = job.status_code or 200
+
+    async def _run(self, job: Job, document: JobInput):
+        job.status = RUNNING
+        job.started = time.time()
+        await self._store(self.store.put, job)
+        logger.info(f"Processing job {job.id}")
+        try:
+            extraction = await self.tika_service.extract(
+                head=document.content,
+                file_content=document.content,
+                filename=document.filename,
+                provided_mime_type=document.mime_type,
+                converter=document.converter,
+                flow=document.flow
+            )
+            documents = extraction.documents
+            if document.chunking is not None:
+                documents = await self.tika_service.chunk(documents, *document.chunking)
+        except HTTPException as e:
+            logger.warning(f"Job {job.id} failed: {e.detail}")
+            await self._fail(job, e.status_code, str(e.detail))
+            return
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {str(e)}")
+            await self._fail(job, 500, f"Error processing document: {str(e)}")
+            return
+        job.status = SUCCEEDED
+        job.finished = time.time()
+        job.documents = documents
+        await self._store(self.store.put, job)
+        self._finish(job.id)
+        logger.info(f"Job {job.id} succeeded in {job.finished - job.started:.2f} seconds")
+
+
+def create_job_store() -> Union[MemoryJobStore, SQLiteJobStore]:
+    """Create the job store configured in the settings"""
+    if settings.JOBS_SQLITE_PATH:
+        logger.info(f"Storing jobs at {settings.JOBS_SQLITE_PATH}")
+        return SQLiteJobStore(settings.JOBS_SQLITE_PATH, settings.JOBS_MAX_RESULT_BYTES, settings.JOBS_TTL_SECONDS)
+    return MemoryJobStore(settings.JOBS_MAX_RESULT_BYTES, settings.JOBS_TTL_SECONDS)
+
+
+def create_job_manager(tika_service: TikaService) -> JobManager:
+    """Create the job manager configured in the settings, which is started by the caller"""
+    return JobManager(
+        tika_service,
+        create_job_store(),
+        settings.JOBS_WORKERS,
+        settings.JOBS_MAX_QUEUED,
+        settings.JOBS_MAX_QUEUED_BYTES,
+        settings.RETRY_AFTER_SECONDS
+    )
@@ -0,0 +1,219 @@
+import asyncio
+import heapq
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from fastapi import HTTPException
+from loguru import logger
+from app.config import settings
+from app.services.shared import SharedState, get_shared_state
+
+PRIORITIES = ("high", "normal", "low")
+
+
+@dataclass(frozen=True)
+class Flow:
+    """
+    The queue a document waits in to be admitted: that of its tenant and priority. When documents of several
+    flows are waiting, each flow is admitted in proportion to its weight.
+    """
+    tenant: str = "default"
+    priority: str = "normal"
+    weight: float = 1.0
+
+
+DEFAULT_FLOW = Flow()
+
+
+def classify(
+        tenant: str = "default",
+        priority: Optional[str] = None,
+        size: Optional[int] = None,
+        bulk: bool = False
+) -> Flow:
+    """
+    The flow of a document of the tenant: of the requested priority if any, otherwise low for bulk processing
+    such as batches and jobs, high for documents of at most PRIORITY_SMALL_BYTES and normal for the rest.
+    """
+    if priority is None:
+        if bulk:
+            priority = "low"
+        elif size is not None and size <= settings.PRIORITY_SMALL_BYTES:
+            priority = "high"
+        else:
+            priority = "normal"
+    weight = settings.tenant_weights.get(tenant, 1.0) * settings.priority_weights[priority]
+    return Flow(tenant, priority, weight)
+
+
+class ConcurrencyLimiter:
+    """
+    Admission gate in front of Tika. At most max_in_flight documents, and at most max_in_flight_bytes of documents,
+    are parsed at a time. A document larger than max_in_flight_bytes is only admitted when nothing else is in flight.
+
+    Documents which can not be admitted wait in a bounded queue. When the queue is full, or a document has
+    waited longer than queue_timeout seconds, the request is rejected right away with a Retry-After header,
+    so overload turns into waiting and fast rejections instead of a flooded Tika.
+
+    Waiting documents are admitted by start-time fair queueing across their flows: each document is tagged
+    with the virtual time it may start, after the previous document of its flow by 1 / weight of the flow,
+    and documents are admitted in the order of their tags. A flow of weight 4 thus gets four times the
+    admissions of a flow of weight 1 while both are waiting, and a flow which starts waiting does not queue
+    behind the backlog of another. Documents of one flow are admitted in the order they arrived. At most
+    max_queue_per_tenant documents of one tenant may wait, when it is set.
+
+    With shared state, the limits hold across all worker processes of the server. Documents released by
+    another worker do not wake the waiting documents of this one, so they are checked every poll_interval
+    seconds while any are waiting.
+    """
+    def __init__(
+            self,
+            max_in_flight: int,
+            max_in_flight_bytes: int,
+            max_queue: int,
+            queue_timeout: float,
+            retry_after: int = 5,
+            max_queue_per_tenant: int = 0,
+            shared: Optional[SharedState] = None,
+            poll_interval: float = 0.02
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_in_flight_bytes = max_in_flight_bytes
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.max_queue_per_tenant = max_queue_per_tenant
+        self.shared = shared
+        self.poll_interval = poll_interval
+        self._poller: Optional[asyncio.Task] = None
+        # Documents admitted by this worker
+        self.in_flight = 0
+        self.in_flight_bytes = 0
+        self.rejected = 0
+        # Heap of waiting documents as start tag, arrival sequence, future, weight in bytes and flow
+        self._waiters: List[Tuple[float, int, asyncio.Future, int, Flow]] = []
+        self._sequence = 0
+        # The start tag of the last document admitted from the queue, and the tag after the last document of
+        # each flow
+        self._virtual_time = 0.0
+        self._finish_tags: Dict[Flow, float] = {}
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def queued_by_tenant(self) -> Dict[str, int]:
+        queued: Dict[str, int] = {}
+        for *_, flow in self._waiters:
+            queued[flow.tenant] = queued.get(flow.tenant, 0) + 1
+        return queued
+
+    def _fits(self, weight: int) -> bool:
+        if self.in_flight >= self.max_in_flight:
+            return False
+        return self.in_flight == 0 or self.in_flight_bytes + weight <= self.max_in_flight_bytes
+
+    def _admit(self, weight: int) -> bool:
+        """Admit a document of weight bytes if it fits, across all workers when the limits are shared"""
+        if self.shared is not None:
+            if not self.shared.try_admit(weight, self.max_in_flight, self.max_in_flight_bytes):
+                return False
+        elif not self._fits(weight):
+            return False
+        self.in_flight += 1
+        self.in_flight_bytes += weight
+        return True
+
+    def _reject(self, status_code: int, detail: str) -> HTTPException:
+        self.rejected += 1
+        logger.warning(f"Rejected document: {detail}")
+        return HTTPException(
+            status_code=status_code,
+            detail=detail,
+            headers={"Retry-After": str(self.retry_after)}
+        )
+
+    async def acquire(self, weight: int = 0, flow: Flow = DEFAULT_FLOW):
+        """
+        Wait until a document of weight bytes, of the flow, may be sent to Tika
+        """
+        if not self._waiters and self._admit(weight):
+            return
+        if len(self._waiters) >= self.max_queue:
+            raise self._reject(429, "Too many documents are waiting to be processed")
+        if self.max_queue_per_tenant and self.queued_by_tenant().get(flow.tenant, 0) >= self.max_queue_per_tenant:
+            raise self._reject(429, f"Too many documents of tenant {flow.tenant} are waiting to be processed")
+
+        start = max(self._virtual_time, self._finish_tags.get(flow, 0.0))
+        self._finish_tags[flow] = start + 1 / flow.weight
+        self._sequence += 1
+        waiter = (start, self._sequence, asyncio.get_running_loop().create_future(), weight, flow)
+        heapq.heappush(self._waiters, waiter)
+        if self.shared is not None and self._poller is None:
+            self._poller = asyncio.create_task(self._poll())
+        try:
+            await asyncio.wait_for(waiter[2], self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            future = waiter[2]
+            if future.done() and not future.cancelled():
+                # The document was admitted just as it gave up waiting
+                self.release(weight)
+            else:
+                future.cancel()
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    heapq.heapify(self._waiters)
+                # Documents behind this one may fit now
+                self._wake()
+            if isinstance(e, asyncio.TimeoutError):
+                raise self._reject(503, f"Timed out after waiting {self.queue_timeout} seconds to be processed")
+            raise
+
+    def release(self, weight: int = 0):
+        self.in_flight -= 1
+        self.in_flight_bytes -= weight
+        if self.shared is not None:
+            self.shared.release(weight)
+        self._wake()
+
+    def _wake(self):
+        while self._waiters:
+            # A document which gave up waiting in this tick is still queued, as its task has not run yet
+            if self._waiters[0][2].done():
+                heapq.heappop(self._waiters)
+                continue
+            if not self._admit(self._waiters[0][3]):
+                break
+            start, _, future, weight, _ = heapq.heappop(self._waiters)
+            self._virtual_time = start
+            future.set_result(None)
+
+    async def _poll(self):
+        """Admit waiting documents as other workers release theirs, for as long as any are waiting"""
+        try:
+            while self._waiters:
+                await asyncio.sleep(self.poll_interval)
+                self._wake()
+        finally:
+            self._poller = None
+
+    @asynccontextmanager
+    async def slot(self, weight: int = 0, flow: Flow = DEFAULT_FLOW) -> AsyncIterator[None]:
+        await self.acquire(weight, flow)
+        try:
+            yield
+        finally:
+            self.release(weight)
+
+
+def create_limiter() -> ConcurrencyLimiter:
+    """Create the admission gate configured in the settings"""
+    return ConcurrencyLimiter(
+        max_in_flight=settings.TIKA_MAX_IN_FLIGHT,
+        max_in_flight_bytes=settings.TIKA_MAX_IN_FLIGHT_BYTES,
+        max_queue=settings.TIKA_QUEUE_SIZE,
+        queue_timeout=settings.TIKA_QUEUE_TIMEOUT,
+        retry_after=settings.RETRY_AFTER_SECONDS,
+        max_queue_per_tenant=settings.TIKA_TENANT_QUEUE_SIZE,
+        shared=get_shared_state()
+    )
@@ -0,0 +1,223 @@
+import io
+import mimetypes
+import struct
+import zipfile
+from typing import Optional, Tuple
+from loguru import logger
+from app.config import settings
+from app.core.logs import annotate
+from app.core.metrics import MIME_DETECTIONS
+
+try:
+    import magic
+except ImportError:  # pragma: no cover - libmagic is missing on some platforms, e.g. Windows
+    magic = None
+
+# Content types clients send when they do not know the type of a document, which are detected instead
+GENERIC_MIME_TYPES = {
+    "application/octet-stream",
+    "binary/octet-stream",
+    "application/unknown",
+    "application/x-www-form-urlencoded",
+    "multipart/form-data",
+    "application/x-download",
+    "application/force-download",
+}
+
+# Signatures at the start of a document, as prefix and MIME type, checked in order
+SIGNATURES = (
+    (b"%PDF-", "application/pdf"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"II*\x00", "image/tiff"),
+    (b"MM\x00*", "image/tiff"),
+    (b"{\\rtf", "text/rtf"),
+    (b"%!PS", "application/postscript"),
+)
+ZIP_SIGNATURE = b"PK\x03\x04"
+UTF8_BOM = b"\xef\xbb\xbf"
+OLE2_SIGNATURE = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+
+# Top level directories of the zip containers of Office Open XML documents
+OOXML_DIRECTORIES = {
+    "word/": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "xl/": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "ppt/": "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+}
+# Streams of OLE2 compound documents written by the old binary Office formats
+OLE2_STREAMS = {
+    "WordDocument": "application/msword",
+    "Workbook": "application/vnd.ms-excel",
+    "Book": "application/vnd.ms-excel",
+    "PowerPoint Document": "application/vnd.ms-powerpoint",
+}
+
+
+def _signature_type(content: bytes) -> Optional[str]:
+    """The MIME type given by a signature at the start of the document, if any"""
+    for signature, mime_type in SIGNATURES:
+        if content.startswith(signature):
+            return mime_type
+    if content[:4] == b"RIFF" and content[8:12] == b"WEBP":
+        return "image/webp"
+    if content.startswith(ZIP_SIGNATURE):
+        return _zip_type(content)
+    if content.startswith(OLE2_SIGNATURE):
+        return _ole2_type(content)
+    return None
+
+
+def _zip_type(content: bytes) -> Optional[str]:
+    """
+    The type of a zip container from the names of its entries, without decompressing any of them.
+    The central directory at the end is read when the whole document is given, otherwise the names in the
+    local headers at the start of the document are used.
+    """
+    # OpenDocument and EPUB start with an uncompressed "mimetype" entry holding their MIME type
+    if content[30:38] == b"mimetype":
+        name_length, extra_length = struct.unpack_from("<HH", content, 26)
+        size = struct.unpack_from("<I", content, 18)[0]
+        start = 30 + name_length + extra_length
+        mime_type = content[start:start + size].decode("ascii", "ignore").strip()
+        if mime_type:
+            return mime_type
+    try:
+        names = zipfile.ZipFile(io.BytesIO(content)).namelist()
+    except (zipfile.BadZipFile, ValueError, OSError):
+        # Only the start of the document is given: look for the names in the local headers
+        for directory, mime_type in OOXML_DIRECTORIES.items():
+            if directory.encode() in content:
+                return mime_type
+        return None
+    for directory, mime_type in OOXML_DIRECTORIES.items():
+        if any(name.startswith(directory) for name in names):
+            return mime_type
+    return None
+
+
+def _ole2_type(content: bytes) -> Optional[str]:
+    """
+    The type of an OLE2 compound document from the stream names in the first sector of its directory
+    """
+    if len(content) < 512:
+        return None
+    sector_size = 1 << struct.unpack_from("<H", content, 30)[0]
+    directory_sector = struct.unpack_from("<I", content, 48)[0]
+    start = (directory_sector + 1) * sector_size
+    directory = content[start:start + sector_size]
+    # Directory entries are 128 bytes and start with the name in UTF-16, followed by its length in bytes at 64
+    for offset in range(0, len(directory) - 127, 128):
+        name_length = struct.unpack_from("<H", directory, offset + 64)[0]
+        name = directory[offset:offset + max(0, min(name_length, 64) - 2)].decode("utf-16-le", "ignore")
+        if name in OLE2_STREAMS:
+            return OLE2_STREAMS[name]
+    return None
+
+
+def _looks_like_text(content: bytes) -> bool:
+    """Whether the start of the document is UTF-8 text without control characters"""
+    sample = content[:settings.MIME_SNIFF_BYTES].removeprefix(UTF8_BOM)
+    if not sample or b"\x00" in sample:
+        return False
+    try:
+        text = sample.decode("utf-8")
+    except UnicodeDecodeError as e:
+        # A multi-byte character may be cut off at the end of the sample
+        if e.start < len(sample) - 3:
+            return False
+        text = sample[:e.start].decode("utf-8")
+    return all(char.isprintable() or char in "\r\n\t\f\v" for char in text)
+
+
+def _filename_type(filename: Optional[str]) -> Optional[str]:
+    return mimetypes.guess_type(filename)[0] if filename else None
+
+
+def _text_type(content: bytes) -> str:
+    """The type of a document which looks like text: HTML or XML when it starts like them, otherwise text/plain"""
+    start = content[:64].removeprefix(UTF8_BOM).lstrip().lower()
+    if start.startswith((b"<!doctype html", b"<html")):
+        return "text/html"
+    if start.startswith(b"<?xml"):
+        return "application/xml"
+    return "text/plain"
+
+
+class MimeDetector:
+    """
+    Detects the MIME type of documents in tiers, cheapest first:
+
+    1. a specific Content-Type sent by the client,
+    2. signatures at the start of the document, with zip and OLE2 containers told apart by their directories,
+    3. for documents which look like text, the extension of the filename, otherwise HTML or XML markup at
+       their start, otherwise text/plain,
+    4. libmagic on at most max_magic_bytes of the document,
+    5. the extension of the filename.
+
+    The tier which decided each detection is counted in the metrics.
+    """
+    def __init__(self, max_magic_bytes: int):
+        self.max_magic_bytes = max_magic_bytes
+
+    def detect(self, content: bytes, filename: str = None, provided_mime_type: str = None) -> str:
+        mime_type, tier = self._detect(content, filename, provided_mime_type)
+        MIME_DETECTIONS.inc(tier)
+        annotate(mime_type=mime_type, mime_tier=tier)
+        return mime_type
+
+    def _detect(self, content: bytes, filename: str = None, provided_mime_type: str = None) -> Tuple[str, str]:
+        if provided_mime_type and provided_mime_type.split(";", 1)[0].strip().lower() not in GENERIC_MIME_TYPES:
+            return provided_mime_type, "client"
+
+        try:
+            mime_type = _signature_type(content)
+        except struct.error:
+            # A truncated or corrupt container
+            mime_type = None
+        if mime_type:
+            return mime_type, "signature"
+
+        # Text is told apart without libmagic, which would take longer to say it is text
+        if _looks_like_text(content):
+            mime_type = _filename_type(filename)
+            if mime_type:
+                return mime_type, "filename"
+            return _text_type(content), "text"
+
+        mime_type = self._magic(content)
+        if mime_type:
+            return mime_type, "libmagic"
+
+        mime_type = _filename_type(filename)
+        if mime_type:
+            return mime_type, "filename"
+
+        logger.warning("Failed to detect MIME type, using application/octet-stream as a fallback")
+        return "application/octet-stream", "fallback"
+
+    def _magic(self, content: bytes) -> Optional[str]:
+        """libmagic on a bounded prefix of the document"""
+        if magic is None:
+            return None
+        try:
+            mime_type = magic.from_buffer(content[:self.max_magic_bytes], mime=True)
+        except Exception as e:
+            logger.warning(f"Error detecting MIME type with libmagic: {str(e)}")
+            return None
+        # libmagic falls back to these when it does not recognise the document
+        if mime_type in ("application/octet-stream", "application/x-empty"):
+            return None
+        return mime_type
+
+
+def load_magic():
+    """Load libmagic and its database, which otherwise happens on the first detection of a document"""
+    if magic is not None:
+        magic.from_buffer(b"", mime=True)
+
+
+def create_mime_detector() -> MimeDetector:
+    """Create the MIME detector configured in the settings"""
+    return MimeDetector(settings.MIME_MAGIC_BYTES)
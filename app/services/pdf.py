@@ -0,0 +1,44 @@
+import io
+from typing import List, Optional, Tuple
+from loguru import logger
+
+try:
+    from pypdf import PdfReader, PdfWriter
+except ImportError:  # pragma: no cover - pypdf is optional
+    PdfReader = PdfWriter = None
+
+# A part of a split PDF: its first and last page, counted from 1, and the PDF of just those pages
+PdfPart = Tuple[int, int, bytes]
+
+
+def pdf_splitting_available() -> bool:
+    """Whether PDFs can be split into page ranges, which needs pypdf"""
+    return PdfReader is not None
+
+
+def split_pdf(content: bytes, pages_per_part: int, min_pages: int) -> Optional[List[PdfPart]]:
+    """
+    Split a PDF into parts of pages_per_part pages. Returns None when the PDF has fewer than min_pages pages,
+    or can not be split, in which case it should be extracted whole.
+    This is CPU bound and is a module level function, so it can be run in the conversion pool.
+    """
+    try:
+        reader = PdfReader(io.BytesIO(content))
+        if reader.is_encrypted:
+            return None
+        pages = len(reader.pages)
+        if pages < max(min_pages, 2):
+            return None
+        parts = []
+        for first in range(0, pages, pages_per_part):
+            last = min(first + pages_per_part, pages)
+            writer = PdfWriter()
+            for index in range(first, last):
+                writer.add_page(reader.pages[index])
+            buffer = io.BytesIO()
+            writer.write(buffer)
+            parts.append((first + 1, last, buffer.getvalue()))
+        return parts
+    except Exception as e:
+        logger.warning(f"Failed to split PDF, extracting it whole: {str(e)}")
+        return None
@@ -0,0 +1,112 @@
+import json
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, List, Literal, Optional, Tuple
+from loguru import logger
+from pydantic import BaseModel, Field, TypeAdapter
+from app.config import settings
+from app.services.converters import CONVERTERS
+
+# The action of extracting text locally instead of with Tika
+PASSTHROUGH = "passthrough"
+
+
+class RoutingRule(BaseModel):
+    """
+    A rule of the routing table. It matches documents of any of mime_types, given exactly, as "type/*" or as "*",
+    of at least min_bytes and at most max_bytes, and routes them to a Tika endpoint with extra Tika request
+    headers and a converter, or to local passthrough of the document as text.
+    """
+    mime_types: List[str] = Field(min_length=1)
+    min_bytes: int = Field(0, ge=0)
+    max_bytes: Optional[int] = Field(None, ge=0)
+    action: Literal["tika", "passthrough"] = "tika"
+    endpoint: Literal["tika", "tika/text", "rmeta"] = "tika"
+    headers: Dict[str, str] = {}
+    converter: Optional[str] = None
+
+
+@dataclass
+class Route:
+    """Where and how a document is extracted"""
+    # A Tika endpoint or PASSTHROUGH
+    endpoint: str
+    # Extra headers of the Tika request, such as X-Tika-PDFOcrStrategy
+    headers: Dict[str, str] = field(default_factory=dict)
+    # Converter of the HTML output, unless the request asks for one
+    converter: Optional[str] = None
+
+    @property
+    def passthrough(self) -> bool:
+        return self.endpoint == PASSTHROUGH
+
+
+class RoutingTable:
+    """
+    Rules compiled into lookups by exact MIME type, by top-level type and for any type. The first rule, in the
+    order of the table, which matches the MIME type and size of a document decides its route.
+    """
+    def __init__(self, rules: List[RoutingRule]):
+        for rule in rules:
+            if rule.converter is not None and rule.converter not in CONVERTERS:
+                raise ValueError(f"Unknown converter {rule.converter} in routing rule for {', '.join(rule.mime_types)}")
+        self.rules = rules
+        self._exact: Dict[str, List[int]] = {}
+        self._by_type: Dict[str, List[int]] = {}
+        self._any: List[int] = []
+        for index, rule in enumerate(rules):
+            for pattern in rule.mime_types:
+                pattern = pattern.strip().lower()
+                if pattern == "*" or pattern == "*/*":
+                    self._any.append(index)
+                elif pattern.endswith("/*"):
+                    self._by_type.setdefault(pattern[:-2], []).append(index)
+                else:
+                    self._exact.setdefault(pattern, []).append(index)
+        self._routes = [
+            Route(PASSTHROUGH if rule.action == PASSTHROUGH else rule.endpoint, dict(rule.headers), rule.converter)
+            for rule in rules
+        ]
+        # The candidate rules of a MIME type are merged once, as documents mostly come in a few types
+        self._candidates = lru_cache(maxsize=1024)(self._merge_candidates)
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def _merge_candidates(self, mime_type: str) -> Tuple[int, ...]:
+        top_level = mime_type.split("/", 1)[0]
+        return tuple(sorted(set(
+            self._exact.get(mime_type, []) + self._by_type.get(top_level, []) + self._any
+        )))
+
+    def lookup(self, mime_type: str, size: Optional[int] = None) -> Optional[Route]:
+        """
+        The route of a document of the MIME type and size, or None when no rule matches.
+        A document of unknown size only matches rules without a size range.
+        """
+        mime_type = mime_type.split(";", 1)[0].strip().lower()
+        for index in self._candidates(mime_type):
+            rule = self.rules[index]
+            if size is None:
+                if rule.min_bytes or rule.max_bytes is not None:
+                    continue
+            elif size < rule.min_bytes or (rule.max_bytes is not None and size > rule.max_bytes):
+                continue
+            return self._routes[index]
+        return None
+
+
+def load_routing_table(path: str) -> RoutingTable:
+    """Load a routing table from a JSON file holding a list of rules"""
+    with open(path) as fp:
+        rules = TypeAdapter(List[RoutingRule]).validate_python(json.load(fp))
+    return RoutingTable(rules)
+
+
+def create_routing_table() -> RoutingTable:
+    """Create the routing table in the file ROUTING_TABLE, or an empty one leaving all routing to the defaults"""
+    if not settings.ROUTING_TABLE:
+        return RoutingTable([])
+    table = load_routing_table(settings.ROUTING_TABLE)
+    logger.info(f"Loaded {len(table)} routing rules from {settings.ROUTING_TABLE}")
+    return table
@@ -0,0 +1,125 @@
+import multiprocessing
+import time
+from typing import Optional, Tuple
+
+# Bytes of the version string of a backend kept in shared memory
+VERSION_BYTES = 64
+
+
+class SharedState:
+    """
+    State shared by the worker processes of the server, in shared memory created by the parent process before
+    the workers are forked: the documents and bytes each worker has admitted to Tika, so that the admission
+    limits hold for the whole instance, and the circuit breakers and last probe results of the Tika backends.
+
+    Every access is a few memory reads or writes under one lock shared by the processes, so it is cheap enough
+    to be made from the event loop. Counters are kept per worker, so those of a worker which died can be reset.
+    """
+    def __init__(self, workers: int, backends: int):
+        self.workers = workers
+        self._lock = multiprocessing.Lock()
+        self._in_flight = multiprocessing.RawArray("q", workers)
+        self._in_flight_bytes = multiprocessing.RawArray("q", workers)
+        # Per backend: until when it is ejected (time.monotonic(), which is the same in every process), and the
+        # time, latency, success and version of its last probe
+        self._ejected_until = multiprocessing.RawArray("d", backends)
+        self._probed_at = multiprocessing.RawArray("d", backends)
+        self._probe_latency = multiprocessing.RawArray("d", backends)
+        self._probe_ok = multiprocessing.RawArray("b", backends)
+        self._versions = multiprocessing.RawArray("c", backends * VERSION_BYTES)
+        # When a worker last claimed a probe round (time.monotonic()), and when the last round completed
+        self._probe_claimed_at = multiprocessing.RawValue("d", 0.0)
+        self._checked_at = multiprocessing.RawValue("d", 0.0)
+        # The worker using the state, set in each worker after it is forked
+        self.worker = 0
+
+    @property
+    def in_flight(self) -> int:
+        """Documents admitted to Tika by all workers"""
+        with self._lock:
+            return sum(self._in_flight)
+
+    def try_admit(self, weight: int, max_in_flight: int, max_in_flight_bytes: int) -> bool:
+        """
+        Admit a document of weight bytes when it fits in the limits across all workers, see ConcurrencyLimiter
+        """
+        with self._lock:
+            in_flight = sum(self._in_flight)
+            if in_flight >= max_in_flight:
+                return False
+            if in_flight and sum(self._in_flight_bytes) + weight > max_in_flight_bytes:
+                return False
+            self._in_flight[self.worker] += 1
+            self._in_flight_bytes[self.worker] += weight
+            return True
+
+    def release(self, weight: int):
+        with self._lock:
+            self._in_flight[self.worker] -= 1
+            self._in_flight_bytes[self.worker] -= weight
+
+    def reset_worker(self, worker: int):
+        """Forget the documents admitted by a worker which exited"""
+        with self._lock:
+            self._in_flight[worker] = 0
+            self._in_flight_bytes[worker] = 0
+
+    def ejected_until(self, backend: int) -> float:
+        return self._ejected_until[backend]
+
+    def set_ejected_until(self, backend: int, ejected_until: float):
+        self._ejected_until[backend] = ejected_until
+
+    def claim_probe(self, interval: float) -> bool:
+        """
+        Whether this worker should run the probe round due every interval seconds, which is claimed by the
+        first worker asking for it, so that the backends are probed once per interval whatever the workers
+        """
+        now = time.monotonic()
+        with self._lock:
+            # Some slack, as the workers' timers drift apart
+            if now - self._probe_claimed_at.value < interval * 0.9:
+                return False
+            self._probe_claimed_at.value = now
+            return True
+
+    @property
+    def checked_at(self) -> Optional[float]:
+        """When the last probe round completed, as time.time()"""
+        return self._checked_at.value or None
+
+    @checked_at.setter
+    def checked_at(self, checked_at: float):
+        self._checked_at.value = checked_at
+
+    def publish_probe(self, backend: int, probed_at: float, latency: float, ok: bool, version: Optional[str]):
+        encoded = (version or "").encode("utf-8", "replace")[:VERSION_BYTES]
+        start = backend * VERSION_BYTES
+        with self._lock:
+            self._probed_at[backend] = probed_at
+            self._probe_latency[backend] = latency
+            self._probe_ok[backend] = ok
+            self._versions[start:start + VERSION_BYTES] = encoded.ljust(VERSION_BYTES, b"\0")
+
+    def probe_result(self, backend: int) -> Tuple[Optional[float], float, bool, Optional[str]]:
+        """When a backend was last probed, None if never, the probe's latency, success and the version"""
+        start = backend * VERSION_BYTES
+        with self._lock:
+            probed_at = self._probed_at[backend]
+            version = self._versions[start:start + VERSION_BYTES].rstrip(b"\0").decode("utf-8", "replace")
+            return probed_at or None, self._probe_latency[backend], bool(self._probe_ok[backend]), version or None
+
+
+_state: Optional[SharedState] = None
+
+
+def create_shared_state(workers: int, backends: int) -> SharedState:
+    """Create the state shared by the workers of the server, which must happen before they are forked"""
+    global _state
+    _state = SharedState(workers, backends)
+    return _state
+
+
+def get_shared_state() -> Optional[SharedState]:
+    """The state shared with the other workers of the server, or None when the server runs one process"""
+    return _state
@@ -0,0 +1,43 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+
+class SingleFlight:
+    """
+    De-duplicates concurrent calls with the same key: while a call is in flight, later calls with its key wait
+    for it and share its result, or its error, instead of doing the work again.
+
+    The work runs in its own task, so it is not cancelled when the request that started it is.
+    """
+    def __init__(self):
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        # Number of calls which did the work, and number of calls which shared the result of another call
+        self.executed = 0
+        self.coalesced = 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._in_flight)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Run fn unless a call with the same key is already in flight.
+        Returns the result and whether it was shared from another call.
+        """
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task), True
+
+        self.executed += 1
+        task = asyncio.ensure_future(fn())
+        self._in_flight[key] = task
+        task.add_done_callback(lambda done: self._done(key, done))
+        return await asyncio.shield(task), False
+
+    def _done(self, key: str, task: asyncio.Task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        # Mark the error as retrieved, in case every waiting call was cancelled
+        if not task.cancelled():
+            task.exception()
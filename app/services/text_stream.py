@@ -0,0 +1,197 @@
+import json
+import re
+from typing import Any, Dict, List, Optional
+
+# An incomplete \u escape at the end of a piece
+_PARTIAL_UNICODE_ESCAPE = re.compile(r"\\u[0-9a-fA-F]{0,3}$")
+# A high surrogate escape at the end of a piece, which must be decoded together with the low surrogate after it
+_HIGH_SURROGATE_ESCAPE = re.compile(r"\\u[dD][89abAB][0-9a-fA-F]{2}$")
+_WHITESPACE = " \t\r\n"
+# A quote which may close the content string, as it is followed by the end of the value or of the chunk.
+# Only these quotes are checked for being escaped, which is much faster than checking every quote in the text.
+_CLOSING_QUOTE = re.compile(r'"[ \t\r\n]*(?:[,}]|$)')
+
+
+def _backslashes_before(data: str, index: int, start: int = 0) -> int:
+    """Number of consecutive backslashes right before index, not looking before start"""
+    count = 0
+    while index - count - 1 >= start and data[index - count - 1] == "\\":
+        count += 1
+    return count
+
+
+def _string_end(data: str, start: int) -> Optional[int]:
+    """Index of the first unescaped quote at or after start, or None when there is none in data"""
+    index = start
+    while True:
+        index = data.find("\"", index)
+        if index == -1:
+            return None
+        if _backslashes_before(data, index, start) % 2 == 0:
+            return index
+        index += 1
+
+
+def _escape_start(pattern: re.Pattern, piece: str, end: int) -> int:
+    """Where an escape matching pattern, which ends at end, starts in piece, or end if there is none"""
+    # The escapes are at most 6 characters long, so only the end of the piece is searched
+    match = pattern.search(piece, max(0, end - 6), end)
+    if match and _backslashes_before(piece, match.start()) % 2 == 0:
+        return match.start()
+    return end
+
+
+class TikaTextJsonStream:
+    """
+    Incremental parser of the JSON object returned by Tika's /tika/text endpoint, which holds the metadata of
+    a document and its text in X-TIKA:content. The text is decoded and handed out piece by piece while the
+    response arrives, while the other values, which are small, are collected into metadata.
+    """
+    def __init__(self, content_key: str = "X-TIKA:content"):
+        self.content_key = content_key
+        self.metadata: Dict[str, Any] = {}
+        # "start", "key_or_end", "key_start", "key", "colon", "value_start", "value", "content", "comma" or "end"
+        self._state = "start"
+        # Unparsed end of the previous chunk
+        self._buffer = ""
+        self._key: Optional[str] = None
+        # Nesting depth and string state of a value other than the content while it is buffered
+        self._value: List[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, chunk: str) -> List[str]:
+        """Parse the next chunk of the response, returning the pieces of text it holds"""
+        data = self._buffer + chunk
+        self._buffer = ""
+        pieces: List[str] = []
+        position = 0
+        while position < len(data):
+            if self._state == "content":
+                position = self._feed_content(data, position, pieces)
+            elif self._state == "value":
+                position = self._feed_value(data, position)
+            elif self._state == "key":
+                end = _string_end(data, position + 1)
+                if end is None:
+                    self._buffer = data[position:]
+                    break
+                self._key = json.loads(data[position:end + 1])
+                self._state = "colon"
+                position = end + 1
+            else:
+                position = self._feed_structure(data, position)
+        return pieces
+
+    def _feed_structure(self, data: str, position: int) -> int:
+        char = data[position]
+        if char in _WHITESPACE or self._state == "end":
+            return position + 1
+        if self._state == "start" and char == "{":
+            self._state = "key_or_end"
+        elif self._state in ("key_or_end", "key_start") and char == "\"":
+            # The key is parsed from its opening quote
+            self._state = "key"
+            return position
+        elif self._state in ("key_or_end", "comma") and char == "}":
+            self._state = "end"
+        elif self._state == "comma" and char == ",":
+            self._state = "key_start"
+        elif self._state == "colon" and char == ":":
+            self._state = "value_start"
+        elif self._state == "value_start":
+            if self._key == self.content_key and char == "\"":
+                self._state = "content"
+            else:
+                self._state = "value"
+                self._depth = 0
+                self._in_string = False
+                self._escaped = False
+                return position
+        else:
+            raise ValueError(f"Unexpected {char!r} in Tika JSON response")
+        return position + 1
+
+    def _feed_content(self, data: str, position: int, pieces: List[str]) -> int:
+        """Decode the content string from position up to its closing quote, or as far as data allows"""
+        end = None
+        for match in _CLOSING_QUOTE.finditer(data, position):
+            if _backslashes_before(data, match.start(), position) % 2 == 0:
+                end = match.start()
+                break
+        if end is not None:
+            piece = data[position:end]
+            self._state = "comma"
+            next_position = end + 1
+        else:
+            piece = data[position:]
+            # Hold back an escape sequence which is cut off at the end of the chunk
+            cut = len(piece)
+            if _backslashes_before(piece, cut) % 2 == 1:
+                cut -= 1
+            else:
+                cut = _escape_start(_PARTIAL_UNICODE_ESCAPE, piece, cut)
+            cut = _escape_start(_HIGH_SURROGATE_ESCAPE, piece, cut)
+            self._buffer = piece[cut:]
+            piece = piece[:cut]
+            next_position = len(data)
+        if piece:
+            pieces.append(json.loads(f"\"{piece}\""))
+        return next_position
+
+    def _feed_value(self, data: str, position: int) -> int:
+        """Buffer a value other than the content until it is complete, then parse it into the metadata"""
+        start = position
+        while position < len(data):
+            char = data[position]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == "\"":
+                    self._in_string = False
+            elif char == "\"":
+                self._in_string = True
+            elif char in "[{":
+                self._depth += 1
+            elif char in "]}" and self._depth > 0:
+                self._depth -= 1
+            elif char in ",}" and self._depth == 0:
+                self._value.append(data[start:position])
+                self.metadata[self._key] = json.loads("".join(self._value))
+                self._value.clear()
+                self._state = "comma"
+                return position
+            position += 1
+        self._value.append(data[start:])
+        return position
+
+    def close(self):
+        """Check that the whole response has been parsed"""
+        if self._state != "end":
+            raise ValueError("Tika JSON response ended early")
+
+
+class TextTrimmer:
+    """
+    Strips leading and trailing whitespace from text given in pieces, holding back whitespace until it is known
+    not to end the text
+    """
+    def __init__(self):
+        self.empty = True
+        self._pending = ""
+
+    def feed(self, piece: str) -> str:
+        if self.empty:
+            piece = piece.lstrip()
+        stripped = piece.rstrip()
+        if not stripped:
+            if not self.empty:
+                self._pending += piece
+            return ""
+        out = self._pending + stripped
+        self._pending = piece[len(stripped):]
+        self.empty = False
+        return out
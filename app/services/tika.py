@@ -1,51 +1,130 @@
 from app.config import settings
-import requests
-from typing import Dict, Any, Tuple
-import mimetypes
+import asyncio
+import hashlib
+import random
+import time
+import httpx
+from contextlib import AsyncExitStack, asynccontextmanager, nullcontext
+from dataclasses import dataclass
+from functools import partial
+from typing import Dict, Any, List, Tuple, AsyncIterable, AsyncIterator, Awaitable, Union, Optional, Callable
 from loguru import logger
 # TODO: Add logging of what is requested and where it is sent to
 from fastapi import HTTPException
-from html2text import HTML2Text
-import magic
+from app.services.cache import CachedExtraction, ExtractionCache, make_cache_key
+from app.services.singleflight import SingleFlight
+from app.services.backends import BackendPool, TikaBackend, create_backend_pool
+from app.services.limiter import DEFAULT_FLOW, ConcurrencyLimiter, Flow
+from app.services.chunking import chunk_markdown
+from app.services.converters import ConversionPool, convert_document, get_converter
+from app.services.pdf import pdf_splitting_available, split_pdf
+from app.services.mime import MimeDetector, create_mime_detector
+from app.services.text_stream import TextTrimmer, TikaTextJsonStream
+from app.services.routing import PASSTHROUGH, Route, RoutingTable, create_routing_table
+from app.core.logs import annotate, content_preview
+from app.core.compression import compress_async, compressible
+from app.core.metrics import CACHE_LOOKUPS, STAGE_SECONDS, TIKA_RESPONSES, mime_label
+
+# Metadata keys giving the page range of a part of a split PDF
+PART_METADATA = ("page_start", "page_end")
+# Tika's recursive metadata endpoint, returning the metadata and XHTML content of a document and of every
+# document embedded in it
+RMETA_ENDPOINT = "rmeta"
+# Statuses of Tika, or of a proxy in front of it, after which a document is sent again
+RETRY_STATUSES = {502, 503, 504}
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """
+    Create the application-lifetime HTTP client used for all Tika calls.
+    Connections are kept alive and pooled across requests.
+    """
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=settings.TIKA_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.TIKA_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.TIKA_KEEPALIVE_EXPIRY
+        ),
+        # The timeouts of Tika calls are given per request, scaled by the size of the document
+        timeout=request_timeout(0)
+    )
+
+
+@dataclass
+class Extraction:
+    """
+    The documents, as text and metadata, extracted from a document. A document is extracted to one document,
+    except for a split PDF which is extracted to one document per part, and a container extracted through
+    RMETA_ENDPOINT which is extracted to one document for itself and one per embedded document.
+    """
+    documents: List[Tuple[str, Dict[str, Any]]]
+    # "hit" or "miss" when the extraction cache is enabled, and the cache tier of a hit
+    cache: Optional[str] = None
+    cache_tier: Optional[str] = None
+    # Whether the result was shared from an identical extraction which was already in flight
+    coalesced: bool = False
+
+    @property
+    def text(self) -> str:
+        """The text of the whole document"""
+        if len(self.documents) == 1:
+            return self.documents[0][0]
+        return "\n\n".join(text for text, _ in self.documents)
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        """The metadata of the whole document"""
+        return {key: value for key, value in self.documents[0][1].items() if key not in PART_METADATA}
+
+
+@dataclass
+class StreamedExtraction:
+    """
+    The text extracted from a document, handed out in pieces while the Tika response arrives.
+    metadata is complete once chunks is exhausted, and close releases the Tika response.
+    """
+    chunks: AsyncIterator[str]
+    metadata: Dict[str, Any]
+    close: Callable[[], Awaitable[None]]
+    # "hit" or "miss" when the extraction cache is enabled, and the cache tier of a hit
+    cache: Optional[str] = None
+    cache_tier: Optional[str] = None
+
 
 class TikaService:
-    def __init__(self):
-        self.base_url = settings.tika_url_with_auth.rstrip('/')
+    def __init__(
+            self,
+            client: httpx.AsyncClient,
+            cache: Optional[ExtractionCache] = None,
+            singleflight: Optional[SingleFlight] = None,
+            backends: Optional[BackendPool] = None,
+            limiter: Optional[ConcurrencyLimiter] = None,
+            conversion_pool: Optional[ConversionPool] = None,
+            mime_detector: Optional[MimeDetector] = None,
+            routing: Optional[RoutingTable] = None
+    ):
+        self.client = client
+        self.cache = cache
+        self.singleflight = singleflight
+        self.backends = backends or create_backend_pool()
+        self.limiter = limiter
+        self.conversion_pool = conversion_pool
+        self.mime_detector = mime_detector or create_mime_detector()
+        self.routing = routing if routing is not None else create_routing_table()
 
     async def is_available(self) -> bool:
-        try:
-            response = requests.get(f"{self.base_url}/version")
-            return response.ok
-        except Exception:
-            return False
-
-    # TODO: Instead of using this mime_type detection method, use the method used in
-    #   the owui_ingestion_test using magic.from_buffer and the containers (apt install) libmagic1
-    def _detect_mime_type(self, file_content: bytes, filename: str = None) -> str:
         """
-        Determine MIME type using multiple methods.
+        Probe all Tika backends. Tika is available when at least one of them answers.
+        This calls every backend, the breaker state alone is given by self.backends.available.
         """
-        try:
-            # Use python-magic to get MIME type from file content
-            mime_type = magic.from_buffer(file_content, mime=True)
-            logger.info(f"Detected MIME using system magic type: {mime_type}")
-            return mime_type
-        except Exception as e:
-            if filename is not None:
-                print(f"Error detecting MIME type for {filename}: {str(e)}")
-            else:
-                print(f"Error detecting MIME type: {str(e)}")
-
-        # Fallback to Python's mimetype detection
-        if filename:
-            guessed_type = mimetypes.guess_type(filename)[0]
-            logger.info(f"Detected MIME using Python's mimetype: {guessed_type}")
-            if guessed_type:
-                return guessed_type
+        await self.backends.probe(self.client)
+        return self.backends.available
 
-        logger.warning(f"Failed to detect MIME type using application/octet-stream as a fallback.")
-
-        return "application/octet-stream"
+    def _detect_mime_type(self, file_content: bytes, filename: str = None, provided_mime_type: str = None) -> str:
+        """
+        Determine MIME type using multiple methods, see MimeDetector.
+        """
+        return self.mime_detector.detect(file_content, filename, provided_mime_type)
 
     def _choose_tika_endpoint(self, mime_type: str) -> str:
         """
@@ -53,12 +132,44 @@ class TikaService:
         """
         # All documents beside pdfs should use the main tika endpoint for HTML output
         endpoint = "tika"
+        # Containers are extracted to a document per embedded document
+        if settings.RMETA_ENABLED and mime_type.split(";", 1)[0].strip().lower() in settings.rmeta_mime_types:
+            endpoint = RMETA_ENDPOINT
         # PDF documents should use the text endpoint
-        if mime_type == "application/pdf":
+        elif mime_type == "application/pdf":
             endpoint = "tika/text"
-        logger.info(f"Using Tika endpoint: {endpoint} for MIME type: {mime_type}")
+        logger.debug(f"Using Tika endpoint: {endpoint} for MIME type: {mime_type}")
         return endpoint
 
+    def _choose_route(self, mime_type: str, size: Optional[int] = None) -> Route:
+        """
+        Choose the route of a document from the routing table, or by the default routing of its MIME type
+        when no rule of the table matches
+        """
+        route = self.routing.lookup(mime_type, size)
+        if route is None:
+            return Route(self._choose_tika_endpoint(mime_type))
+        logger.debug(f"Using {route.endpoint} for MIME type: {mime_type} by the routing table")
+        annotate(routing_table=True)
+        return route
+
+    def _conversion_options(self, endpoint: str, converter: str = None) -> Dict[str, Any]:
+        """
+        Options deciding how the Tika response of the endpoint is converted to text
+        """
+        if endpoint == "tika/text":
+            if settings.PDF_SPLIT_ENABLED:
+                return {"pdf_split_pages": settings.PDF_SPLIT_PAGES}
+            return {}
+        return {"converter": converter or settings.CONVERTER}
+
+    def _cache_options(self, mime_type: str, route: Route, converter: str) -> Dict[str, Any]:
+        """Everything besides the document deciding its extraction, identifying it in the cache"""
+        options = {"Content-Type": mime_type, **self._conversion_options(route.endpoint, converter)}
+        if route.headers:
+            options["tika_headers"] = route.headers
+        return options
+
     async def process_document(
             self,
             file_content: bytes,
@@ -68,37 +179,446 @@ class TikaService:
         """
         Process document through appropriate Tika endpoint
         """
-        logger_msg = "Processing document"
-        if provided_mime_type:
-            logger_msg += f" of MIME type {provided_mime_type}"
-        if filename:
-            logger_msg += f" with name {filename}"
-        else:
-            content = file_content.decode('utf-8', 'ignore')
-            content_len = len(content)
-            content = content[:min(1024, content_len)]
-            logger_msg += f" which content starts with:\n{content}"
-        logger.info(logger_msg)
+        extraction = await self.extract(file_content, file_content, filename, provided_mime_type)
+        return extraction.text, extraction.metadata
+
+    async def process_stream(
+            self,
+            head: bytes,
+            body: AsyncIterable[bytes],
+            filename: str = None,
+            provided_mime_type: str = None
+    ) -> Tuple[str, Dict[str, Any]]:
+        """
+        Process a document which is forwarded to Tika chunk by chunk while it is read.
+        The MIME type is detected from head, the first bytes of the document, while body yields the full document.
+        """
+        extraction = await self.extract(head, body, filename, provided_mime_type)
+        return extraction.text, extraction.metadata
+
+    def _log_request(
+            self,
+            head: bytes,
+            filename: str = None,
+            provided_mime_type: str = None,
+            flow: Flow = DEFAULT_FLOW,
+            size: int = None
+    ):
+        """Add the document to the log event of the request, looking at no more than a bounded prefix of it"""
+        annotate(
+            tenant=flow.tenant,
+            priority=flow.priority,
+            filename=filename,
+            content_type=provided_mime_type,
+            bytes=size,
+            preview=content_preview(head)
+        )
+
+    def _route(
+            self,
+            head: bytes,
+            filename: str = None,
+            provided_mime_type: str = None,
+            converter: str = None,
+            size: int = None
+    ) -> Tuple[str, Route, str, Dict[str, Any]]:
+        """
+        The MIME type of the document, its route, the converter of its HTML output, which is the requested one,
+        that of the route or that of the settings, and the options identifying how it is extracted in the cache
+        """
+        # Use provided MIME type or detect it
+        started = time.perf_counter()
+        mime_type = self._detect_mime_type(head, filename, provided_mime_type)
+        STAGE_SECONDS.observe_since(started, "mime_detection", "", mime_label(mime_type))
+
+        # Choose the route based on MIME type and size
+        route = self._choose_route(mime_type, size)
+        converter = converter or route.converter or settings.CONVERTER
+        annotate(endpoint=route.endpoint)
+        return mime_type, route, converter, self._cache_options(mime_type, route, converter)
+
+    async def extract(
+            self,
+            head: bytes,
+            file_content: Union[bytes, AsyncIterable[bytes]],
+            filename: str = None,
+            provided_mime_type: str = None,
+            size: int = None,
+            converter: str = None,
+            flow: Flow = DEFAULT_FLOW
+    ) -> Extraction:
+        """
+        Process a document given either as bytes or as a stream of chunks, in which case head is the first bytes
+        of the document. Results are looked up in and stored to the extraction cache, when it is enabled, and
+        concurrent extractions of the same document are coalesced into one Tika call.
+        A streamed document can not be identified before it has been sent, so it is only stored to the cache.
+        size is the size of a streamed document, when it is known up front.
+        converter is the name of the converter engine for HTML output, by default the one in the settings.
+        flow is the fair queue of the tenant and priority the document waits in to be admitted to Tika.
+        """
+        streamed = not isinstance(file_content, bytes)
+        if not streamed:
+            size = len(file_content)
+        self._log_request(head, filename, provided_mime_type, flow, size)
         try:
-            # Use provided MIME type or detect it
-            mime_type = provided_mime_type or self._detect_mime_type(file_content, filename)
+            mime_type, route, converter, options = self._route(head, filename, provided_mime_type, converter, size)
+            endpoint = route.endpoint
+            if route.passthrough:
+                document = await self._passthrough(file_content, mime_type)
+                return Extraction(self._documents_metadata([document], endpoint, filename))
+
+            key = None
+            if not streamed and (self.cache is not None or self.singleflight is not None):
+                key = make_cache_key(await _digest(file_content), endpoint, options)
+
+            cache_status = None
+            hasher = None
+            if self.cache is not None:
+                cache_status = "miss"
+                annotate(cache=cache_status)
+                if not streamed:
+                    cached, tier = await self.cache.get(key)
+                    CACHE_LOOKUPS.inc("hit" if cached is not None else "miss", tier or "")
+                    if cached is not None:
+                        annotate(cache="hit", cache_tier=tier)
+                        return Extraction(
+                            self._documents_metadata(cached, endpoint, filename), "hit", tier
+                        )
+                else:
+                    hasher = hashlib.sha256()
+                    file_content = _hashing(file_content, hasher)
+
+            async def extract_and_store() -> CachedExtraction:
+                result = await self._extract_documents(
+                    file_content, mime_type, filename, endpoint, size or 0, converter, flow, route.headers
+                )
+                if self.cache is not None:
+                    cache_key = make_cache_key(hasher.hexdigest(), endpoint, options) if streamed else key
+                    await self.cache.set(cache_key, result)
+                return result
+
+            coalesced = False
+            if self.singleflight is not None and not streamed:
+                # Identical documents routed the same way, which are processed concurrently, share one Tika call
+                documents, coalesced = await self.singleflight.do(key, extract_and_store)
+                if coalesced:
+                    annotate(coalesced=True)
+            else:
+                documents = await extract_and_store()
+
+            return Extraction(
+                self._documents_metadata(documents, endpoint, filename), cache_status, coalesced=coalesced
+            )
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Error processing document: {str(e)}")
+            raise HTTPException(
+                status_code=500,
+                detail=f"Error processing document: {str(e)}"
+            )
 
-            # Prepare headers
-            headers = {"Content-Type": mime_type}
+    async def extract_streaming(
+            self,
+            head: bytes,
+            file_content: Union[bytes, AsyncIterable[bytes]],
+            filename: str = None,
+            provided_mime_type: str = None,
+            size: int = None,
+            converter: str = None,
+            flow: Flow = DEFAULT_FLOW
+    ) -> StreamedExtraction:
+        """
+        Process a document like extract, but hand out its text while the Tika response arrives instead of
+        holding the whole response and text in memory. Errors of Tika are raised before any text is handed out.
+        Cached extractions are used, but streamed extractions are neither stored in the cache, coalesced nor
+        split. A converter which can not convert while the response arrives is replaced by the xhtml one.
+        """
+        if isinstance(file_content, bytes):
+            size = len(file_content)
+        self._log_request(head, filename, provided_mime_type, flow, size)
+        stack = AsyncExitStack()
+        try:
+            mime_type, route, converter, options = self._route(head, filename, provided_mime_type, converter, size)
+            if route.passthrough:
+                text, metadata = self._documents_metadata(
+                    [await self._passthrough(file_content, mime_type)], PASSTHROUGH, filename
+                )[0]
+                return StreamedExtraction(_pieces(text), metadata, stack.aclose)
+            endpoint = route.endpoint
+            if endpoint == RMETA_ENDPOINT:
+                # The recursive metadata is one JSON document, so a container is streamed as one XHTML document
+                endpoint = "tika"
+            if endpoint != "tika/text" and not get_converter(converter).streaming:
+                logger.debug(f"Converter {converter} does not stream, streaming the response with xhtml")
+                converter = "xhtml"
+            options = self._cache_options(mime_type, Route(endpoint, route.headers), converter)
+
+            cache_status = None
+            if self.cache is not None:
+                cache_status = "miss"
+                annotate(cache=cache_status)
+                if isinstance(file_content, bytes):
+                    key = make_cache_key(await _digest(file_content), endpoint, options)
+                    cached, tier = await self.cache.get(key)
+                    CACHE_LOOKUPS.inc("hit" if cached is not None else "miss", tier or "")
+                    if cached is not None:
+                        annotate(cache="hit", cache_tier=tier)
+                        extraction = Extraction(self._documents_metadata(cached, endpoint, filename))
+                        return StreamedExtraction(
+                            _pieces(extraction.text), extraction.metadata, stack.aclose, "hit", tier
+                        )
+
+            headers = {"Content-Type": mime_type, **route.headers}
             if filename:
                 headers["X-Filename"] = filename
+            response = await stack.enter_async_context(
+                self._request(endpoint, file_content, headers, size or 0, flow)
+            )
+            if not response.is_success:
+                await response.aread()
+                raise HTTPException(
+                    status_code=response.status_code,
+                    detail=f"Tika service error: {response.text}"
+                )
+        except BaseException as e:
+            await stack.aclose()
+            if isinstance(e, HTTPException) or not isinstance(e, Exception):
+                raise
+            logger.error(f"Error processing document: {str(e)}")
+            raise HTTPException(
+                status_code=500,
+                detail=f"Error processing document: {str(e)}"
+            )
 
-            # Choose endpoint based on MIME type
-            endpoint = self._choose_tika_endpoint(mime_type)
+        metadata = {} if endpoint == "tika/text" else self._documents_metadata(
+            [("", {"Content-Type": mime_type})], endpoint, filename
+        )[0][1]
+        chunks = self._stream_text(response, endpoint, converter, metadata, stack)
 
-            # Send request to Tika
-            response = requests.put(
-                f"{self.base_url}/{endpoint}",
-                data=file_content,
-                headers=headers
+        async def close():
+            # A generator which was never started does not run its cleanup when closed, so the stack is closed too
+            await chunks.aclose()
+            await stack.aclose()
+
+        return StreamedExtraction(chunks, metadata, close, cache_status)
+
+    async def _stream_text(
+            self,
+            response: httpx.Response,
+            endpoint: str,
+            converter: str,
+            metadata: Dict[str, Any],
+            stack: AsyncExitStack
+    ) -> AsyncIterator[str]:
+        """
+        Convert the Tika response to text while it arrives, stripped of surrounding whitespace like extracted
+        text. The metadata of a /tika/text response is added to metadata once it has been parsed.
+        """
+        trimmer = TextTrimmer()
+        try:
+            if endpoint == "tika/text":
+                parser = TikaTextJsonStream()
+                async for chunk in response.aiter_text():
+                    for piece in parser.feed(chunk):
+                        text = trimmer.feed(piece)
+                        if text:
+                            yield text
+                parser.close()
+                metadata.update(parser.metadata)
+                if trimmer.empty:
+                    yield "<No text content found>"
+            else:
+                streaming_converter = get_converter(converter)
+                async for chunk in response.aiter_text():
+                    text = trimmer.feed(streaming_converter.feed(chunk))
+                    if text:
+                        yield text
+                text = trimmer.feed(streaming_converter.close())
+                if text:
+                    yield text
+        except Exception as e:
+            logger.error(f"Error streaming document: {str(e)}")
+            raise
+        finally:
+            await stack.aclose()
+
+    async def chunk(
+            self,
+            documents: List[Tuple[str, Dict[str, Any]]],
+            chunk_size: int,
+            chunk_overlap: int = 0
+    ) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Split the text of extracted documents into chunks following its Markdown structure, see chunk_markdown.
+        Large texts are chunked in the conversion pool. The chunks of each document keep its metadata, with its
+        document_index when there are several documents.
+        """
+        several = len(documents) > 1
+        chunked = await asyncio.gather(*(
+            self._convert(
+                partial(
+                    chunk_markdown,
+                    chunk_size=chunk_size,
+                    chunk_overlap=chunk_overlap,
+                    metadata={**metadata, "document_index": index} if several else metadata
+                ),
+                text,
+                "chunking",
+                metadata.get("Content-Type")
             )
+            for index, (text, metadata) in enumerate(documents)
+        ))
+        chunks = [chunk for document_chunks in chunked for chunk in document_chunks]
+        annotate(chunks=len(chunks))
+        return chunks
 
-            if not response.ok:
+    def _documents_metadata(
+            self,
+            documents: CachedExtraction,
+            endpoint: str,
+            filename: str = None
+    ) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Documents with the metadata they are returned with.
+        The metadata of converted documents is given the filename of the request.
+        """
+        if endpoint == "tika/text" or not filename:
+            return [(text, dict(metadata)) for text, metadata in documents]
+        return [(text, {**metadata, "X-Filename": filename}) for text, metadata in documents]
+
+    def _should_split(self, mime_type: str, endpoint: str, file_content: Union[bytes, AsyncIterable[bytes]]) -> bool:
+        """Whether the document is a PDF large enough to be opened and split into page ranges"""
+        return (
+            settings.PDF_SPLIT_ENABLED
+            and mime_type == "application/pdf"
+            and endpoint == "tika/text"
+            and isinstance(file_content, bytes)
+            and len(file_content) >= settings.PDF_SPLIT_MIN_BYTES
+            and pdf_splitting_available()
+        )
+
+    async def _extract_documents(
+            self,
+            file_content: Union[bytes, AsyncIterable[bytes]],
+            mime_type: str,
+            filename: str,
+            endpoint: str,
+            size: int = 0,
+            converter: str = None,
+            flow: Flow = DEFAULT_FLOW,
+            tika_headers: Dict[str, str] = None
+    ) -> CachedExtraction:
+        """
+        Extract the document whole, or, when it is a large PDF, split it into page ranges which are extracted
+        in parallel, each admitted and sent to a backend of its own, and returned in page order.
+        """
+        if self._should_split(mime_type, endpoint, file_content):
+            split = partial(
+                split_pdf, pages_per_part=settings.PDF_SPLIT_PAGES, min_pages=settings.PDF_SPLIT_MIN_PAGES
+            )
+            parts = await self._convert(split, file_content, "pdf_split", mime_type)
+            if parts:
+                annotate(parts=len(parts))
+                tasks = [
+                    asyncio.ensure_future(
+                        self._extract_with_tika(
+                            part, mime_type, filename, endpoint, len(part), converter, flow, tika_headers
+                        )
+                    )
+                    for _, _, part in parts
+                ]
+                try:
+                    results = await asyncio.gather(*tasks)
+                except BaseException:
+                    # Do not leave the other parts running when one of them fails
+                    for task in tasks:
+                        task.cancel()
+                    raise
+                return [
+                    (text, {**metadata, "page_start": first, "page_end": last})
+                    for (first, last, _), (text, metadata) in zip(parts, results)
+                ]
+        if endpoint == RMETA_ENDPOINT:
+            return await self._extract_embedded(
+                file_content, mime_type, filename, size, converter, flow, tika_headers
+            )
+        return [
+            await self._extract_with_tika(
+                file_content, mime_type, filename, endpoint, size, converter, flow, tika_headers
+            )
+        ]
+
+    async def _extract_embedded(
+            self,
+            file_content: Union[bytes, AsyncIterable[bytes]],
+            mime_type: str,
+            filename: str,
+            size: int = 0,
+            converter: str = None,
+            flow: Flow = DEFAULT_FLOW,
+            tika_headers: Dict[str, str] = None
+    ) -> CachedExtraction:
+        """
+        Extract a container with the recursive metadata endpoint into a document for the container itself,
+        followed by one for each document with text embedded in it at any depth, each with its own metadata.
+        The XHTML contents are converted in parallel in the conversion pool.
+        """
+        headers = {"Content-Type": mime_type, **(tika_headers or {})}
+        if filename:
+            headers["X-Filename"] = filename
+
+        async with self._request(RMETA_ENDPOINT, file_content, headers, size, flow) as response:
+            if not response.is_success:
+                await response.aread()
+                raise HTTPException(
+                    status_code=response.status_code,
+                    detail=f"Tika service error: {response.text}"
+                )
+            await response.aread()
+            items = response.json()
+
+        contents = [item.pop("X-TIKA:content", None) or "" for item in items]
+        convert = partial(convert_document, converter or settings.CONVERTER)
+        texts = await asyncio.gather(*(
+            self._convert(convert, content, mime_type=item.get("Content-Type")) if content else _completed("")
+            for content, item in zip(contents, items)
+        ))
+        annotate(embedded=len(items) - 1)
+        return [
+            (text.strip(), metadata)
+            for index, (text, metadata) in enumerate(zip(texts, items))
+            if index == 0 or text.strip()
+        ]
+
+    async def _extract_with_tika(
+            self,
+            file_content: Union[bytes, AsyncIterable[bytes]],
+            mime_type: str,
+            filename: str,
+            endpoint: str,
+            size: int = 0,
+            converter: str = None,
+            flow: Flow = DEFAULT_FLOW,
+            tika_headers: Dict[str, str] = None
+    ) -> Tuple[str, Dict[str, Any]]:
+        """
+        Send the document to the Tika endpoint and convert the response to text and metadata.
+        Streaming converters convert the response while it arrives, others convert it in the conversion pool.
+        """
+        # Prepare headers
+        headers = {"Content-Type": mime_type, **(tika_headers or {})}
+        if filename:
+            headers["X-Filename"] = filename
+
+        converter = converter or settings.CONVERTER
+        html = None
+
+        # Send request to Tika
+        async with self._request(endpoint, file_content, headers, size, flow) as response:
+            if not response.is_success:
+                await response.aread()
                 raise HTTPException(
                     status_code=response.status_code,
                     detail=f"Tika service error: {response.text}"
@@ -107,26 +627,268 @@ class TikaService:
             # Handle response based on endpoint
             if endpoint == "tika/text":
                 # Plain text response
+                await response.aread()
                 metadata = response.json()
                 text = metadata.pop("X-TIKA:content", "").strip()
                 if not text:
                     text = "<No text content found>"
+                return text, metadata
+
+            streaming_converter = get_converter(converter)
+            if streaming_converter.streaming:
+                # HTML response converted to markdown while it is received
+                parts = [streaming_converter.feed(chunk) async for chunk in response.aiter_text()]
+                parts.append(streaming_converter.close())
+                text = "".join(parts).strip()
             else:
-                # HTML response that needs to be converted to markdown
-                h = HTML2Text()
-                h.ignore_links = False
-                text = h.handle(response.text).strip()
-                metadata = {"Content-Type": mime_type}
-                if filename:
-                    metadata["X-Filename"] = filename
+                await response.aread()
+                html = response.text
 
-            return text, metadata
+        if html is not None:
+            # HTML response that needs to be converted to markdown
+            text = (await self._convert(partial(convert_document, converter), html, mime_type=mime_type)).strip()
+        metadata = {"Content-Type": mime_type}
 
-        except HTTPException:
-            raise
-        except Exception as e:
-            logger.error(f"Error processing document: {str(e)}")
-            raise HTTPException(
-                status_code=500,
-                detail=f"Error processing document: {str(e)}"
-            )
+        return text, metadata
+
+    async def _passthrough(
+            self,
+            file_content: Union[bytes, AsyncIterable[bytes]],
+            mime_type: str
+    ) -> Tuple[str, Dict[str, Any]]:
+        """
+        Extract a text document locally, without Tika, decoded with the charset of its MIME type or else as UTF-8
+        """
+        started = time.perf_counter()
+        if not isinstance(file_content, bytes):
+            file_content = b"".join([chunk async for chunk in file_content])
+        encoding = _charset(mime_type) or "utf-8-sig"
+        try:
+            "".encode(encoding)
+        except LookupError:
+            encoding = "utf-8-sig"
+        if len(file_content) > 1024 * 1024:
+            # Keep the event loop free while a large document is decoded
+            text = await asyncio.to_thread(file_content.decode, encoding, "replace")
+        else:
+            text = file_content.decode(encoding, "replace")
+        STAGE_SECONDS.observe_since(started, "passthrough", PASSTHROUGH, mime_label(mime_type))
+        return text.strip(), {"Content-Type": mime_type}
+
+    async def _convert(
+            self,
+            convert: Callable[[Any], Any],
+            document: Union[str, bytes],
+            stage: str = "conversion",
+            mime_type: str = None
+    ) -> Any:
+        """Convert the document with the conversion pool, or inline when there is no pool"""
+        started = time.perf_counter()
+        if self.conversion_pool is None:
+            converted = convert(document)
+        else:
+            converted = await self.conversion_pool.run(convert, document)
+        STAGE_SECONDS.observe_since(started, stage, "", mime_label(mime_type))
+        return converted
+
+    @asynccontextmanager
+    async def _request(
+            self,
+            endpoint: str,
+            file_content: Union[bytes, AsyncIterable[bytes]],
+            headers: Dict[str, str],
+            size: int = 0,
+            flow: Flow = DEFAULT_FLOW
+    ) -> AsyncIterator[httpx.Response]:
+        """
+        Send the document to the least loaded healthy Tika backend, once it is admitted by the limiter in its flow.
+        The response body is streamed and must be read within the context.
+
+        Documents in memory are sent again after connection errors and RETRY_STATUSES responses, up to
+        TIKA_MAX_ATTEMPTS times with a jittered backoff in between, while a streamed document can only be sent
+        once. When every backend is open, the document fails fast with 503 without waiting for admission.
+        Transport errors which are not retried are answered with 503, or 504 for a timeout.
+        """
+        if not self.backends.available:
+            raise self._unavailable()
+        mime_type = mime_label(headers.get("Content-Type"))
+        timeout = request_timeout(size)
+        queued = time.perf_counter()
+        async with self.limiter.slot(size, flow) if self.limiter is not None else nullcontext():
+            STAGE_SECONDS.observe_since(queued, "queue", endpoint, mime_type)
+            streamed = not isinstance(file_content, bytes)
+            if not streamed and self._should_compress(file_content, headers):
+                # Compressed once, and sent as is on every attempt
+                started = time.perf_counter()
+                file_content = await compress_async("gzip", file_content)
+                headers = {**headers, "Content-Encoding": "gzip"}
+                STAGE_SECONDS.observe_since(started, "compression", endpoint, mime_type)
+            attempts = 1 if streamed else max(1, settings.TIKA_MAX_ATTEMPTS)
+            tried = []
+            last_error = None
+            last_response = None
+            for attempt in range(attempts):
+                if attempt:
+                    await asyncio.sleep(retry_backoff(attempt))
+                # Backends not tried yet are preferred, a single backend is tried again
+                backend = self.backends.choose(exclude=tried) or self.backends.choose()
+                if backend is None:
+                    break
+                tried.append(backend)
+                last_attempt = attempt == attempts - 1
+
+                self.backends.started(backend, size)
+                started = time.perf_counter()
+                try:
+                    request = self.client.build_request(
+                        "PUT",
+                        f"{backend.url}/{endpoint}",
+                        content=file_content,
+                        headers=headers,
+                        timeout=timeout
+                    )
+                    response = await self.client.send(request, stream=True)
+                except httpx.TransportError as e:
+                    self.backends.finished(backend, size)
+                    self.backends.failed(backend)
+                    TIKA_RESPONSES.inc(backend.name, endpoint, "error")
+                    if last_attempt or not _retryable(e):
+                        raise _transport_error(e, backend)
+                    logger.warning(f"Tika backend {backend.name} failed, retrying: {str(e) or type(e).__name__}")
+                    last_error, last_response = e, None
+                    continue
+
+                if response.status_code in RETRY_STATUSES:
+                    await response.aread()
+                    self.backends.finished(backend, size)
+                    self.backends.failed(backend)
+                    TIKA_RESPONSES.inc(backend.name, endpoint, str(response.status_code))
+                    if not last_attempt:
+                        logger.warning(f"Tika backend {backend.name} responded {response.status_code}, retrying")
+                        last_error, last_response = None, response
+                        continue
+                    yield response
+                    return
+
+                # Other server errors are not retried, but still count against the backend, so one which answers
+                # every document with 500 is ejected
+                server_error = response.status_code >= 500
+                if server_error:
+                    self.backends.failed(backend)
+                try:
+                    yield response
+                except httpx.TransportError as e:
+                    if not server_error:
+                        self.backends.failed(backend)
+                    raise _transport_error(e, backend)
+                else:
+                    if not server_error:
+                        self.backends.succeeded(backend, time.perf_counter() - started)
+                finally:
+                    await response.aclose()
+                    self.backends.finished(backend, size)
+                    TIKA_RESPONSES.inc(backend.name, endpoint, str(response.status_code))
+                    STAGE_SECONDS.observe_since(started, "tika", endpoint, mime_type)
+                return
+
+            # The backends which were not tried became unavailable in the meantime
+            if last_response is not None:
+                yield last_response
+                return
+            if last_error is not None:
+                raise _transport_error(last_error)
+            raise self._unavailable()
+
+    @staticmethod
+    def _should_compress(file_content: bytes, headers: Dict[str, str]) -> bool:
+        """Whether a document is sent to Tika compressed, see TIKA_COMPRESS_REQUESTS"""
+        return (
+            settings.TIKA_COMPRESS_REQUESTS
+            and len(file_content) >= settings.TIKA_COMPRESS_MIN_BYTES
+            and compressible(headers.get("Content-Type"))
+        )
+
+    def _unavailable(self) -> HTTPException:
+        """503 for when every Tika backend is open, to be retried when the first of them becomes half-open"""
+        return HTTPException(
+            status_code=503,
+            detail="No Tika backend is available",
+            headers={"Retry-After": str(self.backends.retry_after())}
+        )
+
+
+def request_timeout(size: int) -> httpx.Timeout:
+    """
+    The timeouts of a Tika call of a document of size bytes: the read and write timeouts grow with its size,
+    see TIKA_READ_TIMEOUT_PER_MB
+    """
+    megabytes = size / (1024 * 1024)
+
+    def scaled(base: float, per_megabyte: float) -> float:
+        return max(base, min(settings.TIKA_MAX_TIMEOUT, base + megabytes * per_megabyte))
+
+    return httpx.Timeout(
+        connect=settings.TIKA_CONNECT_TIMEOUT,
+        read=scaled(settings.TIKA_READ_TIMEOUT, settings.TIKA_READ_TIMEOUT_PER_MB),
+        write=scaled(settings.TIKA_WRITE_TIMEOUT, settings.TIKA_WRITE_TIMEOUT_PER_MB),
+        pool=settings.TIKA_POOL_TIMEOUT
+    )
+
+
+def retry_backoff(attempt: int) -> float:
+    """Seconds to wait before the attempt, counted from 1 for the first retry, with full jitter"""
+    return random.uniform(0, min(settings.TIKA_RETRY_BACKOFF_MAX, settings.TIKA_RETRY_BACKOFF * 2 ** (attempt - 1)))
+
+
+def _retryable(error: httpx.TransportError) -> bool:
+    """
+    Whether a document may be sent again after the error. A timeout waiting for Tika is not retried,
+    as the document would most likely hang again and hold another backend as long.
+    """
+    return not isinstance(error, httpx.TimeoutException) or isinstance(error, httpx.ConnectTimeout)
+
+
+def _transport_error(error: httpx.TransportError, backend: Optional[TikaBackend] = None) -> HTTPException:
+    """The HTTP error answering a failed Tika call"""
+    where = f" ({backend.name})" if backend is not None else ""
+    if isinstance(error, httpx.TimeoutException) and not isinstance(error, httpx.ConnectTimeout):
+        logger.error(f"Tika timed out{where}: {type(error).__name__}")
+        return HTTPException(status_code=504, detail="Tika did not respond in time")
+    logger.error(f"Tika is not reachable{where}: {str(error) or type(error).__name__}")
+    return HTTPException(
+        status_code=503,
+        detail="Tika is not reachable",
+        headers={"Retry-After": str(settings.RETRY_AFTER_SECONDS)}
+    )
+
+
+async def _digest(content: bytes) -> str:
+    """SHA-256 of the content, hashed in a worker thread when it is large to keep the event loop free"""
+    if len(content) > 1024 * 1024:
+        return await asyncio.to_thread(lambda: hashlib.sha256(content).hexdigest())
+    return hashlib.sha256(content).hexdigest()
+
+
+def _charset(mime_type: str) -> Optional[str]:
+    """The charset parameter of a MIME type, if any"""
+    for parameter in mime_type.split(";")[1:]:
+        name, _, value = parameter.partition("=")
+        if name.strip().lower() == "charset" and value.strip():
+            return value.strip().strip("\"'")
+    return None
+
+
+async def _completed(value: Any) -> Any:
+    return value
+
+
+async def _pieces(*pieces: str) -> AsyncIterator[str]:
+    for piece in pieces:
+        yield piece
+
+
+async def _hashing(body: AsyncIterable[bytes], hasher) -> AsyncIterator[bytes]:
+    """Pass the chunks of body through while feeding them to hasher"""
+    async for chunk in body:
+        hasher.update(chunk)
+        yield chunk
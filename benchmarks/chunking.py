@@ -0,0 +1,139 @@
+"""
+Benchmark of the router's Markdown chunking ("X-Split: chunks") on large synthetic Markdown documents, against
+the RecursiveCharacterTextSplitter of langchain-text-splitters which Open WebUI chunks with, when it is installed.
+
+    python -m benchmarks.chunking --sizes 1m,10m,50m --chunk-size 1000 --chunk-overlap 100 --output chunking.json
+
+Reports the seconds, throughput, number of chunks and largest chunk of each splitter and size as JSON, which
+benchmarks/compare.py compares like the results of benchmarks/run.py.
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+from app.services.chunking import chunk_markdown
+from benchmarks.run import git_revision, parse_size
+
+try:
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+except ImportError:  # pragma: no cover - the comparison is optional
+    RecursiveCharacterTextSplitter = None
+
+_WORDS = (
+    "the document router extracts text from files with tika and converts it to markdown for retrieval so that "
+    "chunks of it can be embedded searched and cited by the model answering questions about them"
+).split()
+
+
+def make_markdown(size: int, seed: int = 0) -> str:
+    """A Markdown document of at least size characters with nested headings, paragraphs, lists and code blocks"""
+    rng = random.Random(seed)
+    parts = []
+    length = 0
+    section = 0
+    while length < size:
+        section += 1
+        block = [f"# Chapter {section}"]
+        for subsection in range(1, rng.randint(2, 5)):
+            block.append(f"## Section {section}.{subsection}")
+            for _ in range(rng.randint(2, 6)):
+                kind = rng.random()
+                if kind < 0.1:
+                    block.append("```\n" + "\n".join(
+                        f"# step {line}\nrun --option {rng.randint(0, 99)}" for line in range(rng.randint(2, 8))
+                    ) + "\n```")
+                elif kind < 0.25:
+                    block.append("\n".join(
+                        "- " + " ".join(rng.choices(_WORDS, k=rng.randint(4, 12))) for _ in range(rng.randint(3, 8))
+                    ))
+                else:
+                    block.append(" ".join(
+                        " ".join(rng.choices(_WORDS, k=rng.randint(8, 25))).capitalize() + "."
+                        for _ in range(rng.randint(2, 10))
+                    ))
+        text = "\n\n".join(block) + "\n\n"
+        parts.append(text)
+        length += len(text)
+    return "".join(parts)
+
+
+def router_splitter(chunk_size: int, chunk_overlap: int) -> Callable[[str], List[str]]:
+    return lambda text: [chunk for chunk, _ in chunk_markdown(text, chunk_size, chunk_overlap)]
+
+
+def langchain_splitter(chunk_size: int, chunk_overlap: int) -> Optional[Callable[[str], List[str]]]:
+    """The splitter of Open WebUI, configured like it, or None when langchain-text-splitters is not installed"""
+    if RecursiveCharacterTextSplitter is None:
+        return None
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True
+    )
+    return lambda text: [document.page_content for document in splitter.create_documents([text])]
+
+
+def measure(split: Callable[[str], List[str]], text: str, rounds: int) -> Dict:
+    """The best of rounds runs of split on the text"""
+    best = None
+    chunks: List[str] = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        chunks = split(text)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return {
+        "seconds": round(best, 4),
+        "mb_per_second": round(len(text) / 1024 / 1024 / best, 2) if best else None,
+        "chunks": len(chunks),
+        "max_chunk_chars": max((len(chunk) for chunk in chunks), default=0),
+    }
+
+
+def run(args) -> Dict:
+    splitters = {"router": router_splitter(args.chunk_size, args.chunk_overlap)}
+    langchain = langchain_splitter(args.chunk_size, args.chunk_overlap)
+    if langchain is not None:
+        splitters["langchain"] = langchain
+    else:
+        print("langchain-text-splitters is not installed, only the router is measured", file=sys.stderr)
+
+    results = {}
+    for size in args.sizes.split(","):
+        text = make_markdown(parse_size(size))
+        results[size] = {name: measure(split, text, args.rounds) for name, split in splitters.items()}
+    return {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "config": {
+            "sizes": args.sizes,
+            "chunk_size": args.chunk_size,
+            "chunk_overlap": args.chunk_overlap,
+            "rounds": args.rounds,
+        },
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1m,10m", help="comma separated document sizes, e.g. 1m,10m,50m")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="characters per chunk")
+    parser.add_argument("--chunk-overlap", type=int, default=100, help="characters of overlap between chunks")
+    parser.add_argument("--rounds", type=int, default=3, help="runs per measurement, the fastest is reported")
+    parser.add_argument("--output", help="file to write the JSON results to, instead of stdout")
+    args = parser.parse_args()
+
+    output = json.dumps(run(args), indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+        print(f"Wrote results to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
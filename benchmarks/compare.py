@@ -0,0 +1,73 @@
+"""
+Compare two benchmark results written by benchmarks/run.py.
+
+    python -m benchmarks.compare before.json after.json [--fail-above 10]
+
+Prints the change of each measurement and, with --fail-above, exits with status 1 when any measurement
+got worse by more than the given percentage.
+"""
+import argparse
+import json
+import sys
+from typing import Dict, Iterator, Optional, Tuple
+
+# Measurements where a higher value is better, all others are better when lower
+HIGHER_IS_BETTER = {"requests_per_second", "succeeded", "mb_per_second"}
+
+
+def flatten(results: Dict, prefix: str = "") -> Iterator[Tuple[str, float]]:
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from flatten(value, f"{name}.")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield name, value
+
+
+def change(before: float, after: float) -> Optional[float]:
+    """Change in percent from before to after"""
+    if before == 0:
+        return None
+    return (after - before) / abs(before) * 100
+
+
+def compare(before: Dict, after: Dict) -> Iterator[Tuple[str, float, float, Optional[float], bool]]:
+    """Each measurement found in both results with its values, change and whether it got worse"""
+    after_values = dict(flatten(after["results"]))
+    for name, before_value in flatten(before["results"]):
+        if name not in after_values:
+            continue
+        after_value = after_values[name]
+        percent = change(before_value, after_value)
+        higher_is_better = name.rsplit(".", 1)[-1] in HIGHER_IS_BETTER
+        worse = after_value < before_value if higher_is_better else after_value > before_value
+        yield name, before_value, after_value, percent, worse
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--fail-above", type=float, help="fail when a measurement got worse by more percent")
+    args = parser.parse_args()
+
+    with open(args.before) as fp:
+        before = json.load(fp)
+    with open(args.after) as fp:
+        after = json.load(fp)
+
+    print(f"{'measurement':<40} {before.get('revision') or 'before':>12} {after.get('revision') or 'after':>12} change")
+    regressions = []
+    for name, before_value, after_value, percent, worse in compare(before, after):
+        shown = f"{percent:+.1f}%" if percent is not None else ""
+        print(f"{name:<40} {before_value:>12} {after_value:>12} {shown}")
+        if worse and percent is not None and args.fail_above is not None and abs(percent) > args.fail_above:
+            regressions.append(name)
+
+    if regressions:
+        print(f"Regressed by more than {args.fail_above}%: {', '.join(regressions)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
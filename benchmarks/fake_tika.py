@@ -0,0 +1,77 @@
+"""
+Stand-in for a Tika server, used by the benchmarks.
+
+Replays the recorded Tika responses in tests/test_data, grown to a configurable size, after a configurable
+artificial latency, so the router can be load tested without a JVM. Configured with environment variables:
+
+- FAKE_TIKA_LATENCY: seconds to wait before answering (default 0.05)
+- FAKE_TIKA_LATENCY_PER_MB: extra seconds to wait per MB of uploaded document (default 0.1)
+- FAKE_TIKA_PAYLOAD_BYTES: approximate size of the extracted text returned (default 10000)
+
+Run with: uvicorn benchmarks.fake_tika:app --port 9998
+"""
+import asyncio
+import json
+import os
+from pathlib import Path
+from fastapi import FastAPI, Request, Response
+
+TEST_DATA_DIR = Path(__file__).parent.parent / "tests" / "test_data"
+
+LATENCY = float(os.getenv("FAKE_TIKA_LATENCY", "0.05"))
+LATENCY_PER_MB = float(os.getenv("FAKE_TIKA_LATENCY_PER_MB", "0.1"))
+PAYLOAD_BYTES = int(os.getenv("FAKE_TIKA_PAYLOAD_BYTES", "10000"))
+
+
+def text_response(payload_bytes: int) -> bytes:
+    """The recorded /tika/text response of a PDF, with its text repeated to about payload_bytes"""
+    with open(TEST_DATA_DIR / "hello_world_pdf_tika_resp.json") as fp:
+        metadata = json.load(fp)
+    paragraph = metadata.get("X-TIKA:content", "").strip() + "\n\n"
+    metadata["X-TIKA:content"] = paragraph * max(1, payload_bytes // len(paragraph))
+    return json.dumps(metadata).encode()
+
+
+def html_response(payload_bytes: int) -> bytes:
+    """The recorded /tika XHTML response of a docx, with its body repeated to about payload_bytes"""
+    xhtml = (TEST_DATA_DIR / "hello_world_docx_tika_resp.xml").read_text()
+    start = xhtml.index("<body>") + len("<body>")
+    end = xhtml.index("</body>")
+    body = xhtml[start:end]
+    return (xhtml[:start] + body * max(1, payload_bytes // len(body)) + xhtml[end:]).encode()
+
+
+def rmeta_response(payload_bytes: int) -> bytes:
+    """An /rmeta response of a container with one embedded document, both with XHTML content"""
+    html = html_response(payload_bytes // 2).decode()
+    return json.dumps([
+        {"Content-Type": "application/zip", "X-TIKA:content": html},
+        {"Content-Type": "text/plain", "X-TIKA:embedded_resource_path": "/embedded.txt", "X-TIKA:content": html}
+    ]).encode()
+
+
+app = FastAPI(title="Fake Tika")
+_responses = {
+    "tika/text": (text_response(PAYLOAD_BYTES), "application/json"),
+    "tika": (html_response(PAYLOAD_BYTES), "text/html; charset=UTF-8"),
+    "rmeta": (rmeta_response(PAYLOAD_BYTES), "application/json"),
+}
+
+
+@app.get("/version")
+async def version():
+    return Response("Apache Tika 3.0.0 (fake)", media_type="text/plain")
+
+
+@app.put("/{endpoint:path}")
+async def parse(endpoint: str, request: Request):
+    if endpoint.startswith("rmeta"):
+        endpoint = "rmeta"
+    if endpoint not in _responses:
+        return Response(status_code=404)
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+    await asyncio.sleep(LATENCY + LATENCY_PER_MB * size / (1024 * 1024))
+    content, media_type = _responses[endpoint]
+    return Response(content, media_type=media_type)
@@ -0,0 +1,447 @@
+"""
+Load test of the router against the fake Tika server in benchmarks/fake_tika.py.
+
+Starts the fake Tika and the router as uvicorn processes, drives PUT /api/v1/process at a fixed concurrency with
+a corpus of synthetic documents of several types and sizes, and writes the results as JSON: requests per second,
+latency percentiles, errors, peak RSS of the router and its worker processes, the RSS and PSS of each worker and
+how long the workers took to start, and event loop lag read from the router's /metrics.
+
+    python -m benchmarks.run --concurrency 32 --requests 2000 --output results.json
+    python -m benchmarks.run --env STREAM_UPLOADS=true --env CONVERTER=xhtml
+    python -m benchmarks.run --workers 4
+    python -m benchmarks.run --uvicorn-arg=--workers=4
+
+--workers serves the router with python -m app.server, whose workers are forked from a preloaded parent,
+while --uvicorn-arg=--workers=N uses uvicorn's workers, which each start from scratch.
+
+Compare two runs with benchmarks/compare.py.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import httpx
+
+ROOT = Path(__file__).parent.parent
+TEST_DATA_DIR = ROOT / "tests" / "test_data"
+API_KEY = "benchmark"
+
+# A document of the corpus: its type, MIME type sent with it (None to have it detected) and content
+Document = Tuple[str, Optional[str], bytes]
+
+_SIZES = {"k": 1024, "m": 1024 * 1024}
+
+
+def parse_size(size: str) -> int:
+    size = size.strip().lower()
+    if size[-1] in _SIZES:
+        return int(float(size[:-1]) * _SIZES[size[-1]])
+    return int(size)
+
+
+def make_corpus(sizes: List[int], types: List[str]) -> List[Document]:
+    """Synthetic documents of each type and size. Binary types keep their magic numbers and are padded."""
+    sentence = b"The quick brown fox jumps over the lazy dog. "
+    corpus = []
+    for size in sizes:
+        text = (sentence * (size // len(sentence) + 1))[:size]
+        for kind in types:
+            if kind == "txt":
+                corpus.append((kind, "text/plain", text))
+            elif kind == "html":
+                corpus.append((kind, None, b"<!DOCTYPE html><html><body><p>" + text + b"</p></body></html>"))
+            elif kind == "pdf":
+                # A PDF comment holding the padding, which only the fake Tika ever reads
+                pdf = (TEST_DATA_DIR / "aarhusdk_example.pdf").read_bytes()
+                corpus.append((kind, None, pdf + b"\n%" + text.replace(b"\n", b" ")))
+            elif kind == "docx":
+                docx = (TEST_DATA_DIR / "hello_world.docx").read_bytes()
+                corpus.append((kind, None, docx + text))
+            else:
+                raise ValueError(f"Unknown document type: {kind}")
+    return corpus
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """The q-th percentile, 0 <= q <= 100, of values by linear interpolation"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def parse_histogram(metrics: str, name: str) -> Dict[str, float]:
+    """The cumulative buckets, by upper bound, and the sum and count of an unlabelled histogram in /metrics"""
+    values = {}
+    for line in metrics.splitlines():
+        if line.startswith(f"{name}_bucket"):
+            bound = line.split('le="', 1)[1].split('"', 1)[0]
+            values[bound] = float(line.rsplit(" ", 1)[1])
+        elif line.startswith(f"{name}_sum ") or line.startswith(f"{name}_count "):
+            values[line.split(" ", 1)[0][len(name) + 1:]] = float(line.rsplit(" ", 1)[1])
+    return values
+
+
+def histogram_quantile(before: Dict[str, float], after: Dict[str, float], q: float) -> Optional[float]:
+    """
+    Upper bound of the bucket holding the q quantile, 0 < q < 1, of the observations made between two scrapes
+    """
+    bounds = sorted((bound for bound in after if bound not in ("sum", "count")), key=lambda b: float(b))
+    counts = [(float(bound), after[bound] - before.get(bound, 0)) for bound in bounds]
+    if not counts or counts[-1][1] <= 0:
+        return None
+    rank = q * counts[-1][1]
+    for bound, count in counts:
+        if count >= rank:
+            return bound
+    return None
+
+
+def metric_value(metrics: str, name: str) -> Optional[float]:
+    for line in metrics.splitlines():
+        if line.startswith(f"{name} "):
+            return float(line.rsplit(" ", 1)[1])
+    return None
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def children(pid: int) -> List[int]:
+    """The child processes of a process, on Linux"""
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as fp:
+            return [int(child) for child in fp.read().split()]
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        return []
+
+
+def process_tree(pid: int) -> List[int]:
+    """A process and its descendants, on Linux"""
+    pids = []
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        pids.append(current)
+        pending.extend(children(current))
+    return pids
+
+
+def process_memory(pid: int) -> Optional[Dict[str, int]]:
+    """
+    Resident memory in bytes of a process, as RSS and as PSS, which divides the pages shared with other processes,
+    such as those a forked worker shares with its parent, among them. On Linux.
+    """
+    memory = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as fp:
+            for line in fp:
+                name, _, value = line.partition(":")
+                if name in ("Rss", "Pss"):
+                    memory[name.lower()] = int(value.split()[0]) * 1024
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        return None
+    return memory or None
+
+
+def process_tree_rss(pid: int) -> Optional[int]:
+    """Resident memory in bytes of a process and its children, on Linux"""
+    memories = [process_memory(current) for current in process_tree(pid)]
+    if not memories or memories[0] is None:
+        return None
+    return sum(memory["rss"] for memory in memories if memory is not None)
+
+
+def _is_helper(pid: int) -> bool:
+    """Whether a child of the router is a helper process of multiprocessing rather than a worker"""
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as fp:
+            return b"resource_tracker" in fp.read()
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        return True
+
+
+def worker_memory(pid: int, multi_worker: bool) -> Dict[str, Optional[float]]:
+    """
+    RSS and PSS of the workers of the router: the children of the router process when it runs several workers,
+    otherwise the router process itself, not counting their conversion pools
+    """
+    if multi_worker:
+        workers = [child for child in children(pid) if not _is_helper(child)]
+    else:
+        workers = [pid]
+    memories = [memory for memory in map(process_memory, workers) if memory is not None]
+
+    def mean_mb(key: str) -> Optional[float]:
+        if not memories:
+            return None
+        return round(sum(memory[key] for memory in memories) / len(memories) / (1024 * 1024), 1)
+
+    return {
+        "workers": len(memories),
+        "rss_mb_per_worker": mean_mb("rss"),
+        "pss_mb_per_worker": mean_mb("pss"),
+    }
+
+
+def worker_startup(log: str) -> Dict[str, Optional[float]]:
+    """How long the workers took to start, as logged by app.server"""
+    times = [float(match) for match in re.findall(r"Worker \d+ started in (\d+) ms", log)]
+    return {
+        "max_ms": max(times) if times else None,
+        "mean_ms": round(sum(times) / len(times), 1) if times else None,
+    }
+
+
+def start_server(app: str, port: int, env: Dict[str, str], extra_args: List[str] = (), log=None) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning", *extra_args],
+        cwd=ROOT,
+        env={**os.environ, **env},
+        stdout=subprocess.DEVNULL,
+        stderr=log or subprocess.DEVNULL
+    )
+
+
+def start_prefork_server(port: int, env: Dict[str, str], workers: int, log=None) -> subprocess.Popen:
+    """The router served by app.server with workers forked from a preloaded parent"""
+    return subprocess.Popen(
+        [sys.executable, "-m", "app.server"],
+        cwd=ROOT,
+        env={**os.environ, **env, "HOST": "127.0.0.1", "PORT": str(port), "WORKERS": str(workers)},
+        stdout=subprocess.DEVNULL,
+        stderr=log or subprocess.DEVNULL
+    )
+
+
+async def wait_until_up(url: str, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(url)).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout} seconds")
+
+
+async def drive(
+        base_url: str,
+        corpus: List[Document],
+        concurrency: int,
+        total: int,
+        unique: bool,
+        router_pid: int
+) -> Dict:
+    """Send total requests, concurrency at a time, and measure them"""
+    latencies: List[float] = []
+    by_type: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+    peak_rss = 0
+    sent = 0
+    done = False
+
+    async def sample_rss():
+        nonlocal peak_rss
+        while not done:
+            rss = process_tree_rss(router_pid)
+            if rss is not None:
+                peak_rss = max(peak_rss, rss)
+            await asyncio.sleep(0.1)
+
+    async def worker(client: httpx.AsyncClient):
+        nonlocal sent
+        while sent < total:
+            number = sent
+            sent += 1
+            kind, mime_type, content = corpus[number % len(corpus)]
+            if unique:
+                # Defeat the extraction cache, which would otherwise answer repeated documents
+                content = content + f" {number} {random.random()}".encode()
+            headers = {"Authorization": f"Bearer {API_KEY}", "X-Filename": f"document-{number}.{kind}"}
+            if mime_type:
+                headers["Content-Type"] = mime_type
+            started = time.perf_counter()
+            try:
+                response = await client.put(f"{base_url}/api/v1/process", content=content, headers=headers)
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - started
+            if status == "200":
+                latencies.append(elapsed)
+                by_type.setdefault(kind, []).append(elapsed)
+            else:
+                errors[status] = errors.get(status, 0) + 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=600) as client:
+        sampler = asyncio.create_task(sample_rss())
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        duration = time.perf_counter() - started
+        done = True
+        await sampler
+
+    def summary(values: List[float]) -> Dict[str, Optional[float]]:
+        return {
+            "p50_ms": _ms(percentile(values, 50)),
+            "p95_ms": _ms(percentile(values, 95)),
+            "p99_ms": _ms(percentile(values, 99)),
+            "max_ms": _ms(max(values) if values else None),
+            "mean_ms": _ms(sum(values) / len(values) if values else None),
+        }
+
+    return {
+        "requests": total,
+        "succeeded": len(latencies),
+        "errors": errors,
+        "duration_s": round(duration, 3),
+        "requests_per_second": round(len(latencies) / duration, 2) if duration else None,
+        "latency": summary(latencies),
+        "latency_by_type": {kind: summary(values) for kind, values in sorted(by_type.items())},
+        "peak_rss_mb": round(peak_rss / (1024 * 1024), 1) if peak_rss else None,
+    }
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return round(seconds * 1000, 2) if seconds is not None else None
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> Dict:
+    tika_port, router_port = free_port(), free_port()
+    router_env = {
+        "API_KEY": API_KEY,
+        "TIKA_BASE_URL": f"http://127.0.0.1:{tika_port}",
+        "TIKA_USER": "benchmark",
+        "TIKA_PASSWORD": "benchmark",
+        "METRICS_ENABLED": "true",
+    }
+    for setting in args.env:
+        key, _, value = setting.partition("=")
+        router_env[key] = value
+    tika_env = {
+        "FAKE_TIKA_LATENCY": str(args.tika_latency),
+        "FAKE_TIKA_LATENCY_PER_MB": str(args.tika_latency_per_mb),
+        "FAKE_TIKA_PAYLOAD_BYTES": str(parse_size(args.payload)),
+    }
+    corpus = make_corpus([parse_size(size) for size in args.sizes.split(",")], args.types.split(","))
+
+    tika = start_server("benchmarks.fake_tika:app", tika_port, tika_env)
+    # The router's log is kept for the startup times the workers log
+    log = tempfile.TemporaryFile(mode="w+")
+    if args.workers:
+        router = start_prefork_server(router_port, router_env, args.workers, log)
+    else:
+        router = start_server("app.main:app", router_port, router_env, args.uvicorn_arg, log)
+    multi_worker = args.workers > 1 or any("--workers" in arg for arg in args.uvicorn_arg)
+    base_url = f"http://127.0.0.1:{router_port}"
+    try:
+        started = time.perf_counter()
+        await wait_until_up(f"http://127.0.0.1:{tika_port}/version")
+        await wait_until_up(f"{base_url}/health")
+        startup = time.perf_counter() - started
+
+        if args.warmup:
+            await drive(base_url, corpus, args.concurrency, args.warmup, True, router.pid)
+        async with httpx.AsyncClient() as client:
+            before = (await client.get(f"{base_url}/metrics")).text
+        results = await drive(base_url, corpus, args.concurrency, args.requests, not args.repeat, router.pid)
+        async with httpx.AsyncClient() as client:
+            after = (await client.get(f"{base_url}/metrics")).text
+        memory = worker_memory(router.pid, multi_worker)
+    finally:
+        for process in (router, tika):
+            process.terminate()
+            process.wait(timeout=30)
+        log.seek(0)
+        startup_log = log.read()
+        log.close()
+
+    lag_before = parse_histogram(before, "router_event_loop_lag_seconds")
+    lag_after = parse_histogram(after, "router_event_loop_lag_seconds")
+    samples = lag_after.get("count", 0) - lag_before.get("count", 0)
+    results["event_loop_lag"] = {
+        "mean_ms": _ms((lag_after.get("sum", 0) - lag_before.get("sum", 0)) / samples) if samples else None,
+        "p50_upper_bound_ms": _ms(histogram_quantile(lag_before, lag_after, 0.5)),
+        "p99_upper_bound_ms": _ms(histogram_quantile(lag_before, lag_after, 0.99)),
+        "max_ms": _ms(metric_value(after, "router_event_loop_lag_max_seconds")),
+    }
+    results["startup_s"] = round(startup, 3)
+    results["worker_startup"] = worker_startup(startup_log)
+    results["worker_memory"] = memory
+    return {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "config": {
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "sizes": args.sizes,
+            "types": args.types,
+            "unique_documents": not args.repeat,
+            "tika_latency": args.tika_latency,
+            "tika_latency_per_mb": args.tika_latency_per_mb,
+            "payload": args.payload,
+            "env": args.env,
+            "uvicorn_args": args.uvicorn_arg,
+            "workers": args.workers,
+        },
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=16, help="requests in flight at a time")
+    parser.add_argument("--requests", type=int, default=500, help="requests to measure")
+    parser.add_argument("--warmup", type=int, default=50, help="requests sent before measuring")
+    parser.add_argument("--sizes", default="1k,64k,1m", help="comma separated document sizes, e.g. 1k,64k,1m")
+    parser.add_argument("--types", default="txt,html,pdf,docx", help="comma separated document types")
+    parser.add_argument("--repeat", action="store_true", help="repeat identical documents, so the cache answers")
+    parser.add_argument("--tika-latency", type=float, default=0.05, help="seconds the fake Tika takes per document")
+    parser.add_argument("--tika-latency-per-mb", type=float, default=0.1, help="extra seconds per MB of document")
+    parser.add_argument("--payload", default="10k", help="size of the text the fake Tika returns")
+    parser.add_argument("--env", action="append", default=[], help="router setting as KEY=VALUE, repeatable")
+    parser.add_argument("--uvicorn-arg", action="append", default=[], help="extra uvicorn argument, repeatable")
+    parser.add_argument("--workers", type=int, default=0, help="serve with app.server and this many workers")
+    parser.add_argument("--output", help="file to write the JSON results to, instead of stdout")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+        print(f"Wrote results to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
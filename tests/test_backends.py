@@ -0,0 +1,89 @@
+import pytest
+import httpx
+from app.services.backends import TikaBackend, BackendPool
+
+
+def make_pool(*names, **kwargs) -> BackendPool:
+    return BackendPool([TikaBackend(f"http://{name}", name) for name in names], **kwargs)
+
+
+def test_choose_least_loaded():
+    pool = make_pool("tika-1", "tika-2")
+    first, second = pool.backends
+    pool.started(first, 100)
+    assert pool.choose() is second
+    pool.started(second, 1000)
+    # Same number of requests in flight, so fewest bytes in flight wins
+    assert pool.choose() is first
+    pool.finished(first, 100)
+    assert pool.choose() is first
+    assert pool.choose(exclude=[first]) is second
+
+
+def test_choose_by_latency():
+    pool = make_pool("tika-1", "tika-2")
+    first, second = pool.backends
+    pool.succeeded(first, 2.0)
+    pool.succeeded(second, 0.5)
+    assert pool.choose() is second
+
+
+def test_eject_after_consecutive_failures():
+    pool = make_pool("tika-1", "tika-2", failure_threshold=2)
+    first, second = pool.backends
+    pool.failed(first)
+    assert not first.ejected
+    pool.failed(first)
+    assert first.ejected
+    assert pool.choose() is second
+    assert pool.choose(exclude=[second]) is None
+    assert pool.available
+    pool.failed(second, eject=True)
+    assert not pool.available
+
+
+def test_ejected_backend_is_retried_after_eject_seconds(mocker):
+    monotonic = mocker.patch("app.services.backends.time.monotonic", return_value=1000)
+    pool = make_pool("tika-1", eject_seconds=30)
+    backend, = pool.backends
+    pool.failed(backend, eject=True)
+    assert pool.choose() is None
+    monotonic.return_value = 1031
+    assert pool.choose() is backend
+
+
+def test_half_open_backend_gets_a_single_trial(mocker):
+    monotonic = mocker.patch("app.services.backends.time.monotonic", return_value=1000)
+    pool = make_pool("tika-1", eject_seconds=30)
+    backend, = pool.backends
+    pool.failed(backend, eject=True)
+    assert backend.state == "open"
+    assert pool.retry_after() == 30
+    monotonic.return_value = 1031
+    assert backend.state == "half_open"
+    assert pool.available
+    pool.started(backend, 100)
+    # No other request while the trial is in flight
+    assert pool.choose() is None
+    pool.finished(backend, 100)
+    # A failed trial opens the breaker again at once
+    pool.failed(backend)
+    assert backend.state == "open"
+    monotonic.return_value = 1062
+    pool.started(backend, 100)
+    pool.finished(backend, 100)
+    pool.succeeded(backend, 0.1)
+    assert backend.state == "closed"
+    assert pool.choose() is backend
+
+
+@pytest.mark.asyncio
+async def test_probe():
+    def handler(request):
+        if request.url.host == "tika-2":
+            raise httpx.ConnectError("Connection refused")
+        return httpx.Response(200, text="Apache Tika 3.0.0")
+
+    pool = make_pool("tika-1", "tika-2")
+    await pool.probe(httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    assert [backend["healthy"] for backend in pool.health()] == [True, False]
@@ -0,0 +1,74 @@
+import os
+import pytest
+from fastapi.testclient import TestClient
+from benchmarks.run import (
+    histogram_quantile, make_corpus, parse_histogram, parse_size, percentile, process_memory, worker_memory,
+    worker_startup
+)
+from benchmarks.compare import compare
+from benchmarks.chunking import make_markdown, measure, router_splitter
+from benchmarks.fake_tika import app
+
+
+def test_fake_tika():
+    client = TestClient(app)
+    assert client.get("/version").status_code == 200
+    response = client.put("/tika/text", content=b"%PDF-1.4", headers={"Content-Type": "application/pdf"})
+    assert "Hallo World!" in response.json()["X-TIKA:content"]
+    response = client.put("/tika", content=b"PK", headers={"Accept": "text/html"})
+    assert response.text.startswith("<?xml")
+
+
+def test_make_corpus():
+    corpus = make_corpus([parse_size("1k"), parse_size("64k")], ["txt", "pdf"])
+    assert [(kind, len(content) >= size) for (kind, _, content), size in zip(corpus, [1024, 1024, 65536, 65536])] == [
+        ("txt", True), ("pdf", True), ("txt", True), ("pdf", True)
+    ]
+    assert corpus[1][2].startswith(b"%PDF")
+
+
+def test_percentile():
+    assert percentile([], 50) is None
+    assert percentile([1, 2, 3, 4], 50) == 2.5
+    assert percentile([1, 2, 3, 4], 100) == 4
+
+
+def test_histogram_quantile():
+    before = parse_histogram('lag_bucket{le="0.01"} 1\nlag_bucket{le="0.1"} 1\nlag_bucket{le="+Inf"} 1\n', "lag")
+    after = parse_histogram(
+        'lag_bucket{le="0.01"} 90\nlag_bucket{le="0.1"} 100\nlag_bucket{le="+Inf"} 101\nlag_count 101\n', "lag"
+    )
+    assert histogram_quantile(before, after, 0.5) == 0.01
+    assert histogram_quantile(before, after, 0.95) == 0.1
+
+
+def test_compare():
+    before = {"results": {"requests_per_second": 100, "latency": {"p99_ms": 100}}}
+    after = {"results": {"requests_per_second": 90, "latency": {"p99_ms": 80}}}
+    assert list(compare(before, after)) == [
+        ("requests_per_second", 100, 90, -10.0, True),
+        ("latency.p99_ms", 100, 80, -20.0, False),
+    ]
+
+
+def test_worker_startup():
+    log = "INFO Worker 12 started in 410 ms\nINFO other\nINFO Worker 13 started in 450 ms\n"
+    assert worker_startup(log) == {"max_ms": 450.0, "mean_ms": 430.0}
+    assert worker_startup("") == {"max_ms": None, "mean_ms": None}
+
+
+def test_worker_memory():
+    memory = process_memory(os.getpid())
+    if memory is None:
+        pytest.skip("Needs /proc/<pid>/smaps_rollup")
+    assert memory["rss"] >= memory["pss"] > 0
+    assert worker_memory(os.getpid(), multi_worker=False)["workers"] == 1
+
+
+def test_chunking_benchmark():
+    text = make_markdown(64 * 1024)
+    assert len(text) >= 64 * 1024
+    assert text.startswith("# Chapter 1\n\n## Section 1.1")
+    results = measure(router_splitter(1000, 100), text, rounds=1)
+    assert results["chunks"] > 64
+    assert results["max_chunk_chars"] <= 1000
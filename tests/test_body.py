@@ -0,0 +1,106 @@
+import gzip
+import pytest
+from fastapi import Request, HTTPException
+from app.api.body import read_body, peek_body
+
+
+def make_request(chunks, content_length: int = None, content_encoding: str = None) -> Request:
+    """Request whose body arrives in the given chunks"""
+    headers = []
+    if content_length is not None:
+        headers.append((b"content-length", str(content_length).encode()))
+    if content_encoding is not None:
+        headers.append((b"content-encoding", content_encoding.encode()))
+    messages = [
+        {"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+        for i, chunk in enumerate(chunks)
+    ]
+
+    async def receive():
+        return messages.pop(0)
+
+    return Request({"type": "http", "method": "PUT", "headers": headers}, receive)
+
+
+@pytest.mark.asyncio
+async def test_read_body():
+    request = make_request([b"hello ", b"world"])
+    assert await read_body(request, max_bytes=100) == b"hello world"
+
+
+@pytest.mark.asyncio
+async def test_read_body_too_large():
+    request = make_request([b"hello ", b"world"])
+    with pytest.raises(HTTPException) as exc_info:
+        await read_body(request, max_bytes=8)
+    assert exc_info.value.status_code == 413
+
+
+@pytest.mark.asyncio
+async def test_read_body_content_length_too_large():
+    request = make_request([b"hello"], content_length=1000)
+    with pytest.raises(HTTPException) as exc_info:
+        await read_body(request, max_bytes=100)
+    assert exc_info.value.status_code == 413
+
+
+@pytest.mark.asyncio
+async def test_peek_body():
+    request = make_request([b"abc", b"def", b"ghi", b"jkl"])
+    head, body = await peek_body(request, peek_bytes=4, max_bytes=100)
+    assert head == b"abcdef"
+    assert [chunk async for chunk in body] == [b"abcdef", b"ghi", b"jkl"]
+
+
+@pytest.mark.asyncio
+async def test_peek_body_too_large_while_streaming():
+    request = make_request([b"abc", b"def", b"ghi", b"jkl"])
+    head, body = await peek_body(request, peek_bytes=3, max_bytes=8)
+    assert head == b"abc"
+    with pytest.raises(HTTPException) as exc_info:
+        [chunk async for chunk in body]
+    assert exc_info.value.status_code == 413
+
+
+def split(data: bytes, size: int):
+    return [data[start:start + size] for start in range(0, len(data), size)]
+
+
+@pytest.mark.asyncio
+async def test_read_gzip_body():
+    compressed = gzip.compress(b"hello world" * 1000)
+    request = make_request(split(compressed, 10), content_length=len(compressed), content_encoding="gzip")
+    assert await read_body(request, max_bytes=100_000) == b"hello world" * 1000
+
+
+@pytest.mark.asyncio
+async def test_peek_gzip_body():
+    request = make_request(split(gzip.compress(b"abcdefghijkl"), 7), content_encoding="gzip")
+    head, body = await peek_body(request, peek_bytes=4, max_bytes=100)
+    assert head.startswith(b"abcd")
+    assert b"".join([chunk async for chunk in body]) == b"abcdefghijkl"
+
+
+@pytest.mark.asyncio
+async def test_read_gzip_body_too_large():
+    # A small body which decompresses to far more than the limit is stopped at the limit
+    request = make_request([gzip.compress(bytes(64 * 1024 * 1024))], content_encoding="gzip")
+    with pytest.raises(HTTPException) as exc_info:
+        await read_body(request, max_bytes=1024 * 1024)
+    assert exc_info.value.status_code == 413
+
+
+@pytest.mark.asyncio
+async def test_read_truncated_gzip_body():
+    request = make_request([gzip.compress(b"hello world")[:-8]], content_encoding="gzip")
+    with pytest.raises(HTTPException) as exc_info:
+        await read_body(request, max_bytes=100)
+    assert exc_info.value.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_read_body_unsupported_encoding():
+    request = make_request([b"hello"], content_encoding="br")
+    with pytest.raises(HTTPException) as exc_info:
+        await read_body(request, max_bytes=100)
+    assert exc_info.value.status_code == 415
@@ -0,0 +1,85 @@
+import gc
+import warnings
+import pytest
+from app.services.cache import MemoryCache, SQLiteCache, ExtractionCache, make_cache_key
+
+value = [("Hello world!", {"Content-Type": "text/plain"})]
+
+
+def test_make_cache_key():
+    key = make_cache_key("abc", "tika", {"ignore_links": False})
+    assert key.startswith("abc:")
+    assert key == make_cache_key("abc", "tika", {"ignore_links": False})
+    assert key != make_cache_key("abc", "tika/text", {"ignore_links": False})
+    assert key != make_cache_key("abc", "tika", {"ignore_links": True})
+
+
+def test_memory_cache_lru_entries():
+    cache = MemoryCache(max_entries=2, max_bytes=1024, ttl=60)
+    cache.set("a", value)
+    cache.set("b", value)
+    assert cache.get("a") == value
+    cache.set("c", value)
+    # "b" was the least recently used
+    assert cache.get("b") is None
+    assert cache.get("a") == value
+    assert cache.get("c") == value
+
+
+def test_memory_cache_max_bytes():
+    cache = MemoryCache(max_entries=10, max_bytes=100, ttl=60)
+    cache.set("a", [("x" * 40, {})])
+    cache.set("b", [("x" * 40, {})])
+    cache.set("c", [("x" * 40, {})])
+    assert len(cache) == 2
+    assert cache.size <= 100
+    assert cache.get("a") is None
+    # Entries larger than the cache are not stored
+    cache.set("d", [("x" * 200, {})])
+    assert cache.get("d") is None
+
+
+def test_memory_cache_ttl(mocker):
+    cache = MemoryCache(max_entries=10, max_bytes=1024, ttl=60)
+    monotonic = mocker.patch("app.services.cache.time.monotonic", return_value=1000)
+    cache.set("a", value)
+    monotonic.return_value = 1059
+    assert cache.get("a") == value
+    monotonic.return_value = 1061
+    assert cache.get("a") is None
+    assert cache.size == 0
+
+
+def test_sqlite_cache_survives_reopen(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    SQLiteCache(path, max_bytes=1024, ttl=60).set("a", value)
+    assert SQLiteCache(path, max_bytes=1024, ttl=60).get("a") == value
+
+
+def test_sqlite_cache_closes_connections(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite"), max_bytes=1024, ttl=60)
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        cache.set("a", value)
+        assert cache.get("a") == value
+        gc.collect()
+    assert not [warning for warning in caught if issubclass(warning.category, ResourceWarning)]
+
+
+def test_sqlite_cache_evicts_least_recently_used(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite"), max_bytes=100, ttl=60)
+    cache.set("a", [("x" * 40, {})])
+    cache.set("b", [("x" * 40, {})])
+    cache.set("c", [("x" * 40, {})])
+    assert cache.get("a") is None
+    assert cache.get("c") is not None
+
+
+@pytest.mark.asyncio
+async def test_extraction_cache_promotes_disk_hits(tmp_path):
+    disk = SQLiteCache(str(tmp_path / "cache.sqlite"), max_bytes=1024, ttl=60)
+    disk.set("a", value)
+    cache = ExtractionCache(MemoryCache(max_entries=10, max_bytes=1024, ttl=60), disk)
+    assert await cache.get("a") == (value, "disk")
+    assert await cache.get("a") == (value, "memory")
+    assert await cache.get("b") == (None, None)
@@ -0,0 +1,87 @@
+import pytest
+from app.services.chunking import chunk_markdown
+
+DOCUMENT = """# Guide
+
+Welcome to the guide. It explains everything.
+
+## Install
+
+Run the installer. Then restart.
+
+```
+# a comment, not a heading
+pip install package
+```
+
+## Use
+
+Use it daily.
+
+# Appendix
+
+The end.
+"""
+
+
+def check_offsets(text, chunks):
+    for chunk, metadata in chunks:
+        assert text[metadata["start_index"]:metadata["end_index"]] == chunk
+
+
+def test_chunks_follow_headings():
+    chunks = chunk_markdown(DOCUMENT, chunk_size=1000)
+    check_offsets(DOCUMENT, chunks)
+    assert [metadata["heading"] for _, metadata in chunks] == [
+        "Guide", "Guide > Install", "Guide > Use", "Appendix"
+    ]
+    assert chunks[1][0].startswith("## Install")
+    assert "# a comment, not a heading" in chunks[1][0]
+    assert [metadata["chunk_index"] for _, metadata in chunks] == [0, 1, 2, 3]
+
+
+def test_chunks_are_bounded():
+    text = "\n\n".join(" ".join(f"word{number}" for number in range(paragraph * 40)) for paragraph in range(1, 6))
+    chunks = chunk_markdown(text, chunk_size=100)
+    check_offsets(text, chunks)
+    assert all(len(chunk) <= 100 for chunk, _ in chunks)
+    # Words are never cut, and no text is lost
+    assert " ".join(chunk for chunk, _ in chunks).split() == text.split()
+
+
+def test_text_without_separators_is_cut():
+    text = "x" * 250
+    chunks = chunk_markdown(text, chunk_size=100)
+    assert [len(chunk) for chunk, _ in chunks] == [100, 100, 50]
+    check_offsets(text, chunks)
+
+
+def test_overlap():
+    text = " ".join(f"w{number:02}" for number in range(30))
+    chunks = chunk_markdown(text, chunk_size=40, chunk_overlap=10)
+    check_offsets(text, chunks)
+    assert all(len(chunk) <= 40 for chunk, _ in chunks)
+    for (previous, _), (chunk, _) in zip(chunks, chunks[1:]):
+        # The next chunk starts with the last words of the previous one
+        assert previous.endswith(chunk.split()[0]) or previous.split()[-2] == chunk.split()[0]
+    assert chunks[1][1]["start_index"] < chunks[0][1]["end_index"]
+
+
+@pytest.mark.parametrize("overlap", [0, 5, 20])
+def test_overlap_keeps_chunks_bounded(overlap):
+    text = "Sentence one is here. A second sentence. " * 20
+    chunks = chunk_markdown(text, chunk_size=30, chunk_overlap=overlap)
+    check_offsets(text, chunks)
+    assert all(len(chunk) <= 30 for chunk, _ in chunks)
+
+
+def test_metadata_is_kept():
+    chunks = chunk_markdown("Hello world", chunk_size=100, metadata={"Content-Type": "text/plain"})
+    assert chunks == [(
+        "Hello world",
+        {"Content-Type": "text/plain", "chunk_index": 0, "start_index": 0, "end_index": 11}
+    )]
+
+
+def test_empty_text():
+    assert chunk_markdown("", chunk_size=100, metadata={"a": 1}) == [("", {"a": 1})]
@@ -0,0 +1,90 @@
+import gzip
+import zlib
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.testclient import TestClient
+from app.core.compression import (
+    CompressionMiddleware, DECOMPRESS_PIECE_BYTES, DecompressionError, choose_encoding, create_decompressor
+)
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, expected",
+    [
+        (None, None),
+        ("gzip, deflate", "gzip"),
+        ("br;q=1.0, gzip;q=0.5", "gzip"),
+        ("gzip;q=0", None),
+        ("*", "gzip"),
+        ("identity", None),
+    ],
+)
+def test_choose_encoding(accept_encoding, expected, mocker):
+    mocker.patch("app.core.compression.zstandard", None)
+    assert choose_encoding(accept_encoding) == expected
+
+
+def test_decompress_in_bounded_pieces():
+    decompressor = create_decompressor("gzip")
+    pieces = list(decompressor.decompress(gzip.compress(bytes(5 * DECOMPRESS_PIECE_BYTES))))
+    pieces += list(decompressor.finish())
+    assert max(len(piece) for piece in pieces) <= DECOMPRESS_PIECE_BYTES
+    assert sum(len(piece) for piece in pieces) == 5 * DECOMPRESS_PIECE_BYTES
+
+
+def test_decompress_deflate():
+    decompressor = create_decompressor("deflate")
+    assert b"".join(decompressor.decompress(zlib.compress(b"hello"))) == b"hello"
+
+
+def test_decompress_invalid():
+    with pytest.raises(DecompressionError):
+        list(create_decompressor("gzip").decompress(b"not gzip at all"))
+
+
+def make_client(minimum_size: int = 100) -> TestClient:
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, minimum_size=minimum_size)
+
+    @app.get("/text")
+    async def text(size: int):
+        return PlainTextResponse("x" * size)
+
+    @app.get("/image")
+    async def image():
+        return PlainTextResponse("x" * 1000, media_type="image/png")
+
+    @app.get("/stream")
+    async def stream():
+        async def lines():
+            for index in range(3):
+                yield f"line {index}\n"
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    return TestClient(app)
+
+
+def test_compress_response():
+    client = make_client()
+    response = client.get("/text?size=1000", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert int(response.headers["Content-Length"]) < 1000
+    assert response.text == "x" * 1000
+
+
+def test_small_or_incompressible_response_not_compressed():
+    client = make_client()
+    assert "Content-Encoding" not in client.get("/text?size=10", headers={"Accept-Encoding": "gzip"}).headers
+    assert "Content-Encoding" not in client.get("/image", headers={"Accept-Encoding": "gzip"}).headers
+    assert "Content-Encoding" not in client.get("/text?size=1000", headers={"Accept-Encoding": "identity"}).headers
+
+
+def test_compress_streamed_response():
+    client = make_client()
+    with client.stream("GET", "/stream", headers={"Accept-Encoding": "gzip"}) as response:
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert "Content-Length" not in response.headers
+        raw = b"".join(response.iter_raw())
+    assert gzip.decompress(raw) == b"line 0\nline 1\nline 2\n"
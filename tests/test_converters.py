@@ -0,0 +1,179 @@
+import re
+from functools import partial
+import pytest
+from app.services.converters import ConversionPool, convert_document, get_converter
+
+with open('tests/test_data/hello_world_docx_tika_resp.xml', 'r') as fp:
+    hello_world_docx_tika_resp = fp.read()
+
+with open('tests/test_data/hello_world_doc_tika_resp.xml', 'r') as fp:
+    hello_world_doc_tika_resp = fp.read()
+
+xhtml_document = (
+    '<?xml version="1.0" encoding="UTF-8"?><html xmlns="http://www.w3.org/1999/xhtml">'
+    '<head><title>Ignored</title><meta name="Content-Type" content="text/html"/></head><body>'
+    '<h1>Title</h1><h2>Sub <b>bold</b></h2>'
+    '<p>Para <i>it</i> and   <b>b</b>\n with <a href="http://x.y">link</a>.</p>'
+    '<p>line<br/>break</p>'
+    '<ul><li>one</li><li>two<ul><li>nested</li></ul></li></ul>'
+    '<ol><li>first</li><li><p>second</p></li></ol>'
+    '<table><tbody><tr><th>a</th><th>b</th></tr><tr><td>c</td><td><p>d|e</p></td></tr></tbody></table>'
+    '<pre>  code\n  more</pre>'
+    '<img src="embedded:image1.png" alt="image1.png"/>'
+    '<p>&amp; &#0;end</p>'
+    '</body></html>'
+)
+
+xhtml_markdown = """# Title
+
+## Sub **bold**
+
+Para _it_ and **b** with [link](http://x.y).
+
+line
+break
+
+  * one
+  * two
+    * nested
+
+  1. first
+  2. second
+
+| a | b |
+|---|---|
+| c | d\\|e |
+
+```
+  code
+  more
+```
+
+![image1.png](embedded:image1.png)
+
+& end"""
+
+
+@pytest.mark.parametrize("converter", ["html2text", "xhtml"])
+@pytest.mark.parametrize("tika_response", [hello_world_docx_tika_resp, hello_world_doc_tika_resp])
+def test_converters_parity(converter, tika_response):
+    assert convert_document(converter, tika_response).strip() == "Hello world!"
+
+
+def tika_xhtml(body: str) -> str:
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?><html xmlns="http://www.w3.org/1999/xhtml"><head>'
+        '<meta name="X-TIKA:Parsed-By" content="org.apache.tika.parser.DefaultParser"/><title>Ignored</title>'
+        f'</head><body>{body}</body></html>'
+    )
+
+
+parity_documents = {
+    "nested_lists": (
+        '<ul><li>one</li><li>two<ul><li>nested <b>bold</b> and <a href="http://x.y/z">link</a></li>'
+        '<li>deeper<ol><li>x</li><li>y</li></ol></li></ul></li><li>three</li></ul><p>Between</p>'
+        '<ol><li>first</li><li>second<ul><li>inner</li></ul></li><li>third</li></ol>'
+    ),
+    "table": (
+        '<p>Before</p><table><tbody><tr><th>Name</th><th>Value</th></tr>'
+        '<tr><td>alpha <b>bold</b></td><td><a href="http://x.y">1</a></td></tr>'
+        '<tr><td>beta</td><td>2</td></tr></tbody></table><p>After</p>'
+    ),
+    "links": (
+        '<p>See <a href="http://example.com/a?b=c&amp;d=e">the <b>site</b></a>, <a href="mailto:x@y.z">mail</a>'
+        ' and <a href="#anchor">anchor</a>, which is long enough for html2text to wrap the line.</p>'
+        '<p><a href="http://example.com/">http://example.com/</a></p>'
+    ),
+    "heading_emphasis": (
+        '<h1>Title <b>bold</b></h1><h2>Sub <i>italic</i> and <em>em</em></h2><h3><strong>All strong</strong></h3>'
+        '<h4>Link <a href="http://x.y">here</a></h4><p>Text</p>'
+    ),
+    "entities": (
+        '<p>Fish &amp; chips &lt;tag&gt; &quot;quoted&quot; &#39;single&#39; a&#160;b &#38; &#x26;</p>'
+        '<h2>A &amp; B</h2>'
+    ),
+    "pages": (
+        '<div class="page"><p>Page one text.</p><p>Second paragraph with <b>bold</b>.</p></div>'
+        '<div class="page"><h1>Chapter</h1><p>Page two.</p></div>'
+    ),
+}
+
+
+def normalized(markdown: str) -> list:
+    """
+    The blocks of markdown, ignoring how the converters differ on purpose: html2text wraps paragraphs and
+    writes tables without outer pipes, the xhtml converter does not
+    """
+    blocks = []
+    markdown = "\n".join(line.rstrip() for line in markdown.strip().split("\n"))
+    for block in markdown.split("\n\n"):
+        lines = block.split("\n")
+        if all("|" in line for line in lines):
+            rows = [[cell.strip() for cell in line.strip().strip("|").split("|")] for line in lines]
+            blocks.append([row for row in rows if any(cell.strip("-:") for cell in row)])
+        elif any(re.match(r"\s*(\*|\d+\.) ", line) for line in lines):
+            blocks.append(lines)
+        else:
+            blocks.append(" ".join(block.split()))
+    return blocks
+
+
+@pytest.mark.parametrize("name", parity_documents)
+def test_xhtml_converter_parity(name):
+    document = tika_xhtml(parity_documents[name])
+    expected = normalized(convert_document("html2text", document))
+    assert normalized(convert_document("xhtml", document)) == expected
+
+
+def test_xhtml_converter_keeps_unicode():
+    # html2text replaces characters outside ASCII with approximations, the xhtml converter keeps them
+    document = tika_xhtml("<p>&#233;t&#233; &#8212; &#8220;q&#8221;</p>")
+    assert convert_document("html2text", document).strip() == 'ete -- "q"'
+    assert convert_document("xhtml", document).strip() == "\u00e9t\u00e9 \u2014 \u201cq\u201d"
+
+
+def test_xhtml_converter():
+    assert convert_document("xhtml", xhtml_document).strip() == xhtml_markdown
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64])
+def test_xhtml_converter_streaming(chunk_size):
+    converter = get_converter("xhtml")
+    parts = [converter.feed(xhtml_document[i:i + chunk_size]) for i in range(0, len(xhtml_document), chunk_size)]
+    # Markdown is emitted while the document is fed
+    assert any(parts)
+    parts.append(converter.close())
+    assert "".join(parts).strip() == xhtml_markdown
+
+
+def test_unknown_converter():
+    with pytest.raises(ValueError):
+        get_converter("pandoc")
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("kind", ["thread", "process"])
+async def test_conversion_pool(kind):
+    pool = ConversionPool(kind, workers=1, inline_max_bytes=0)
+    try:
+        converted = await pool.run(partial(convert_document, "html2text"), hello_world_docx_tika_resp)
+    finally:
+        pool.shutdown()
+    assert converted.strip() == "Hello world!"
+
+
+@pytest.mark.asyncio
+async def test_small_documents_are_converted_inline(mocker):
+    pool = ConversionPool("thread", workers=1, inline_max_bytes=len(hello_world_docx_tika_resp))
+    submit = mocker.spy(pool.executor, "submit")
+    try:
+        converted = await pool.run(partial(convert_document, "html2text"), hello_world_docx_tika_resp)
+    finally:
+        pool.shutdown()
+    assert converted.strip() == "Hello world!"
+    submit.assert_not_called()
+
+
+def test_unknown_pool_kind():
+    with pytest.raises(ValueError):
+        ConversionPool("gpu", workers=1, inline_max_bytes=0)
@@ -1,16 +1,45 @@
+import gzip
+import io
+import json
+import time
+import zipfile
 import pytest
 from fastapi.testclient import TestClient
 from app.main import app
 from app.config import settings
+from app.services.jobs import JobManager
 
-client = TestClient(app)
 
-def test_health_check():
+@pytest.fixture(scope="module")
+def client():
+    # Entering the client runs the application lifespan, which opens the shared Tika client
+    with TestClient(app) as client:
+        yield client
+
+def test_health_check(client):
     response = client.get("/health")
     assert response.status_code == 200
     assert response.json()["status"] == "healthy"
+    assert response.json()["backends"][0]["state"] == "closed"
+
+def test_liveness_and_readiness(client):
+    assert client.get("/health/live").json() == {"status": "alive"}
+    # The first background probe of Tika may not have completed yet
+    for _ in range(100):
+        response = client.get("/health/ready")
+        if response.status_code == 200:
+            break
+        time.sleep(0.05)
+    assert response.status_code == 200
+    assert response.json() == {"status": "ready"}
+    assert client.get("/health").json()["checked_at"] is not None
 
-def test_unauthorized():
+def test_request_id(client):
+    response = client.get("/health/live", headers={"X-Request-ID": "request-1"})
+    assert response.headers["X-Request-ID"] == "request-1"
+    assert len(client.get("/health/live").headers["X-Request-ID"]) == 32
+
+def test_unauthorized(client):
     headers = {
         "Content-Type": "text/plain",
         "X-Filename": "test.txt"
@@ -23,7 +52,7 @@ def test_unauthorized():
     assert response.status_code == 401
     assert "Authorization header is missing" in response.json()["detail"]
 
-def test_invalid_token():
+def test_invalid_token(client):
     headers = {
         "Authorization": "Bearer invalid_token",
         "Content-Type": "text/plain",
@@ -37,7 +66,7 @@ def test_invalid_token():
     assert response.status_code == 401
     assert "Invalid API key" in response.json()["detail"]
 
-def test_invalid_format():
+def test_invalid_format(client):
     headers = {
         "Authorization": settings.API_KEY,
         "Content-Type": "text/plain",
@@ -51,7 +80,7 @@ def test_invalid_format():
     assert response.status_code == 401
     assert "Invalid authorization header format" in response.json()["detail"]
 
-def test_process_document_raw_data():
+def test_process_document_raw_data(client):
     headers = {
         "Authorization": f"Bearer {settings.API_KEY}",
         "Content-Type": "text/plain",
@@ -66,7 +95,7 @@ def test_process_document_raw_data():
     assert response.json()["success"] is True
     assert "page_content" in response.json()["content"]
 
-def test_process_document_using_data_field():
+def test_process_document_using_data_field(client):
     # This mimics how OWUI communicates with an endpoint in the ExternalDocumentLoader class
     headers = {
         "Authorization": f"Bearer {settings.API_KEY}",
@@ -83,7 +112,7 @@ def test_process_document_using_data_field():
     assert response.json()["success"] is True
     assert "page_content" in response.json()["content"]
 
-def test_process_document_raw_data_no_filename():
+def test_process_document_raw_data_no_filename(client):
     headers = {
         "Authorization": f"Bearer {settings.API_KEY}",
         "Content-Type": "text/plain"
@@ -96,7 +125,20 @@ def test_process_document_raw_data_no_filename():
     assert response.status_code == 200
     assert response.json()["success"] is True
 
-def test_process_document_no_content():
+def test_process_document_compressed(client):
+    headers = {
+        "Authorization": f"Bearer {settings.API_KEY}",
+        "Content-Type": "text/plain",
+        "Content-Encoding": "gzip",
+        "Accept-Encoding": "gzip"
+    }
+    text = "Hello world! " * 1000
+    response = client.put("/api/v1/process", headers=headers, content=gzip.compress(text.encode()))
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.json()["content"]["page_content"].startswith("Hello world!")
+
+def test_process_document_no_content(client):
     headers = {
         "Authorization": f"Bearer {settings.API_KEY}",
         "Content-Type": "text/plain"
@@ -109,3 +151,193 @@ def test_process_document_no_content():
     assert response.status_code == 400
     assert "No content provided" in response.json()["detail"]
 
+
+def test_process_document_unknown_converter(client):
+    headers = {
+        "Authorization": f"Bearer {settings.API_KEY}",
+        "Content-Type": "text/plain",
+        "X-Converter": "pandoc"
+    }
+    response = client.put(
+        "/api/v1/process",
+        headers=headers,
+        content=b"test content"
+    )
+    assert response.status_code == 400
+    assert "Unknown converter" in response.json()["detail"]
+
+def test_process_document_split_pages(client):
+    headers = {
+        "Authorization": f"Bearer {settings.API_KEY}",
+        "Content-Type": "text/plain",
+        "X-Split": "pages"
+    }
+    response = client.put("/api/v1/process", headers=headers, content=b"test content")
+    assert response.status_code == 200
+    documents = response.json()
+    assert len(documents) == 1
+    assert "page_content" in documents[0]
+
+def test_process_document_split_embedded_documents(client, mocker):
+    mocker.patch.object(settings, "RMETA_ENABLED", True)
+    headers = {
+        "Authorization": f"Bearer {settings.API_KEY}",
+        "Content-Type": "application/zip",
+        "X-Split": "documents"
+    }
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zip_file:
+        zip_file.writestr("hello.txt", "Hello world!")
+    response = client.put("/api/v1/process", headers=headers, content=archive.getvalue())
+    assert response.status_code == 200
+    documents = response.json()
+    assert documents[0]["metadata"]["Content-Type"].startswith("application/zip")
+    assert any("Hello world!" in document["page_content"] for document in documents)
+
+def test_process_document_split_chunks(client):
+    headers = {
+        "Authorization": f"Bearer {settings.API_KEY}",
+        "Content-Type": "text/plain",
+        "X-Split": "chunks",
+        "X-Chunk-Size": "40",
+        "X-Chunk-Overlap": "20"
+    }
+    content = " ".join(f"Sentence number {number}." for number in range(20)).encode()
+    response = client.put("/api/v1/process", headers=headers, content=content)
+    assert response.status_code == 200
+    chunks = response.json()
+    assert len(chunks) > 1
+    assert all(len(chunk["page_content"]) <= 40 for chunk in chunks)
+    assert [chunk["metadata"]["chunk_index"] for chunk in chunks] == list(range(len(chunks)))
+    assert chunks[1]["metadata"]["start_index"] < chunks[0]["metadata"]["end_index"]
+
+def test_process_document_split_chunks_query(client):
+    headers = {"Authorization": f"Bearer {settings.API_KEY}", "Content-Type": "text/plain"}
+    response = client.put(
+        "/api/v1/process?split=chunks&chunk_size=50&chunk_overlap=0", headers=headers, content=b"test content"
+    )
+    assert response.status_code == 200
+    chunks = response.json()
+    assert len(chunks) == 1
+    assert chunks[0]["metadata"]["start_index"] == 0
+
+def test_process_document_chunk_overlap_too_large(client):
+    headers = {"Authorization": f"Bearer {settings.API_KEY}", "Content-Type": "text/plain", "X-Split": "chunks"}
+    response = client.put(
+        "/api/v1/process?chunk_size=50&chunk_overlap=50", headers=headers, content=b"test content"
+    )
+    assert response.status_code == 400
+    assert "overlap" in response.json()["detail"]
+
+def test_process_document_unknown_split(client):
+    headers = {
+        "Authorization": f"Bearer {settings.API_KEY}",
+        "Content-Type": "text/plain",
+        "X-Split": "sentences"
+    }
+    response = client.put("/api/v1/process", headers=headers, content=b"test content")
+    assert response.status_code == 400
+    assert "Unknown split" in response.json()["detail"]
+
+def test_process_document_streamed(client, mocker):
+    mocker.patch.multiple(settings, STREAM_RESPONSES=True, STREAM_RESPONSES_MIN_BYTES=0)
+    headers = {
+        "Authorization": f"Bearer {settings.API_KEY}",
+        "Content-Type": "text/plain",
+        "X-Filename": "test.txt"
+    }
+    response = client.put("/api/v1/process", headers=headers, content=b"test content")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert "content-length" not in response.headers
+    data = response.json()
+    assert data["success"] is True
+    assert "page_content" in data["content"]
+    assert data["content"]["metadata"]["X-Filename"] == "test.txt"
+
+def test_jobs(client):
+    headers = {
+        "Authorization": f"Bearer {settings.API_KEY}",
+        "Content-Type": "text/plain",
+        "X-Filename": "test.txt"
+    }
+    response = client.post("/api/v1/jobs", headers=headers, content=b"test content")
+    assert response.status_code == 202
+    job = response.json()
+    assert job["status"] in ("queued", "running", "succeeded")
+    assert response.headers["location"] == f"/api/v1/jobs/{job['job_id']}"
+
+    response = client.get(response.headers["location"], params={"wait": 10}, headers=headers)
+    assert response.status_code == 200
+    job = response.json()
+    assert job["status"] == "succeeded"
+    assert job["content"]["metadata"]["X-Filename"] == "test.txt"
+
+    response = client.delete(f"/api/v1/jobs/{job['job_id']}", headers=headers)
+    assert response.status_code == 204
+    response = client.get(f"/api/v1/jobs/{job['job_id']}", headers=headers)
+    assert response.status_code == 404
+
+def test_named_api_keys(client, mocker):
+    mocker.patch.object(settings, "API_KEYS", "chat:chat-key,import:import-key")
+    headers = {"Authorization": "Bearer import-key", "Content-Type": "text/plain", "X-Priority": "high"}
+    response = client.put("/api/v1/process", headers=headers, content=b"test content")
+    assert response.status_code == 200
+
+    response = client.post("/api/v1/jobs", headers=headers, content=b"test content")
+    assert response.status_code == 202
+    # Jobs are only visible to the tenant which submitted them, which is checked before waiting on them
+    get = mocker.spy(JobManager, "get")
+    location = response.headers["location"]
+    response = client.get(location, params={"wait": 10}, headers={"Authorization": "Bearer chat-key"})
+    assert response.status_code == 404
+    assert [call.args[2:] for call in get.call_args_list] == [()]
+
+def test_unknown_priority(client):
+    headers = {"Authorization": f"Bearer {settings.API_KEY}", "Content-Type": "text/plain", "X-Priority": "urgent"}
+    response = client.put("/api/v1/process", headers=headers, content=b"test content")
+    assert response.status_code == 400
+    assert "Unknown priority" in response.json()["detail"]
+
+def test_metrics(client):
+    headers = {"Authorization": f"Bearer {settings.API_KEY}", "Content-Type": "text/plain"}
+    client.put("/api/v1/process", headers=headers, content=b"test content")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert 'router_requests_total{method="PUT",handler="process_document",status="200"}' in response.text
+    assert 'router_stage_duration_seconds_count{stage="tika",endpoint="tika",mime_type="text/plain"}' in response.text
+    assert "router_admission_queued 0" in response.text
+
+def test_process_batch(client):
+    headers = {"Authorization": f"Bearer {settings.API_KEY}"}
+    files = [
+        ("files", ("first.txt", b"first content", "text/plain")),
+        ("files", ("empty.txt", b"", "text/plain")),
+        ("files", ("third.txt", b"third content", "text/plain")),
+    ]
+    response = client.post("/api/v1/process/batch", headers=headers, files=files)
+    assert response.status_code == 200
+    documents = response.json()
+    assert [document["index"] for document in documents] == [0, 1, 2]
+    assert [document["success"] for document in documents] == [True, False, True]
+    assert documents[0]["filename"] == "first.txt"
+    assert "page_content" in documents[0]
+    assert documents[1]["status_code"] == 400
+
+def test_process_batch_ndjson(client):
+    headers = {
+        "Authorization": f"Bearer {settings.API_KEY}",
+        "Accept": "application/x-ndjson"
+    }
+    files = [("files", (f"{i}.txt", f"content {i}".encode(), "text/plain")) for i in range(5)]
+    response = client.post("/api/v1/process/batch", headers=headers, files=files)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    documents = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(document["index"] for document in documents) == [0, 1, 2, 3, 4]
+    assert all(document["success"] for document in documents)
+
+def test_process_batch_unauthorized(client):
+    files = [("files", ("first.txt", b"first content", "text/plain"))]
+    response = client.post("/api/v1/process/batch", files=files)
+    assert response.status_code == 401
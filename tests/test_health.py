@@ -0,0 +1,60 @@
+import asyncio
+import pytest
+import httpx
+from app.services.backends import BackendPool, TikaBackend
+from app.services.health import HealthMonitor
+
+
+def make_monitor(handler, stale_seconds: float = 60) -> HealthMonitor:
+    backends = BackendPool([TikaBackend("http://tika-1", "tika-1"), TikaBackend("http://tika-2", "tika-2")])
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return HealthMonitor(backends, client, interval=0.01, timeout=1, stale_seconds=stale_seconds)
+
+
+@pytest.mark.asyncio
+async def test_probe_records_results():
+    def handler(request):
+        if request.url.host == "tika-2":
+            raise httpx.ConnectError("Connection refused")
+        return httpx.Response(200, text="Apache Tika 3.0.0\n")
+
+    monitor = make_monitor(handler)
+    assert not monitor.ready
+    await monitor.probe()
+    assert monitor.ready
+    first, second = monitor.backends.health()
+    assert (first["healthy"], first["version"]) == (True, "Apache Tika 3.0.0")
+    assert first["probed_at"] == pytest.approx(monitor.checked_at, abs=1)
+    assert first["probe_latency_ms"] is not None
+    assert (second["healthy"], second["state"], second["version"]) == (False, "open", None)
+
+
+@pytest.mark.asyncio
+async def test_probes_in_background():
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.host)
+        return httpx.Response(200, text="Apache Tika 3.0.0")
+
+    monitor = make_monitor(handler)
+    monitor.start()
+    try:
+        for _ in range(100):
+            if len(calls) >= 4:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        await monitor.close()
+    # Every round probes both backends
+    assert len(calls) >= 4
+    assert monitor.fresh
+
+
+@pytest.mark.asyncio
+async def test_not_ready_when_probes_are_stale(mocker):
+    monitor = make_monitor(lambda request: httpx.Response(200, text="Apache Tika 3.0.0"), stale_seconds=60)
+    await monitor.probe()
+    mocker.patch("app.services.health.time.time", return_value=monitor.checked_at + 61)
+    assert monitor.backends.available
+    assert not monitor.ready
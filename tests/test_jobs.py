@@ -0,0 +1,179 @@
+import asyncio
+import time
+import httpx
+import pytest
+from fastapi import HTTPException
+from app.services.jobs import FAILED, QUEUED, SUCCEEDED, Job, JobInput, JobManager, MemoryJobStore, SQLiteJobStore
+from app.services.tika import TikaService
+
+tika_response = {"Content-Type": "application/pdf", "X-TIKA:content": "Hello world!"}
+
+
+def finished_job(job_id: str, text: str = "x" * 40) -> Job:
+    return Job(id=job_id, status=SUCCEEDED, finished=time.time(), documents=[(text, {})])
+
+
+def test_memory_store_max_bytes():
+    store = MemoryJobStore(max_bytes=100, ttl=60)
+    store.add(Job(id="queued", status=QUEUED))
+    for job_id in "abc":
+        store.add(finished_job(job_id))
+    # The oldest finished job is evicted, but never a job which is not finished
+    assert store.get("a") is None
+    assert store.get("c") is not None
+    assert store.get("queued") is not None
+    assert store.size <= 100
+
+
+def test_memory_store_ttl(mocker):
+    store = MemoryJobStore(max_bytes=1024, ttl=60)
+    store.add(finished_job("a"))
+    mocker.patch("app.services.jobs.time.time", return_value=time.time() + 61)
+    assert store.get("a") is None
+    assert len(store) == 0
+
+
+def test_sqlite_store(tmp_path):
+    store = SQLiteJobStore(str(tmp_path / "jobs.db"), max_bytes=100, ttl=60)
+    store.add(Job(id="queued", status=QUEUED, filename="document.pdf"))
+    job = store.get("queued")
+    assert (job.status, job.filename, job.documents) == (QUEUED, "document.pdf", None)
+    for job_id in "abc":
+        store.add(finished_job(job_id))
+    assert store.get("a") is None
+    assert store.get("c").documents == [("x" * 40, {})]
+    assert store.delete("c")
+    assert not store.delete("c")
+    # Jobs are shared by every store using the database
+    assert SQLiteJobStore(str(tmp_path / "jobs.db"), max_bytes=100, ttl=60).get("b") is not None
+
+
+@pytest.mark.parametrize("store_type", ["memory", "sqlite"])
+def test_store_put_after_delete(tmp_path, store_type):
+    if store_type == "memory":
+        store = MemoryJobStore(max_bytes=1024, ttl=60)
+    else:
+        store = SQLiteJobStore(str(tmp_path / "jobs.db"), max_bytes=1024, ttl=60)
+    job = Job(id="a", status=QUEUED)
+    store.add(job)
+    assert store.delete("a")
+    # A job finishing after it was deleted is not stored again
+    store.put(finished_job("a"))
+    assert store.get("a") is None
+
+
+def test_sqlite_store_fails_stale_jobs(tmp_path, mocker):
+    store = SQLiteJobStore(str(tmp_path / "jobs.db"), max_bytes=1024, ttl=60, stale_seconds=10)
+    store.add(Job(id="alive", status=QUEUED))
+    store.add(Job(id="stale", status=QUEUED))
+    now = time.time()
+    mocker.patch("app.services.jobs.time.time", return_value=now + 5)
+    store.touch(["alive"])
+    mocker.patch("app.services.jobs.time.time", return_value=now + 11)
+    assert store.get("alive").status == QUEUED
+    job = store.get("stale")
+    assert (job.status, job.status_code) == (FAILED, 503)
+    # Stale jobs nobody reads are deleted once they would have expired
+    store.add(Job(id="left", status=QUEUED))
+    mocker.patch("app.services.jobs.time.time", return_value=now + 100)
+    store.put(store.get("alive"))
+    assert store.get("left") is None
+
+
+def job_manager(handler, **kwargs) -> JobManager:
+    tika_service = TikaService(httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    options = {"workers": 1, "max_queued": 10, "max_queued_bytes": 1024 * 1024, **kwargs}
+    return JobManager(tika_service, MemoryJobStore(max_bytes=1024 * 1024, ttl=60), **options)
+
+
+@pytest.mark.asyncio
+async def test_job_succeeds():
+    manager = job_manager(lambda request: httpx.Response(200, json=tika_response))
+    manager.start()
+    try:
+        job = await manager.submit(JobInput(b"%PDF-1.4", "document.pdf"))
+        assert job.status == QUEUED
+        job = await manager.get(job.id, wait=5)
+        assert job.status == SUCCEEDED
+        assert job.documents == [("Hello world!", {"Content-Type": "application/pdf"})]
+        assert job.started is not None and job.finished >= job.started
+    finally:
+        await manager.close()
+
+
+@pytest.mark.asyncio
+async def test_job_chunks():
+    manager = job_manager(lambda request: httpx.Response(200, json=tika_response))
+    manager.start()
+    try:
+        job = await manager.submit(JobInput(b"%PDF-1.4", "document.pdf", chunking=(6, 0)), "chunks")
+        job = await manager.get(job.id, wait=5)
+        assert job.status == SUCCEEDED
+        assert [text for text, _ in job.documents] == ["Hello", "world!"]
+        assert job.documents[1][1]["start_index"] == 6
+    finally:
+        await manager.close()
+
+
+@pytest.mark.asyncio
+async def test_job_fails():
+    manager = job_manager(lambda request: httpx.Response(422, text="Unprocessable"))
+    manager.start()
+    try:
+        job = await manager.submit(JobInput(b"%PDF-1.4"))
+        job = await manager.get(job.id, wait=5)
+        assert (job.status, job.status_code) == (FAILED, 422)
+        assert "Unprocessable" in job.error
+    finally:
+        await manager.close()
+
+
+@pytest.mark.asyncio
+async def test_job_queue_full():
+    manager = job_manager(lambda request: httpx.Response(200, json=tika_response), max_queued=1)
+    # Without workers the first job stays queued
+    await manager.submit(JobInput(b"%PDF-1.4"))
+    with pytest.raises(HTTPException) as exc_info:
+        await manager.submit(JobInput(b"%PDF-1.4"))
+    assert exc_info.value.status_code == 503
+    assert "Retry-After" in exc_info.value.headers
+    await manager.close()
+
+
+@pytest.mark.asyncio
+async def test_job_deleted_while_running():
+    started = asyncio.Event()
+
+    async def handler(request):
+        started.set()
+        await asyncio.sleep(10)
+        return httpx.Response(200, json=tika_response)
+
+    manager = job_manager(handler)
+    manager.start()
+    try:
+        job = await manager.submit(JobInput(b"%PDF-1.4"))
+        await asyncio.wait_for(started.wait(), 5)
+        assert manager.running == 1
+        assert await manager.delete(job.id)
+        assert await manager.get(job.id) is None
+        # The cancelled extraction takes a few iterations of the loop to unwind
+        for _ in range(100):
+            if manager.running == 0:
+                break
+            await asyncio.sleep(0.01)
+        assert manager.running == 0
+    finally:
+        await manager.close()
+
+
+@pytest.mark.asyncio
+async def test_long_poll_times_out():
+    manager = job_manager(lambda request: httpx.Response(200, json=tika_response))
+    job = await manager.submit(JobInput(b"%PDF-1.4"))
+    started = time.monotonic()
+    assert (await manager.get(job.id, wait=0.1)).status == QUEUED
+    assert time.monotonic() - started >= 0.1
+    await manager.close()
+    # Jobs left in the queue are failed on shutdown
+    assert (await manager.get(job.id)).status_code == 503
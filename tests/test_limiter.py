@@ -0,0 +1,158 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from app.config import settings
+from app.services.limiter import ConcurrencyLimiter, Flow, classify
+
+
+def make_limiter(**kwargs) -> ConcurrencyLimiter:
+    options = dict(max_in_flight=2, max_in_flight_bytes=100, max_queue=2, queue_timeout=1.0, retry_after=7)
+    options.update(kwargs)
+    return ConcurrencyLimiter(**options)
+
+
+@pytest.mark.asyncio
+async def test_waits_for_free_slot():
+    limiter = make_limiter()
+    await limiter.acquire()
+    await limiter.acquire()
+    waiting = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0)
+    assert not waiting.done()
+    assert limiter.queued == 1
+    limiter.release()
+    await waiting
+    assert (limiter.in_flight, limiter.queued) == (2, 0)
+
+
+@pytest.mark.asyncio
+async def test_weighted_by_bytes():
+    limiter = make_limiter(max_in_flight=10)
+    await limiter.acquire(60)
+    waiting = asyncio.create_task(limiter.acquire(60))
+    await asyncio.sleep(0)
+    assert not waiting.done()
+    limiter.release(60)
+    await waiting
+    assert limiter.in_flight_bytes == 60
+
+
+@pytest.mark.asyncio
+async def test_document_larger_than_byte_limit_is_admitted_alone():
+    limiter = make_limiter()
+    await limiter.acquire(1000)
+    assert limiter.in_flight_bytes == 1000
+
+
+@pytest.mark.asyncio
+async def test_queue_full():
+    limiter = make_limiter(max_in_flight=1, max_queue=1)
+    await limiter.acquire()
+    waiting = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0)
+    with pytest.raises(HTTPException) as exc_info:
+        await limiter.acquire()
+    assert exc_info.value.status_code == 429
+    assert exc_info.value.headers["Retry-After"] == "7"
+    waiting.cancel()
+
+
+@pytest.mark.asyncio
+async def test_queue_timeout():
+    limiter = make_limiter(max_in_flight=1, queue_timeout=0.01)
+    await limiter.acquire()
+    with pytest.raises(HTTPException) as exc_info:
+        await limiter.acquire()
+    assert exc_info.value.status_code == 503
+    assert exc_info.value.headers["Retry-After"] == "7"
+    assert (limiter.in_flight, limiter.queued, limiter.rejected) == (1, 0, 1)
+
+
+@pytest.mark.asyncio
+async def test_cancelled_in_same_tick_as_release():
+    limiter = make_limiter(max_in_flight=1)
+    await limiter.acquire()
+    cancelled = asyncio.create_task(limiter.acquire())
+    waiting = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0)
+    cancelled.cancel()
+    limiter.release()
+    await waiting
+    with pytest.raises(asyncio.CancelledError):
+        await cancelled
+    assert (limiter.in_flight, limiter.queued) == (1, 0)
+
+
+@pytest.mark.asyncio
+async def test_slot_releases_on_error():
+    limiter = make_limiter()
+    with pytest.raises(ValueError):
+        async with limiter.slot(50):
+            raise ValueError()
+    assert (limiter.in_flight, limiter.in_flight_bytes) == (0, 0)
+
+
+async def admitted_order(limiter: ConcurrencyLimiter, flows) -> list:
+    """Queue one document of each flow behind a full limiter and return the flows in the order they are admitted"""
+    await limiter.acquire()
+    order = []
+
+    async def wait(flow):
+        await limiter.acquire(flow=flow)
+        order.append(flow)
+
+    tasks = []
+    for flow in flows:
+        tasks.append(asyncio.create_task(wait(flow)))
+        await asyncio.sleep(0)
+    for _ in flows:
+        limiter.release()
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+    return order
+
+
+@pytest.mark.asyncio
+async def test_new_flow_does_not_wait_behind_backlog():
+    limiter = make_limiter(max_in_flight=1, max_queue=10)
+    bulk = Flow("import", "low", 1)
+    chat = Flow("chat", "high", 1)
+    order = await admitted_order(limiter, [bulk] * 5 + [chat])
+    # The chat document is admitted right after the first document of the import, not after all of them
+    assert order.index(chat) == 1
+
+
+@pytest.mark.asyncio
+async def test_flows_are_admitted_by_weight():
+    limiter = make_limiter(max_in_flight=1, max_queue=20)
+    light = Flow("a", "low", 1)
+    heavy = Flow("b", "high", 4)
+    order = await admitted_order(limiter, [light] * 5 + [heavy] * 10)
+    assert order[:10].count(heavy) == 8
+
+
+@pytest.mark.asyncio
+async def test_tenant_queue_full():
+    limiter = make_limiter(max_in_flight=1, max_queue=10, max_queue_per_tenant=1)
+    await limiter.acquire()
+    waiting = asyncio.create_task(limiter.acquire(flow=Flow("import")))
+    await asyncio.sleep(0)
+    with pytest.raises(HTTPException) as exc_info:
+        await limiter.acquire(flow=Flow("import"))
+    assert exc_info.value.status_code == 429
+    # Other tenants may still queue
+    other = asyncio.create_task(limiter.acquire(flow=Flow("chat")))
+    await asyncio.sleep(0)
+    assert limiter.queued_by_tenant() == {"import": 1, "chat": 1}
+    waiting.cancel()
+    other.cancel()
+
+
+def test_classify(mocker):
+    mocker.patch.multiple(
+        settings, TENANT_WEIGHTS="chat=2", PRIORITY_WEIGHTS="high=8,normal=2,low=1", PRIORITY_SMALL_BYTES=100
+    )
+    assert classify("chat", size=10) == Flow("chat", "high", 16)
+    assert classify("import", size=1000) == Flow("import", "normal", 2)
+    assert classify("import", size=10, bulk=True) == Flow("import", "low", 1)
+    assert classify("import", "high", bulk=True).priority == "high"
@@ -0,0 +1,55 @@
+import asyncio
+import pytest
+from loguru import logger
+from app.config import settings
+from app.core.logs import annotate, content_preview, log_event
+from app.core.metrics import STAGE_SECONDS
+
+
+@pytest.fixture
+def records():
+    records = []
+    handler_id = logger.add(lambda message: records.append(message.record), level="DEBUG")
+    yield records
+    logger.remove(handler_id)
+
+
+def test_log_event(records):
+    with log_event("POST /api/v1/process", "request-1", tenant="default"):
+        annotate(mime_type="application/pdf", endpoint="tika/text")
+        STAGE_SECONDS.observe(0.25, "tika", "tika/text", "application/pdf")
+        STAGE_SECONDS.observe(0.25, "tika", "tika/text", "application/pdf")
+        logger.info("Inside the request")
+    # Records written while the event is open carry its request id
+    inside, event = records
+    assert inside["extra"]["request_id"] == "request-1"
+    assert event["extra"]["request_id"] == "request-1"
+    assert event["extra"]["mime_type"] == "application/pdf"
+    assert event["extra"]["stages_ms"] == {"tika": 500.0}
+    assert event["message"].startswith("POST /api/v1/process tenant=default mime_type=application/pdf")
+
+
+def test_nested_log_events(records):
+    async def document(index: int):
+        with log_event("Processed batch document", index=index):
+            annotate(endpoint="tika")
+            STAGE_SECONDS.observe(0.1, "tika", "tika", "")
+
+    async def batch():
+        with log_event("POST /api/v1/process/batch", "batch-1"):
+            await asyncio.gather(document(0), document(1))
+
+    asyncio.run(batch())
+    first, second, event = records
+    # Documents inherit the request id, while their fields and stages are kept apart from the batch
+    assert {first["extra"]["index"], second["extra"]["index"]} == {0, 1}
+    assert {first["extra"]["request_id"], second["extra"]["request_id"]} == {"batch-1"}
+    assert first["extra"]["stages_ms"] == {"tika": 100.0}
+    assert "stages_ms" not in event["extra"] and "endpoint" not in event["extra"]
+
+
+def test_content_preview(mocker):
+    assert content_preview(b"Hello world") is None
+    mocker.patch.multiple(settings, LOG_PREVIEW_SAMPLE_RATE=1.0, LOG_PREVIEW_BYTES=5)
+    assert content_preview(b"Hello world") == "'Hello'"
+    assert content_preview(b"\x00\x01\x02\xff\xfe") is None
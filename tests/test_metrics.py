@@ -0,0 +1,50 @@
+from app.core.metrics import Counter, Gauge, Histogram, Registry, mime_label
+
+
+def test_counter_and_gauge():
+    registry = Registry()
+    counter = registry.register(Counter("requests_total", "Requests", ["path"]))
+    gauge = registry.register(Gauge("in_flight", "In flight"))
+    counter.inc("/a")
+    counter.inc("/a")
+    counter.inc('/"b"')
+    gauge.inc()
+    gauge.inc()
+    gauge.dec()
+    assert registry.render().splitlines() == [
+        "# HELP requests_total Requests",
+        "# TYPE requests_total counter",
+        'requests_total{path="/a"} 2',
+        'requests_total{path="/\\"b\\""} 1',
+        "# HELP in_flight In flight",
+        "# TYPE in_flight gauge",
+        "in_flight 1",
+    ]
+
+
+def test_histogram():
+    histogram = Histogram("latency_seconds", "Latency", ["stage"], buckets=(0.1, 1))
+    histogram.observe(0.05, "tika")
+    histogram.observe(0.1, "tika")
+    histogram.observe(5, "tika")
+    assert histogram.count("tika") == 3
+    assert histogram.render()[2:] == [
+        'latency_seconds_bucket{stage="tika",le="0.1"} 2',
+        'latency_seconds_bucket{stage="tika",le="1"} 2',
+        'latency_seconds_bucket{stage="tika",le="+Inf"} 3',
+        'latency_seconds_sum{stage="tika"} 5.15',
+        'latency_seconds_count{stage="tika"} 3',
+    ]
+
+
+def test_collected_metric():
+    registry = Registry()
+    registry.collected("queued", "Queued", lambda: [(("tika-1",), 3)], ["backend"])
+    assert 'queued{backend="tika-1"} 3' in registry.render()
+
+
+def test_mime_label():
+    assert mime_label("application/pdf") == "application/pdf"
+    assert mime_label("Text/HTML; charset=utf-8") == "text/html"
+    assert mime_label("application/x-made-up") == "other"
+    assert mime_label(None) == ""
@@ -0,0 +1,84 @@
+import io
+import zipfile
+import pytest
+from app.core.metrics import MIME_DETECTIONS
+from app.services.mime import MimeDetector
+
+with open("tests/test_data/hello_world.doc", "rb") as fp:
+    hello_world_doc_content = fp.read()
+
+with open("tests/test_data/hello_world.docx", "rb") as fp:
+    hello_world_docx_content = fp.read()
+
+docx_mime_type = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+
+def make_zip(*entries) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name, content, compression in entries:
+            archive.writestr(name, content, compress_type=compression)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def detector():
+    return MimeDetector(max_magic_bytes=64 * 1024)
+
+
+@pytest.mark.parametrize(
+    "content, expected_mime",
+    [
+        (b"%PDF-1.7\n", "application/pdf"),
+        (b"\x89PNG\r\n\x1a\n\x00\x00", "image/png"),
+        (hello_world_docx_content, docx_mime_type),
+        # Only the start of the document, without the central directory of the zip
+        (hello_world_docx_content[:4096], docx_mime_type),
+        (hello_world_doc_content, "application/msword"),
+        (make_zip(
+            ("mimetype", "application/vnd.oasis.opendocument.text", zipfile.ZIP_STORED),
+            ("content.xml", "<office:document-content/>", zipfile.ZIP_DEFLATED),
+        ), "application/vnd.oasis.opendocument.text"),
+        (make_zip(("xl/workbook.xml", "<workbook/>", zipfile.ZIP_DEFLATED)),
+         "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    ],
+)
+def test_detect_signature(detector, content, expected_mime):
+    before = MIME_DETECTIONS.value("signature")
+    assert detector.detect(content) == expected_mime
+    assert MIME_DETECTIONS.value("signature") == before + 1
+
+
+@pytest.mark.parametrize("provided, expected", [("text/csv", "text/csv"), ("application/octet-stream", "application/pdf")])
+def test_detect_client_type(detector, provided, expected):
+    assert detector.detect(b"%PDF-1.7\n", provided_mime_type=provided) == expected
+
+
+def test_detect_libmagic_bounded(detector, mocker):
+    from_buffer = mocker.patch("magic.from_buffer", return_value="audio/mpeg")
+    content = b"ID3\x04\x00" + b"\x00" * 100 * 1024
+    assert detector.detect(content) == "audio/mpeg"
+    assert len(from_buffer.call_args.args[0]) == 64 * 1024
+
+
+@pytest.mark.parametrize(
+    "content, filename, expected_mime, tier",
+    [
+        (b"fake content", None, "text/plain", "text"),
+        (b"a,b\n1,2\n", "data.csv", "text/csv", "filename"),
+        (b"\xef\xbb\xbf  <!DOCTYPE html><html></html>", None, "text/html", "text"),
+        (b'<?xml version="1.0"?><root/>', None, "application/xml", "text"),
+    ],
+)
+def test_detect_text_before_libmagic(detector, mocker, content, filename, expected_mime, tier):
+    from_buffer = mocker.patch("magic.from_buffer")
+    before = MIME_DETECTIONS.value(tier)
+    assert detector.detect(content, filename) == expected_mime
+    assert MIME_DETECTIONS.value(tier) == before + 1
+    from_buffer.assert_not_called()
+
+
+def test_detect_filename_after_libmagic(detector, mocker):
+    mocker.patch("magic.from_buffer", side_effect=Exception("Mock an error"))
+    assert detector.detect(b"\x00\x01\x02", "test.pdf") == "application/pdf"
+    assert detector.detect(b"\x00\x01\x02") == "application/octet-stream"
@@ -0,0 +1,24 @@
+import io
+import pytest
+from pypdf import PdfReader, PdfWriter
+from app.services.pdf import split_pdf
+
+
+def make_pdf(pages: int) -> bytes:
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=595, height=842)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def test_split_pdf():
+    parts = split_pdf(make_pdf(5), pages_per_part=2, min_pages=2)
+    assert [(first, last) for first, last, _ in parts] == [(1, 2), (3, 4), (5, 5)]
+    assert [len(PdfReader(io.BytesIO(part)).pages) for _, _, part in parts] == [2, 2, 1]
+
+
+@pytest.mark.parametrize("content", [make_pdf(3), b"%PDF-1.4\nnot really a pdf"])
+def test_split_pdf_not_split(content):
+    assert split_pdf(content, pages_per_part=2, min_pages=4) is None
@@ -0,0 +1,54 @@
+import json
+import pytest
+from pydantic import ValidationError
+from app.services.routing import RoutingRule, RoutingTable, load_routing_table
+
+rules = [
+    {"mime_types": ["text/plain", "text/csv"], "max_bytes": 1000, "action": "passthrough"},
+    {"mime_types": ["application/pdf"], "min_bytes": 1000, "endpoint": "tika/text",
+     "headers": {"X-Tika-PDFOcrStrategy": "no_ocr"}},
+    {"mime_types": ["image/*"], "endpoint": "tika", "headers": {"X-Tika-OCRskipOcr": "true"}},
+    {"mime_types": ["*"], "converter": "xhtml"},
+]
+
+
+@pytest.fixture
+def table() -> RoutingTable:
+    return RoutingTable([RoutingRule(**rule) for rule in rules])
+
+
+def test_lookup_first_matching_rule(table):
+    assert table.lookup("text/plain; charset=utf-8", 10).passthrough
+    # Too large for passthrough, so the catch-all rule matches
+    assert table.lookup("text/plain", 2000).converter == "xhtml"
+    assert table.lookup("application/pdf", 5000).headers == {"X-Tika-PDFOcrStrategy": "no_ocr"}
+    assert table.lookup("image/png", 5000).headers == {"X-Tika-OCRskipOcr": "true"}
+    assert table.lookup("application/msword", 5000).converter == "xhtml"
+
+
+def test_lookup_unknown_size(table):
+    # Rules with a size range only match documents of known size
+    assert table.lookup("text/plain").converter == "xhtml"
+
+
+def test_lookup_without_match():
+    table = RoutingTable([RoutingRule(mime_types=["text/*"], action="passthrough")])
+    assert table.lookup("application/pdf", 10) is None
+
+
+def test_unknown_converter():
+    with pytest.raises(ValueError):
+        RoutingTable([RoutingRule(mime_types=["*"], converter="pandoc")])
+
+
+def test_invalid_rule():
+    with pytest.raises(ValidationError):
+        RoutingRule(mime_types=["*"], endpoint="unpack")
+
+
+def test_load_routing_table(tmp_path):
+    path = tmp_path / "routing.json"
+    path.write_text(json.dumps(rules))
+    table = load_routing_table(str(path))
+    assert len(table) == 4
+    assert table.lookup("text/csv", 10).passthrough
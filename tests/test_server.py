@@ -0,0 +1,21 @@
+import os
+import shutil
+from app.config import settings
+from app.server import share_stores
+
+
+def test_share_stores(mocker):
+    mocker.patch.object(settings, "CACHE_SQLITE_PATH", "")
+    mocker.patch.object(settings, "JOBS_SQLITE_PATH", "/data/jobs.db")
+    directory = share_stores()
+    try:
+        assert settings.CACHE_SQLITE_PATH == os.path.join(directory, "extraction_cache.sqlite")
+        assert settings.JOBS_SQLITE_PATH == "/data/jobs.db"
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_share_configured_stores(mocker):
+    mocker.patch.object(settings, "CACHE_SQLITE_PATH", "/data/cache.sqlite")
+    mocker.patch.object(settings, "JOBS_SQLITE_PATH", "/data/jobs.db")
+    assert share_stores() is None
@@ -0,0 +1,104 @@
+import asyncio
+import copy
+import httpx
+import pytest
+from app.services.backends import BackendPool, TikaBackend
+from app.services.health import HealthMonitor
+from app.services.limiter import ConcurrencyLimiter
+from app.services.shared import SharedState
+
+
+def worker_view(state: SharedState, worker: int) -> SharedState:
+    """The state as seen by another worker process"""
+    view = copy.copy(state)
+    view.worker = worker
+    return view
+
+
+def make_pool(state: SharedState, worker: int) -> BackendPool:
+    backends = [TikaBackend("http://tika-1", "tika-1"), TikaBackend("http://tika-2", "tika-2")]
+    return BackendPool(backends, failure_threshold=1, eject_seconds=30, shared=worker_view(state, worker))
+
+
+def test_admission_is_shared():
+    state = SharedState(workers=2, backends=1)
+    first, second = worker_view(state, 0), worker_view(state, 1)
+    assert first.try_admit(60, max_in_flight=2, max_in_flight_bytes=100)
+    # The bytes in flight of the other worker count
+    assert not second.try_admit(60, max_in_flight=2, max_in_flight_bytes=100)
+    assert second.try_admit(40, max_in_flight=2, max_in_flight_bytes=100)
+    assert not first.try_admit(0, max_in_flight=2, max_in_flight_bytes=100)
+    assert state.in_flight == 2
+    # A worker which exited releases its documents
+    state.reset_worker(1)
+    assert state.in_flight == 1
+    first.release(60)
+    assert state.in_flight == 0
+
+
+def test_probe_round_is_claimed_once():
+    state = SharedState(workers=2, backends=1)
+    assert worker_view(state, 0).claim_probe(10)
+    assert not worker_view(state, 1).claim_probe(10)
+    assert worker_view(state, 1).claim_probe(0)
+
+
+def test_probe_results():
+    state = SharedState(workers=1, backends=2)
+    assert state.probe_result(1) == (None, 0.0, False, None)
+    state.publish_probe(1, 1000.0, 0.25, True, "Apache Tika 3.0.0")
+    assert state.probe_result(1) == (1000.0, 0.25, True, "Apache Tika 3.0.0")
+    assert state.probe_result(0)[0] is None
+
+
+@pytest.mark.asyncio
+async def test_limiter_waits_for_other_workers():
+    state = SharedState(workers=2, backends=1)
+    limiters = [
+        ConcurrencyLimiter(1, 100, 2, queue_timeout=1.0, shared=worker_view(state, worker), poll_interval=0.01)
+        for worker in range(2)
+    ]
+    await limiters[0].acquire()
+    waiting = asyncio.create_task(limiters[1].acquire())
+    await asyncio.sleep(0.03)
+    assert not waiting.done()
+    # Released by the other worker, which does not wake this one, so it is found by polling
+    limiters[0].release()
+    await asyncio.wait_for(waiting, 1)
+    assert (limiters[0].in_flight, limiters[1].in_flight, state.in_flight) == (0, 1, 1)
+
+
+def test_ejection_is_shared():
+    state = SharedState(workers=2, backends=2)
+    first, second = make_pool(state, 0), make_pool(state, 1)
+    first.failed(first.backends[0])
+    assert first.backends[0].ejected
+    assert second.choose() is second.backends[1]
+    assert second.backends[0].state == "open"
+
+
+@pytest.mark.asyncio
+async def test_probe_results_are_taken_over():
+    state = SharedState(workers=2, backends=2)
+    probed = []
+
+    def handler(request):
+        probed.append(request.url.host)
+        if request.url.host == "tika-2":
+            raise httpx.ConnectError("Connection refused")
+        return httpx.Response(200, text="Apache Tika 3.0.0\n")
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monitors = [
+        HealthMonitor(make_pool(state, worker), client, interval=10, timeout=1, stale_seconds=60)
+        for worker in range(2)
+    ]
+    for monitor in monitors:
+        await monitor.probe()
+    # Only the first worker probed, the second took over its results
+    assert sorted(probed) == ["tika-1", "tika-2"]
+    assert monitors[1].ready
+    assert monitors[1].checked_at == monitors[0].checked_at
+    first, second = monitors[1].backends.health()
+    assert (first["healthy"], first["version"]) == (True, "Apache Tika 3.0.0")
+    assert (second["healthy"], second["state"]) == (False, "open")
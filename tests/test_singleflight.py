@@ -0,0 +1,63 @@
+import asyncio
+import pytest
+from app.services.singleflight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_are_coalesced():
+    singleflight = SingleFlight()
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "result"
+
+    results = await asyncio.gather(*(singleflight.do("key", work) for _ in range(5)))
+    assert calls == 1
+    assert [result for result, _ in results] == ["result"] * 5
+    assert sorted(shared for _, shared in results) == [False, True, True, True, True]
+    assert (singleflight.executed, singleflight.coalesced, singleflight.in_flight) == (1, 4, 0)
+
+
+@pytest.mark.asyncio
+async def test_different_keys_are_not_coalesced():
+    singleflight = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.01)
+        return "result"
+
+    await asyncio.gather(singleflight.do("a", work), singleflight.do("b", work))
+    assert (singleflight.executed, singleflight.coalesced) == (2, 0)
+
+
+@pytest.mark.asyncio
+async def test_errors_are_shared():
+    singleflight = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.01)
+        raise ValueError("Tika is down")
+
+    results = await asyncio.gather(*(singleflight.do("key", work) for _ in range(3)), return_exceptions=True)
+    assert all(isinstance(result, ValueError) for result in results)
+    # A failed call is not remembered
+    assert singleflight.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_does_not_cancel_shared_call():
+    singleflight = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.05)
+        return "result"
+
+    first = asyncio.create_task(singleflight.do("key", work))
+    await asyncio.sleep(0)
+    second = asyncio.create_task(singleflight.do("key", work))
+    await asyncio.sleep(0.01)
+    first.cancel()
+    assert await second == ("result", True)
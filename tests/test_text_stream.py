@@ -0,0 +1,52 @@
+import json
+import random
+import pytest
+from app.services.text_stream import TextTrimmer, TikaTextJsonStream
+
+
+def parse(response: str, chunk_size: int):
+    parser = TikaTextJsonStream()
+    pieces = []
+    for i in range(0, len(response), chunk_size):
+        pieces.extend(parser.feed(response[i:i + chunk_size]))
+    parser.close()
+    return "".join(pieces), parser.metadata
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 7, 64, 100000])
+@pytest.mark.parametrize("indent", [None, 2])
+def test_parse_chunked(chunk_size, indent):
+    text = 'Hallo "World"!\n\\ \t æøå \U0001F600 \\u0041 ", } '
+    document = {"Content-Type": "application/pdf", "X-TIKA:content": text, "pages": [1, {"a": "}\""}], "n": 2}
+    response = json.dumps(document, indent=indent)
+    assert parse(response, chunk_size) == (text, {"Content-Type": "application/pdf", "pages": [1, {"a": "}\""}], "n": 2})
+    # Escaped non-ASCII characters, with surrogate pairs, are decoded across chunks too
+    assert parse(json.dumps(document, ensure_ascii=True), chunk_size)[0] == text
+
+
+def test_parse_random_chunks():
+    characters = ['a', ' ', '"', '\\', '\n', 'æ', '\U0001F600', '}', ',']
+    rng = random.Random(0)
+    for _ in range(200):
+        text = "".join(rng.choice(characters) for _ in range(rng.randint(0, 50)))
+        response = json.dumps({"X-TIKA:content": text, "Content-Type": "text/plain"}, ensure_ascii=rng.random() < 0.5)
+        assert parse(response, rng.randint(1, 10)) == (text, {"Content-Type": "text/plain"})
+
+
+def test_parse_without_content():
+    assert parse('{"Content-Type": "application/pdf"}', 4) == ("", {"Content-Type": "application/pdf"})
+
+
+def test_parse_incomplete():
+    parser = TikaTextJsonStream()
+    parser.feed('{"X-TIKA:content": "Hallo')
+    with pytest.raises(ValueError):
+        parser.close()
+
+
+def test_trimmer():
+    trimmer = TextTrimmer()
+    pieces = ["  \n", " Hallo", " ", "\n", "World!  ", "\n\n", " "]
+    assert "".join(trimmer.feed(piece) for piece in pieces) == "".join(pieces).strip()
+    assert not trimmer.empty
+    assert TextTrimmer().feed("  ") == ""
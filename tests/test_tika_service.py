@@ -1,6 +1,17 @@
+import asyncio
+import gzip
+import io
 import pytest
-from app.services.tika import TikaService
+import httpx
+from pypdf import PdfReader
+from app.config import settings
+from app.services.tika import TikaService, request_timeout
+from app.services.cache import ExtractionCache, MemoryCache
+from app.services.singleflight import SingleFlight
+from app.services.backends import BackendPool, TikaBackend
+from app.services.routing import RoutingRule, RoutingTable
 from fastapi import HTTPException
+from tests.test_pdf import make_pdf
 import json
 
 # See https://unix.stackexchange.com/a/277967 for empty pdf content
@@ -24,9 +35,13 @@ pdf_mime_type = "application/pdf"
 docx_mime_type = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
 doc_mime_type = "application/msword"
 
+def mock_tika_service(handler) -> TikaService:
+    """TikaService whose HTTP client is served by the given handler instead of a Tika server"""
+    return TikaService(httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
 @pytest.fixture
 def tika_service():
-    return TikaService()
+    return mock_tika_service(lambda request: httpx.Response(200, text="Apache Tika 3.0.0"))
 
 @pytest.mark.parametrize(
     "file_content, expected_mime",
@@ -82,16 +97,13 @@ hello_world_doc_processed_text = 'Hello world!'
         (hello_world_doc_content, hello_world_doc_tika_resp, 'text', hello_world_doc_processed_text),
     ],
 )
-async def test_process_document(tika_service, mocker, file_content, tika_response, tika_resp_type, expected_out):
-    mock_response = mocker.MagicMock()
-    if tika_resp_type == 'json':
-        mock_response.json.return_value = tika_response
-    else:
-        mock_response.text = tika_response
-
-    # Patch 'requests.put' to return the mock response
-    mocker.patch("requests.put", return_value=mock_response)
+async def test_process_document(file_content, tika_response, tika_resp_type, expected_out):
+    def handler(request):
+        if tika_resp_type == 'json':
+            return httpx.Response(200, json=tika_response)
+        return httpx.Response(200, text=tika_response)
 
+    tika_service = mock_tika_service(handler)
     text, metadata = await tika_service.process_document(
         file_content
     )
@@ -99,15 +111,360 @@ async def test_process_document(tika_service, mocker, file_content, tika_respons
 
 
 @pytest.mark.asyncio
-async def test_process_document_error(tika_service, mocker):
-    mock_response = mocker.MagicMock()
-    mock_response.ok = False
-    mock_response.status_code = 500
-    mock_response.text = "Internal server error"
-
-    # Patch 'requests.put' to return the mock response
-    mocker.patch("requests.put", return_value=mock_response)
+async def test_process_document_error():
+    tika_service = mock_tika_service(lambda request: httpx.Response(500, text="Internal server error"))
 
     with pytest.raises(HTTPException) as exc_info:
         await tika_service.process_document(b"fake content")
     assert exc_info.value.status_code == 500
+
+
+@pytest.mark.asyncio
+async def test_is_available(tika_service):
+    assert await tika_service.is_available()
+
+
+@pytest.mark.asyncio
+async def test_is_not_available():
+    def handler(request):
+        raise httpx.ConnectError("Connection refused")
+
+    assert not await mock_tika_service(handler).is_available()
+
+
+@pytest.mark.asyncio
+async def test_process_stream():
+    def handler(request):
+        assert request.content == hello_world_pdf_content
+        return httpx.Response(200, json=hello_world_pdf_tika_resp)
+
+    async def body():
+        for i in range(0, len(hello_world_pdf_content), 100):
+            yield hello_world_pdf_content[i:i + 100]
+
+    tika_service = mock_tika_service(handler)
+    text, metadata = await tika_service.process_stream(hello_world_pdf_content[:100], body())
+    assert text == hello_world_pdf_processed_text
+
+
+@pytest.mark.asyncio
+async def test_process_stream_body_too_large():
+    async def handler(request):
+        await request.aread()
+        return httpx.Response(200, json=hello_world_pdf_tika_resp)
+
+    async def body():
+        yield hello_world_pdf_content[:100]
+        raise HTTPException(status_code=413, detail="Request body exceeds the limit")
+
+    tika_service = mock_tika_service(handler)
+    with pytest.raises(HTTPException) as exc_info:
+        await tika_service.process_stream(hello_world_pdf_content[:100], body())
+    assert exc_info.value.status_code == 413
+
+
+@pytest.mark.asyncio
+async def test_extract_cached():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(200, text=hello_world_docx_tika_resp)
+
+    cache = ExtractionCache(MemoryCache(max_entries=10, max_bytes=1024 * 1024, ttl=60))
+    tika_service = TikaService(httpx.AsyncClient(transport=httpx.MockTransport(handler)), cache)
+
+    first = await tika_service.extract(hello_world_docx_content, hello_world_docx_content, "first.docx")
+    second = await tika_service.extract(hello_world_docx_content, hello_world_docx_content, "second.docx")
+    assert len(calls) == 1
+    assert (first.cache, second.cache, second.cache_tier) == ("miss", "hit", "memory")
+    assert second.text == hello_world_docx_processed_text
+    assert second.metadata["X-Filename"] == "second.docx"
+
+
+@pytest.mark.asyncio
+async def test_extract_coalesced():
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        await asyncio.sleep(0.01)
+        return httpx.Response(200, text=hello_world_docx_tika_resp)
+
+    tika_service = TikaService(httpx.AsyncClient(transport=httpx.MockTransport(handler)), singleflight=SingleFlight())
+    extractions = await asyncio.gather(*(
+        tika_service.extract(hello_world_docx_content, hello_world_docx_content) for _ in range(3)
+    ))
+    assert len(calls) == 1
+    assert [extraction.text for extraction in extractions] == [hello_world_docx_processed_text] * 3
+    assert sum(extraction.coalesced for extraction in extractions) == 2
+
+
+@pytest.mark.asyncio
+async def test_process_document_retried_on_another_backend():
+    hosts = []
+
+    def handler(request):
+        hosts.append(request.url.host)
+        if request.url.host == "tika-1":
+            raise httpx.ConnectError("Connection refused")
+        return httpx.Response(200, json=hello_world_pdf_tika_resp)
+
+    backends = BackendPool([TikaBackend("http://tika-1", "tika-1"), TikaBackend("http://tika-2", "tika-2")])
+    tika_service = TikaService(httpx.AsyncClient(transport=httpx.MockTransport(handler)), backends=backends)
+    text, metadata = await tika_service.process_document(hello_world_pdf_content)
+    assert text == hello_world_pdf_processed_text
+    assert hosts == ["tika-1", "tika-2"]
+    assert backends.backends[0].consecutive_failures == 1
+
+
+@pytest.mark.asyncio
+async def test_process_document_retried_with_backoff(mocker):
+    sleep = mocker.patch("app.services.tika.asyncio.sleep")
+    responses = [httpx.Response(503, text="Busy"), httpx.Response(200, json=hello_world_pdf_tika_resp)]
+    tika_service = mock_tika_service(lambda request: responses.pop(0))
+    text, metadata = await tika_service.process_document(hello_world_pdf_content)
+    assert text == hello_world_pdf_processed_text
+    # The only backend is tried again after a jittered backoff
+    assert not responses
+    delay, = sleep.call_args.args
+    assert 0 <= delay <= settings.TIKA_RETRY_BACKOFF
+
+
+@pytest.mark.asyncio
+async def test_process_document_timeout_not_retried():
+    calls = []
+
+    def handler(request):
+        calls.append(request.extensions["timeout"]["read"])
+        raise httpx.ReadTimeout("Timed out")
+
+    with pytest.raises(HTTPException) as exc_info:
+        await mock_tika_service(handler).process_document(hello_world_pdf_content)
+    assert exc_info.value.status_code == 504
+    assert calls == [pytest.approx(settings.TIKA_READ_TIMEOUT, abs=0.1)]
+
+
+@pytest.mark.asyncio
+async def test_process_document_connection_error():
+    def handler(request):
+        raise httpx.ConnectError("Connection refused")
+
+    with pytest.raises(HTTPException) as exc_info:
+        await mock_tika_service(handler).process_document(hello_world_pdf_content)
+    assert exc_info.value.status_code == 503
+    assert "Retry-After" in exc_info.value.headers
+
+
+@pytest.mark.asyncio
+async def test_backend_answering_500_is_ejected():
+    backends = BackendPool([TikaBackend("http://tika-1", "tika-1")], failure_threshold=3, eject_seconds=30)
+    tika_service = TikaService(
+        httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(500, text="Broken"))),
+        backends=backends
+    )
+    for _ in range(3):
+        with pytest.raises(HTTPException) as exc_info:
+            await tika_service.process_document(hello_world_pdf_content)
+        assert exc_info.value.status_code == 500
+    assert backends.backends[0].ejected
+
+
+@pytest.mark.asyncio
+async def test_process_document_fails_fast_when_breaker_is_open():
+    calls = []
+    backends = BackendPool([TikaBackend("http://tika-1", "tika-1")], eject_seconds=30)
+    backends.failed(backends.backends[0], eject=True)
+    tika_service = TikaService(
+        httpx.AsyncClient(transport=httpx.MockTransport(lambda request: calls.append(request))), backends=backends
+    )
+    with pytest.raises(HTTPException) as exc_info:
+        await tika_service.process_document(hello_world_pdf_content)
+    assert exc_info.value.status_code == 503
+    assert int(exc_info.value.headers["Retry-After"]) == 30
+    assert not calls
+
+
+@pytest.mark.asyncio
+async def test_compressed_request_to_tika(mocker):
+    mocker.patch.multiple(settings, TIKA_COMPRESS_REQUESTS=True, TIKA_COMPRESS_MIN_BYTES=1024)
+    bodies = []
+
+    def handler(request):
+        bodies.append((request.headers.get("Content-Encoding"), request.content))
+        if request.url.path.endswith("/tika/text"):
+            return httpx.Response(200, json=hello_world_pdf_tika_resp)
+        return httpx.Response(200, text="<html><body><p>Hello</p></body></html>")
+
+    tika_service = mock_tika_service(handler)
+    text = b"Hello world! " * 1000
+    await tika_service.extract(text, text, provided_mime_type="text/plain")
+    await tika_service.extract(hello_world_pdf_content, hello_world_pdf_content, provided_mime_type=pdf_mime_type)
+    (encoding, body), (pdf_encoding, pdf_body) = bodies
+    assert encoding == "gzip" and gzip.decompress(body) == text
+    # PDFs are not worth compressing
+    assert pdf_encoding is None and pdf_body == hello_world_pdf_content
+
+
+def test_request_timeout_scaled_by_size(mocker):
+    mocker.patch.multiple(
+        settings, TIKA_READ_TIMEOUT=60, TIKA_READ_TIMEOUT_PER_MB=5, TIKA_WRITE_TIMEOUT=60,
+        TIKA_WRITE_TIMEOUT_PER_MB=1, TIKA_MAX_TIMEOUT=1800
+    )
+    assert request_timeout(0).read == 60
+    timeout = request_timeout(100 * 1024 * 1024)
+    assert (timeout.read, timeout.write) == (560, 160)
+    assert request_timeout(1024 * 1024 * 1024).read == 1800
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("converter", ["html2text", "xhtml"])
+async def test_extract_with_converter(converter):
+    tika_service = mock_tika_service(lambda request: httpx.Response(200, text=hello_world_doc_tika_resp))
+    extraction = await tika_service.extract(hello_world_doc_content, hello_world_doc_content, converter=converter)
+    assert extraction.text == hello_world_doc_processed_text
+
+
+@pytest.mark.asyncio
+async def test_extract_split_pdf(mocker):
+    mocker.patch.multiple(
+        settings, PDF_SPLIT_ENABLED=True, PDF_SPLIT_MIN_BYTES=0, PDF_SPLIT_MIN_PAGES=2, PDF_SPLIT_PAGES=2
+    )
+
+    def handler(request):
+        pages = len(PdfReader(io.BytesIO(request.content)).pages)
+        return httpx.Response(200, json={"Content-Type": pdf_mime_type, "X-TIKA:content": f"{pages} pages"})
+
+    tika_service = mock_tika_service(handler)
+    extraction = await tika_service.extract(make_pdf(5), make_pdf(5), provided_mime_type=pdf_mime_type)
+    assert extraction.text == "2 pages\n\n2 pages\n\n1 pages"
+    assert [(metadata["page_start"], metadata["page_end"]) for _, metadata in extraction.documents] == [
+        (1, 2), (3, 4), (5, 5)
+    ]
+    assert "page_start" not in extraction.metadata
+
+
+async def read_streamed(streamed):
+    try:
+        return "".join([text async for text in streamed.chunks])
+    finally:
+        await streamed.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "file_content, tika_response, tika_resp_type, expected_out",
+    [
+        (hello_world_pdf_content, hello_world_pdf_tika_resp, 'json', hello_world_pdf_processed_text),
+        (hello_world_docx_content, hello_world_docx_tika_resp, 'text', hello_world_docx_processed_text),
+        (hello_world_pdf_content, {"X-TIKA:content": " \n "}, 'json', "<No text content found>"),
+    ],
+)
+async def test_extract_streaming(file_content, tika_response, tika_resp_type, expected_out):
+    def handler(request):
+        if tika_resp_type == 'json':
+            return httpx.Response(200, json=tika_response)
+        return httpx.Response(200, text=tika_response)
+
+    tika_service = mock_tika_service(handler)
+    streamed = await tika_service.extract_streaming(file_content, file_content, "document")
+    assert await read_streamed(streamed) == expected_out
+    # The metadata is the same as of a buffered extraction once the text has been streamed
+    extraction = await tika_service.extract(file_content, file_content, "document")
+    assert streamed.metadata == extraction.metadata
+
+
+@pytest.mark.asyncio
+async def test_extract_streaming_error():
+    tika_service = mock_tika_service(lambda request: httpx.Response(422, text="Unprocessable"))
+
+    with pytest.raises(HTTPException) as exc_info:
+        await tika_service.extract_streaming(hello_world_pdf_content, hello_world_pdf_content)
+    assert exc_info.value.status_code == 422
+    assert tika_service.backends.backends[0].in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_extract_streaming_cached():
+    cache = ExtractionCache(MemoryCache(max_entries=10, max_bytes=1024 * 1024, ttl=60))
+    tika_service = TikaService(
+        httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200, text=hello_world_docx_tika_resp))),
+        cache
+    )
+    await tika_service.extract(hello_world_docx_content, hello_world_docx_content, converter="xhtml")
+    streamed = await tika_service.extract_streaming(hello_world_docx_content, hello_world_docx_content)
+    assert (streamed.cache, streamed.cache_tier) == ("hit", "memory")
+    assert await read_streamed(streamed) == hello_world_docx_processed_text
+
+
+def test_choose_rmeta_endpoint(tika_service, mocker):
+    mocker.patch.object(settings, "RMETA_ENABLED", True)
+    assert tika_service._choose_tika_endpoint("application/zip") == "rmeta"
+    assert tika_service._choose_tika_endpoint("message/rfc822") == "rmeta"
+    assert tika_service._choose_tika_endpoint("application/pdf") == "tika/text"
+
+
+@pytest.mark.asyncio
+async def test_extract_embedded_documents(mocker):
+    mocker.patch.object(settings, "RMETA_ENABLED", True)
+    paths = []
+
+    def handler(request):
+        paths.append(request.url.path)
+        return httpx.Response(200, json=[
+            {"Content-Type": "application/zip", "X-TIKA:content": "<html><body></body></html>"},
+            {
+                "Content-Type": "application/msword",
+                "X-TIKA:embedded_resource_path": "/hello.doc",
+                "X-TIKA:content": hello_world_doc_tika_resp
+            },
+            {"Content-Type": "image/png", "X-TIKA:embedded_resource_path": "/empty.png", "X-TIKA:content": ""},
+            {
+                "Content-Type": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                "X-TIKA:embedded_resource_path": "/hello.docx",
+                "X-TIKA:content": hello_world_docx_tika_resp
+            },
+        ])
+
+    tika_service = mock_tika_service(handler)
+    extraction = await tika_service.extract(b"PK\x03\x04", b"PK\x03\x04", "archive.zip", "application/zip")
+    assert paths == ["/rmeta"]
+    # The container is kept while embedded documents without text are left out
+    assert [text for text, _ in extraction.documents] == [
+        "", hello_world_doc_processed_text, hello_world_docx_processed_text
+    ]
+    assert [metadata.get("X-TIKA:embedded_resource_path") for _, metadata in extraction.documents] == [
+        None, "/hello.doc", "/hello.docx"
+    ]
+    assert all(metadata["X-Filename"] == "archive.zip" for _, metadata in extraction.documents)
+    assert extraction.metadata["Content-Type"] == "application/zip"
+
+
+@pytest.mark.asyncio
+async def test_extract_passthrough():
+    def handler(request):
+        raise AssertionError("Passthrough documents are not sent to Tika")
+
+    routing = RoutingTable([RoutingRule(mime_types=["text/*"], action="passthrough")])
+    tika_service = TikaService(httpx.AsyncClient(transport=httpx.MockTransport(handler)), routing=routing)
+    content = "  Blåbærgrød\n".encode("latin-1")
+    extraction = await tika_service.extract(content, content, "notes.txt", "text/plain; charset=latin-1")
+    assert extraction.text == "Blåbærgrød"
+    assert extraction.metadata == {"Content-Type": "text/plain; charset=latin-1", "X-Filename": "notes.txt"}
+
+
+@pytest.mark.asyncio
+async def test_extract_with_route_headers():
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, json=hello_world_pdf_tika_resp)
+
+    routing = RoutingTable([
+        RoutingRule(mime_types=["application/pdf"], endpoint="tika/text", headers={"X-Tika-PDFOcrStrategy": "no_ocr"})
+    ])
+    tika_service = TikaService(httpx.AsyncClient(transport=httpx.MockTransport(handler)), routing=routing)
+    extraction = await tika_service.extract(hello_world_pdf_content, hello_world_pdf_content)
+    assert extraction.text == hello_world_pdf_processed_text
+    assert requests[0].headers["X-Tika-PDFOcrStrategy"] == "no_ocr"